@@ -25,7 +25,7 @@ GIT_COMMAND="git --git-dir=$GIT_DIR --work-tree=$WORK_TREE"
 
 	echo " * collect static"
 	$APP_DIR/manage.py collectstatic --noinput
-	echo "HASHES = $( python $APP_DIR/manage.py static_hashes )" > $APP_DIR/hashes.py
+	python $APP_DIR/manage.py static_hashes --output=$APP_DIR/hashes.py --manifest=$APP_DIR/hashes.manifest.json
 
 	echo " * migrate"
 	$APP_DIR/manage.py migrate geography --delete-ghost-migrations --traceback
@@ -33,8 +33,8 @@ GIT_COMMAND="git --git-dir=$GIT_DIR --work-tree=$WORK_TREE"
 	$APP_DIR/manage.py sqlcustom geography | $APP_DIR/manage.py dbshell
 	echo " * derive knowledge data"
 	$APP_DIR/manage.py derived_knowledge_data
-	echo " * remove django cache"
-	rm -rf $DATA_DIR/.django_cache
+	echo " * clear django cache"
+	$APP_DIR/manage.py clear_cache
 
 
 ###############################################################################
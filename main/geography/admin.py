@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from models import Place, PlaceRelation, Answer, PriorSkill, CurrentSkill, Difficulty
+from models import Place, PlaceRelation, Answer, PriorSkill, CurrentSkill, Difficulty, MapSkillStats
 from django.contrib import admin
 from django.contrib.contenttypes.models import ContentType
 from django.http import HttpResponseRedirect
@@ -67,12 +67,31 @@ def pretty_date(time=False):
 # classes
 
 
-class PlaceAdmin(admin.ModelAdmin):
+class MapIndexAdmin(admin.ModelAdmin):
+
+    def save_model(self, request, obj, form, change):
+        admin.ModelAdmin.save_model(self, request, obj, form, change)
+        Place.objects.bump_map_index_version()
+
+    def save_related(self, request, form, formsets, change):
+        admin.ModelAdmin.save_related(self, request, form, formsets, change)
+        Place.objects.bump_map_index_version()
+        # the related places are saved after the object itself, so the
+        # statistics are rebuilt once when everything is stored
+        MapSkillStats.objects.rebuild()
+
+    def delete_model(self, request, obj):
+        admin.ModelAdmin.delete_model(self, request, obj)
+        Place.objects.bump_map_index_version()
+        MapSkillStats.objects.rebuild()
+
+
+class PlaceAdmin(MapIndexAdmin):
     list_display = ('code', 'text', 'option_a', 'option_b', 'option_c', 'correct')
     list_filter = ('type',)
 
 
-class PlaceRelationAdmin(admin.ModelAdmin):
+class PlaceRelationAdmin(MapIndexAdmin):
     list_display = ('place', 'type')
     list_filter = ('type',)
 
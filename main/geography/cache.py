@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from django.core.cache import get_cache
+from django.core.cache.backends.base import BaseCache
+import cPickle
+import logging
+import threading
+import time
+import uuid
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TwoTierCache(BaseCache):
+
+    """
+    Cache keeping recently used values in a bounded in-process LRU in front
+    of a shared cache, the LOCATION is the alias of the shared cache in
+    settings.CACHES. Values stay in the process for at most LOCAL_TIMEOUT
+    seconds and never longer than in the shared cache, so changes made by
+    other processes are visible after this time. Keys which are changed or
+    deleted by other processes and have to be visible at once (e.g. version
+    stamps) can be excluded from the process by SHARED_ONLY_PREFIXES.
+
+    All keys are put to a namespace whose version is stored in the shared
+    cache, clear() only starts a new namespace, so it is cheap and it is
+    visible to all processes sharing the cache.
+
+    Options:
+        LOCAL_MAX_ENTRIES: maximal number of values kept in the process
+        LOCAL_TIMEOUT: maximal number of seconds a value is kept in the process
+        SHARED_ONLY_PREFIXES: prefixes of keys which are always read from the
+            shared cache
+        STATS_EVERY: number of reads after which the counters are logged
+    """
+
+    NAMESPACE_KEY = 'two_tier_cache_namespace'
+
+    NAMESPACE_TIMEOUT = 365 * 24 * 60 * 60
+
+    def __init__(self, location, params):
+        BaseCache.__init__(self, params)
+        options = params.get('OPTIONS', {})
+        self._shared = get_cache(location)
+        self._local_max_entries = int(options.get('LOCAL_MAX_ENTRIES', 1000))
+        self._local_timeout = int(options.get('LOCAL_TIMEOUT', 60))
+        self._shared_only_prefixes = tuple(options.get('SHARED_ONLY_PREFIXES', ()))
+        self._stats_every = int(options.get('STATS_EVERY', 10000))
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._namespace = None
+        self.reset_stats()
+
+    def add(self, key, value, timeout=None, version=None):
+        local = self._is_local(key)
+        key = self._make_namespaced_key(key, version)
+        timeout = self._get_timeout(timeout)
+        expires = time.time() + timeout
+        if not self._shared.add(key, (expires, value), timeout):
+            return False
+        if local:
+            self._set_local(key, value, expires)
+        return True
+
+    def get(self, key, default=None, version=None):
+        local = self._is_local(key)
+        key = self._make_namespaced_key(key, version)
+        if local:
+            found, value = self._get_local(key)
+            if found:
+                self._count('local_hits')
+                return value
+        # the shared entries carry their expiration, so the value is not kept
+        # in the process longer than in the shared cache
+        entry = self._shared.get(key)
+        if entry is None or entry[0] <= time.time():
+            self._count('misses')
+            return default
+        self._count('shared_hits')
+        expires, value = entry
+        if local:
+            self._set_local(key, value, expires)
+        return value
+
+    def set(self, key, value, timeout=None, version=None):
+        local = self._is_local(key)
+        key = self._make_namespaced_key(key, version)
+        timeout = self._get_timeout(timeout)
+        expires = time.time() + timeout
+        self._shared.set(key, (expires, value), timeout)
+        if local:
+            self._set_local(key, value, expires)
+
+    def delete(self, key, version=None):
+        key = self._make_namespaced_key(key, version)
+        self._shared.delete(key)
+        with self._lock:
+            self._local.pop(key, None)
+
+    def clear(self):
+        namespace = uuid.uuid4().hex
+        self._shared.set(TwoTierCache.NAMESPACE_KEY, namespace, TwoTierCache.NAMESPACE_TIMEOUT)
+        with self._lock:
+            self._local.clear()
+            self._namespace = (time.time(), namespace)
+
+    def stats(self):
+        """
+        Returns the numbers of reads served from the process, from the shared
+        cache and the numbers of misses since the last reset.
+        """
+        return dict(self._stats)
+
+    def reset_stats(self):
+        self._stats = {
+            'local_hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+        }
+
+    def _count(self, name):
+        self._stats[name] += 1
+        reads = sum(self._stats.values())
+        if reads % self._stats_every == 0:
+            LOGGER.info('two tier cache, reads: %s, stats: %s, local entries: %s', reads, self._stats, len(self._local))
+
+    def _get_timeout(self, timeout):
+        return self.default_timeout if timeout is None else timeout
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._local.pop(key, None)
+            if entry is None:
+                return (False, None)
+            expires, pickled = entry
+            if expires < time.time():
+                return (False, None)
+            # move the key to the end as the most recently used
+            self._local[key] = entry
+        return (True, cPickle.loads(pickled))
+
+    def _is_local(self, key):
+        return not key.startswith(self._shared_only_prefixes)
+
+    def _set_local(self, key, value, expires):
+        expires = min(expires, time.time() + self._local_timeout)
+        # values are pickled, so callers can't change the cached objects
+        entry = (expires, cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._local.pop(key, None)
+            self._local[key] = entry
+            while len(self._local) > self._local_max_entries:
+                self._local.popitem(last=False)
+
+    def _get_namespace(self):
+        namespace = self._namespace
+        if namespace is not None and namespace[0] > time.time() - self._local_timeout:
+            return namespace[1]
+        value = self._shared.get(TwoTierCache.NAMESPACE_KEY)
+        if value is None:
+            self._shared.add(TwoTierCache.NAMESPACE_KEY, uuid.uuid4().hex, TwoTierCache.NAMESPACE_TIMEOUT)
+            value = self._shared.get(TwoTierCache.NAMESPACE_KEY)
+        if namespace is not None and namespace[1] != value:
+            with self._lock:
+                self._local.clear()
+        self._namespace = (time.time(), value)
+        return value
+
+    def _make_namespaced_key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._get_namespace() + ':' + key
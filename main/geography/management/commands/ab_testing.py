@@ -1,11 +1,9 @@
 # -*- coding: utf-8 -*-
 from django.core.management.base import BaseCommand, CommandError
-from geography.models import Group
+from geography.models import Group, ValueStats
 from optparse import make_option
 from prettytable import PrettyTable
-from django.db import connection
-from geography.utils.db import dump_cursor
-from contextlib import closing
+from geography.utils.db import dump_query_by_id
 
 
 class Command(BaseCommand):
@@ -31,6 +29,22 @@ class Command(BaseCommand):
             dest='min_answers',
             help='minimum number of answers of user allowed to be in A/B testing group',
         ),
+        make_option(
+            '--since-id',
+            type='int',
+            action='store',
+            dest='since_id',
+            default=0,
+            help='export only answers with greater id',
+        ),
+        make_option(
+            '--chunk-size',
+            type='int',
+            action='store',
+            dest='chunk_size',
+            default=10000,
+            help='number of answers read by one query during export',
+        ),
     )
 
     args = '<command> [command arguments]'
@@ -45,6 +59,7 @@ class Command(BaseCommand):
         * export-answers
         * init
         * overview
+        * stats
         * stats-user
         * stats-answer
 
@@ -69,6 +84,8 @@ class Command(BaseCommand):
             return self.init(command_args, options)
         elif command == 'overview':
             return self.overview(command_args, options)
+        elif command == 'stats':
+            return self.stats(command_args, options)
         elif command == 'stats-user':
             return self.stats_user(command_args, options)
         elif command == 'stats-answer':
@@ -92,34 +109,37 @@ class Command(BaseCommand):
         group_name = args[0]
         dest_file = args[1]
         print 'exporting answers with group ' + group_name + ' to file ' + dest_file
-        with closing(connection.cursor()) as cursor:
-            cursor.execute(
-                '''
-                SELECT
-                    geography_answer.*,
-                    geography_ab_value.value AS ab_value
-                FROM
-                    geography_answer
-                    LEFT JOIN geography_answer_ab_values ON
-                        geography_answer_ab_values.answer_id = geography_answer.id
-                    LEFT JOIN geography_ab_value ON
-                        geography_ab_value.id = geography_answer_ab_values.value_id
-                    LEFT JOIN geography_ab_group ON
-                        geography_ab_group.id = geography_ab_value.group_id
-                WHERE
-                    geography_ab_group.name = %s OR ISNULL(geography_ab_group.name)
-                GROUP BY
-                    geography_answer.id
-                ''', [group_name])
-            field_mapping = {
-                'answer_id': 'answer',
-                'place_asked_id': 'place_asked',
-                'place_answered_id': 'place_answered',
-                'user_id': 'user'}
-            dump_cursor(
-                cursor,
-                dest_file,
-                **field_mapping)
+        field_mapping = {
+            'answer_id': 'answer',
+            'place_asked_id': 'place_asked',
+            'place_answered_id': 'place_answered',
+            'user_id': 'user'}
+        rows_num, last_id = dump_query_by_id(
+            '''
+            SELECT
+                geography_answer.*,
+                geography_ab_value.value AS ab_value
+            FROM
+                geography_answer
+                LEFT JOIN geography_answer_ab_values ON
+                    geography_answer_ab_values.answer_id = geography_answer.id
+                LEFT JOIN geography_ab_value ON
+                    geography_ab_value.id = geography_answer_ab_values.value_id
+                LEFT JOIN geography_ab_group ON
+                    geography_ab_group.id = geography_ab_value.group_id
+            WHERE
+                geography_answer.id > %s
+                AND (geography_ab_group.name = %s OR ISNULL(geography_ab_group.name))
+            GROUP BY
+                geography_answer.id
+            ''',
+            dest_file,
+            id_column='geography_answer.id',
+            params=[group_name],
+            since_id=options['since_id'],
+            chunk_size=options['chunk_size'],
+            **field_mapping)
+        print 'exported answers: {0}, last id: {1}'.format(rows_num, last_id)
 
     def init(self, args, options):
         if options.get('command_help', False):
@@ -151,6 +171,26 @@ class Command(BaseCommand):
             table.add_row([g.name, g.active])
         print table
 
+    def stats(self, args, options):
+        if options.get('command_help', False):
+            print self.help_stats()
+            return
+        group_name = args[0]
+        table = PrettyTable([
+            'Value', 'Number of users', 'Number of answers', 'Success rate',
+            '95% confidence interval', 'Average response time'])
+        table.align['Value'] = 'l'
+        for s in ValueStats.objects.for_group(group_name):
+            interval = s.success_rate_interval()
+            table.add_row([
+                s.value.value,
+                s.users_num,
+                s.answers_num,
+                '-' if interval is None else '{0:.3f}'.format(s.success_rate()),
+                '-' if interval is None else '{0:.3f} - {1:.3f}'.format(*interval),
+                '-' if interval is None else '{0:.0f} ms'.format(s.avg_response_time())])
+        print table
+
     def stats_user(self, args, options):
         if options.get('command_help', False):
             print self.help_stats_user()
@@ -186,7 +226,7 @@ class Command(BaseCommand):
         return '''
     exports answers together with the value for the given A/B testing group
 
-        ./manage.py ab_testing export-answers <group name> <dest file>
+        ./manage.py ab_testing export-answers <group name> <dest file> [--since-id=<answer id>]
                 '''
 
     def help_init(self):
@@ -196,6 +236,15 @@ class Command(BaseCommand):
         ./manage.py ab_testing init <group name>=<default value> [<value>=<percentige>]
                 '''
 
+    def help_stats(self):
+        return '''
+    show numbers of users and answers, success rate with its confidence
+    interval and average response time for the values of the given group,
+    answers are counted for the values they have been recorded with
+
+        ./manage.py ab_testing stats <group name>
+                '''
+
     def help_stats_user(self):
         return '''
     show number of users for the values of the given group
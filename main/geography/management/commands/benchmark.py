@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connection
+from geography.models import Place, PlaceRelation, DatabaseEnvironment, RequestEnvironment
+from geography.models.place import PlaceManager
+from geography.models import recommendation as vectorized_recommendation
+from proso.geography import recommendation
+from optparse import make_option
+from prettytable import PrettyTable
+import time
+
+
+class FixedABEnvironment:
+
+    def __init__(self, values):
+        self._values = values
+
+    def get_membership(self, ab_values, default_value, reason):
+        for v in self._values:
+            if v in ab_values:
+                return v
+        return default_value
+
+    def get_affecting_values(self, reason):
+        return []
+
+
+class Command(BaseCommand):
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--command-help',
+            action='store_true',
+            dest='command_help',
+            help='shows helps for the given command',
+        ),
+        make_option(
+            '--repeat',
+            type='int',
+            action='store',
+            dest='repeat',
+            default=10,
+            help='number of repetitions of the measured code',
+        ),
+    )
+
+    args = '<command> [command arguments]'
+
+    help = '''
+    ----------------------------------------------------------------------------
+    command for measuring performance of the application
+
+    the following subcommands are available
+        * queries
+        * recommendation
+
+    to print more help use the following command:
+
+        ./manage.py benchmark <command> --comand-help
+    ----------------------------------------------------------------------------
+            '''
+
+    def handle(self, *args, **options):
+        if not len(args):
+            raise CommandError(Command.help)
+        command = args[0]
+        command_args = args[1:]
+        if command == 'queries':
+            return self.queries(command_args, options)
+        elif command == 'recommendation':
+            return self.recommendation(command_args, options)
+        else:
+            raise CommandError('unknow command: ' + command)
+
+    def queries(self, args, options):
+        if options.get('command_help', False):
+            print self.help_queries()
+            return
+        if len(args) < 1:
+            raise CommandError(self.help_queries())
+        map_place = PlaceRelation.objects.get(
+            place__code=args[0],
+            type=PlaceRelation.IS_ON_MAP)
+        user = self.get_user(args[1] if len(args) > 1 else None)
+        place_types = [t[0] for t in Place.PLACE_TYPES]
+        environments = [
+            ('DatabaseEnvironment', lambda: DatabaseEnvironment()),
+            ('RequestEnvironment', lambda: RequestEnvironment(user.id)),
+        ]
+        table = PrettyTable(['Environment', 'Options strategy', 'Queries per request', 'Time per request [ms]'])
+        table.align['Environment'] = 'l'
+        table.align['Options strategy'] = 'l'
+        for options_strategy in sorted(PlaceManager.OPTIONS_STRATEGIES.keys()):
+            ab_env = FixedABEnvironment([options_strategy])
+            for name, create_env in environments:
+                num_queries, secs = self.measure(
+                    lambda: Place.objects.get_places_to_ask(
+                        user, map_place, 10, place_types, create_env(), ab_env),
+                    options['repeat'])
+                table.add_row([name, options_strategy, num_queries, round(1000 * secs, 2)])
+        print table
+
+    def recommendation(self, args, options):
+        if options.get('command_help', False):
+            print self.help_recommendation()
+            return
+        if len(args) < 1:
+            raise CommandError(self.help_recommendation())
+        map_place = PlaceRelation.objects.get(
+            place__code=args[0],
+            type=PlaceRelation.IS_ON_MAP)
+        user = self.get_user(args[1] if len(args) > 1 else None)
+        place_ids = sorted(map_place.related_places.values_list('id', flat=True))
+        env = RequestEnvironment(user.id)
+        env.preload(place_ids)
+        strategies = [
+            ('proso.geography.recommendation', recommendation.by_additive_function),
+            ('geography.models.recommendation', vectorized_recommendation.by_additive_function),
+        ]
+        table = PrettyTable(['Implementation', 'Places', 'Time per request [ms]', 'Targets'])
+        table.align['Implementation'] = 'l'
+        for name, strategy in strategies:
+            targets = [t for (t, o) in strategy(user.id, place_ids, env, 10, recommendation.OPTIONS_RANDOM)]
+            num_queries, secs = self.measure(
+                lambda: strategy(user.id, place_ids, env, 10, recommendation.OPTIONS_RANDOM),
+                options['repeat'])
+            table.add_row([name, len(place_ids), round(1000 * secs, 2), ' '.join(map(str, targets))])
+        print table
+
+    def measure(self, fun, repeat):
+        use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        try:
+            queries_before = len(connection.queries)
+            time_before = time.time()
+            for i in range(repeat):
+                fun()
+            secs = time.time() - time_before
+            num_queries = len(connection.queries) - queries_before
+        finally:
+            connection.use_debug_cursor = use_debug_cursor
+        return (num_queries / float(repeat), secs / repeat)
+
+    def get_user(self, username):
+        if username:
+            return User.objects.get(username=username)
+        return User.objects.order_by('id')[0]
+
+    def help_queries(self):
+        return '''
+    compare number of database queries needed for choosing the questions
+    in the question view when using the given knowledge environments
+
+        ./manage.py benchmark queries <map code> [<username>] [--repeat <n>]
+                '''
+
+    def help_recommendation(self):
+        return '''
+    compare the time needed for choosing the questions by the additive
+    function from the proso library and by its vectorized version, all
+    places on the map are candidates and knowledge is preloaded
+
+        ./manage.py benchmark recommendation <map code> [<username>] [--repeat <n>]
+                '''
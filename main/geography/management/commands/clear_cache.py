@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = u'''Invalidate all values in the cache used by the application'''
+
+    def handle(self, *args, **options):
+        if len(args) > 0:
+            raise CommandError('The command doesn\'t need any argument.')
+        cache.clear()
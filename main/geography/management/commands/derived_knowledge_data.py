@@ -1,93 +1,244 @@
 # -*- coding: utf-8 -*-
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.db import connection
-from geography.models import KnowledgeUpdater, InMemoryEnvironmentWithFlush
-from geography.models.utils import fetchone
 from contextlib import closing
+from django.db import connection, transaction
+from geography.models import KnowledgeUpdater, InMemoryEnvironmentWithFlush, MapSkillStats
+from geography.utils.answerlog import AnswerLog
+from geography.utils.db import streaming_cursor, iterate_cursor
+from optparse import make_option
+import cPickle
+import itertools
+import datetime
+import os
 import time
 import sys
 
 
 class Command(BaseCommand):
-    help = u'''Recompute derived data'''
+    help = u'''Recompute derived data. The statements storing the data are
+    printed, with --execute they are executed and the checkpoint for the
+    next --incremental run is saved afterwards. The incremental mode upserts
+    values computed from the answers up to the start of the command, so it
+    can overwrite a value updated by a newer answer in the meantime; the value
+    is corrected by the next run.'''
+
+    FETCH_SIZE = 10000
+
+    REPORT_EVERY = 100000
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--incremental',
+            action='store_true',
+            dest='incremental',
+            default=False,
+            help='replay only answers newer than the checkpoint and update only the changed values',
+        ),
+        make_option(
+            '--execute',
+            action='store_true',
+            dest='execute',
+            default=False,
+            help='execute the statements instead of only printing them, the checkpoint is saved only when they are committed',
+        ),
+        make_option(
+            '--checkpoint',
+            action='store',
+            dest='checkpoint',
+            default=os.path.join(settings.MEDIA_ROOT, 'derived_knowledge_data.checkpoint'),
+            help='file with the id of the last processed answer and the state of the environment',
+        ),
+        make_option(
+            '--batch-size',
+            type='int',
+            action='store',
+            dest='batch_size',
+            default=InMemoryEnvironmentWithFlush.flush_batch_size,
+            help='maximal number of rows inserted by one statement',
+        ),
+        make_option(
+            '--answer-log',
+            action='store',
+            dest='answer_log',
+            default=None,
+            help='directory of the answer log (see update_answer_log) to read answers from, answers newer than the log are read from the database',
+        ),
+    )
 
     def handle(self, *args, **options):
         if len(args) > 0:
-            raise CommandError('The command doesn\'t need any option.')
-        self.load_derived_data()
+            raise CommandError('The command doesn\'t need any argument.')
+        self.answer_log = AnswerLog(options['answer_log']) if options['answer_log'] else None
+        time_start = time.time()
+        if options['incremental']:
+            if not os.path.exists(options['checkpoint']):
+                raise CommandError(
+                    'There is no checkpoint "' + options['checkpoint'] +
+                    '", run the command without --incremental first.')
+            sys.stderr.write('loading checkpoint\n')
+            with open(options['checkpoint'], 'rb') as f:
+                checkpoint = cPickle.load(f)
+            env = checkpoint['environment']
+            last_answer_id = self.load_derived_data(env, checkpoint['last_answer_id'])
+        else:
+            env = InMemoryEnvironmentWithFlush()
+            last_answer_id = self.load_derived_data(env)
+        time_after_knowledge = time.time()
+        env.flush_batch_size = options['batch_size']
+        statements = self.statements(env, options)
+        # current skills are changed in bulk, the statistics are replaced by
+        # DDL statements which commit implicitly, so they can't be executed
+        # in the same transaction
+        rebuild = [] if options['incremental'] else MapSkillStats.objects.rebuild_sql()
+        if options['execute']:
+            sys.stderr.write('flushing knowledge data to database\n')
+            self.apply(statements)
+            if rebuild:
+                sys.stderr.write('rebuilding map skill statistics\n')
+                self.execute(rebuild)
+                transaction.commit_unless_managed()
+            sys.stderr.write('time: ' + str(time.time() - time_after_knowledge) + ' secs\n')
+            # the checkpoint has to correspond to the data in the database
+            sys.stderr.write('saving checkpoint\n')
+            env.reset_changes()
+            self.save_checkpoint(options['checkpoint'], env, last_answer_id)
+        else:
+            for sql in itertools.chain(statements, rebuild):
+                print sql
+            sys.stderr.write('time: ' + str(time.time() - time_after_knowledge) + ' secs\n')
+            sys.stderr.write('the statements are not executed, the checkpoint is not saved\n')
+        sys.stderr.write('total time: ' + str(time.time() - time_start) + ' secs\n')
 
-    def load_derived_data(self):
-        with closing(connection.cursor()) as cursor_answers:
-            with closing(connection.cursor()) as cursor_options:
-                # foreach answer update new datasets
-                time_start = time.time()
-                sys.stderr.write('loading options\n')
-                cursor_options.execute(
-                    '''
-                    SELECT
-                        answer_id,
-                        place_id
-                    FROM geography_answer_options
-                    ORDER BY answer_id
-                    ''')
-                row = cursor_options.fetchone()
-                current_options = []
-                last_options = None
-                current_answer = -1
-                last_answer = None
-                sys.stderr.write('loading answers\n')
-                cursor_answers.execute(
-                    '''
-                    SELECT
-                        id,
-                        user_id AS user,
-                        place_asked_id AS place_asked,
-                        place_answered_id AS place_answered,
-                        place_map_id AS place_map,
-                        inserted,
-                        response_time,
-                        number_of_options,
-                        type
-                    FROM geography_answer
-                    ORDER BY id
-                    ''')
+    def statements(self, env, options):
+        if options['incremental']:
+            # values are upserted, so unique checks can't be disabled
+            yield 'SET foreign_key_checks=0;'
+            sys.stderr.write('flushing changed knowledge data\n')
+            # the numbers of learned places are updated by the difference
+            # between the stored and the new current skills, so before the
+            # current skills are stored
+            for sql in MapSkillStats.objects.update_sql(env.changed_current_skills(), options['batch_size']):
+                yield sql
+            for sql in env.flush_changed():
+                yield sql
+            yield 'SET foreign_key_checks=1;'
+        else:
+            yield 'SET foreign_key_checks=0;'
+            yield 'SET unique_checks=0;'
+            # empty precomputed datasets
+            sys.stderr.write('deleting old knowledge data\n')
+            yield 'DELETE FROM geography_difficulty;'
+            yield 'DELETE FROM geography_priorskill;'
+            yield 'DELETE FROM geography_currentskill;'
+            # save new precomputed datasets
+            sys.stderr.write('flushing knowledge data\n')
+            for sql in env.flush():
+                yield sql
+            yield 'SET foreign_key_checks=1;'
+            yield 'SET unique_checks=1;'
 
-                time_after_loading = time.time()
-                sys.stderr.write('time: ' + str(time_after_loading - time_start) + ' secs\n')
-                sys.stderr.write('computing knowledge data in memory\n')
-                answer = fetchone(cursor_answers)
-                env = InMemoryEnvironmentWithFlush()
-                stream = KnowledgeUpdater(env)
-                while answer:
-                    while current_answer <= answer['id'] and row:
-                        current_options.append(row[1])
-                        row = cursor_options.fetchone()
-                        if not row or row[0] != current_answer:
-                            last_answer = current_answer
-                            last_options = current_options
-                            current_answer = row[0] if row else None
-                            current_options = []
-                    if last_answer == answer['id']:
-                        answer['options'] = last_options
-                    else:
-                        answer['options'] = []
-                    stream.stream_answer(answer)
-                    answer = fetchone(cursor_answers)
-                time_after_knowledge = time.time()
-                sys.stderr.write('time: ' + str(time_after_knowledge - time_after_loading) + ' secs\n')
-        # empty precomputed datasets
-        print 'SET foreign_key_checks=0;'
-        print 'SET unique_checks=0;'
-        sys.stderr.write('deleting old knowledge data from database\n')
-        print 'DELETE FROM geography_difficulty;'
-        print 'DELETE FROM geography_priorskill;'
-        print 'DELETE FROM geography_currentskill;'
-        time_after_delete = time.time()
-        sys.stderr.write('time: ' + str(time_after_delete - time_after_knowledge) + ' secs\n')
-        # save new precomputed datasets
-        sys.stderr.write('flushing knowledge data to database\n')
-        print env.flush()
-        print 'SET foreign_key_checks=1;'
-        print 'SET unique_checks=1;'
-        sys.stderr.write('time: ' + str(time.time() - time_after_delete) + ' secs\n')
-        sys.stderr.write('total time: ' + str(time.time() - time_start) + ' secs\n')
+    def apply(self, statements):
+        """
+        Executes the given statements in one transaction, the executed
+        statements are printed as well.
+        """
+        with transaction.commit_on_success():
+            self.execute(statements)
+
+    def execute(self, statements):
+        with closing(connection.cursor()) as cursor:
+            for sql in statements:
+                print sql
+                cursor.execute(sql)
+
+    def save_checkpoint(self, checkpoint_file, env, last_answer_id):
+        checkpoint = {
+            'last_answer_id': last_answer_id,
+            'environment': env,
+        }
+        with open(checkpoint_file + '.tmp', 'wb') as f:
+            cPickle.dump(checkpoint, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(checkpoint_file + '.tmp', checkpoint_file)
+
+    def load_derived_data(self, env, last_answer_id=0):
+        sys.stderr.write('computing knowledge data in memory\n')
+        return self.replay(KnowledgeUpdater(env).stream_answer, last_answer_id)
+
+    def replay(self, process, last_answer_id=0):
+        """
+        Calls the given function for each answer newer than the given one and
+        returns the id of the last processed answer. Answers inserted in the
+        last AnswerLog.SETTLE_SECONDS and all the following ones are left for
+        the next run, so answers committed out of the order of their ids are
+        not skipped.
+        """
+        # answers are streamed from the database together with their options,
+        # so the memory needed doesn't depend on the number of answers
+        time_start = time.time()
+        settled = datetime.datetime.now() - datetime.timedelta(seconds=AnswerLog.SETTLE_SECONDS)
+        answers_num = 0
+        if self.answer_log is not None and self.answer_log.last_id > last_answer_id:
+            sys.stderr.write('reading answers from the answer log\n')
+            for answer in self.answer_log.iterate(last_answer_id):
+                process(answer)
+                answers_num += 1
+                if answers_num % self.REPORT_EVERY == 0:
+                    self.report_throughput(answers_num, time_start)
+            last_answer_id = self.answer_log.last_id
+        with streaming_cursor() as cursor:
+            cursor.execute(
+                '''
+                SELECT
+                    geography_answer.id,
+                    geography_answer.user_id,
+                    geography_answer.place_asked_id,
+                    geography_answer.place_answered_id,
+                    geography_answer.place_map_id,
+                    geography_answer.inserted,
+                    geography_answer.response_time,
+                    geography_answer.number_of_options,
+                    geography_answer.type,
+                    geography_answer_options.place_id
+                FROM geography_answer
+                LEFT JOIN geography_answer_options
+                    ON geography_answer_options.answer_id = geography_answer.id
+                WHERE geography_answer.id > %s
+                ORDER BY geography_answer.id
+                ''', [last_answer_id])
+            answer = None
+            for row in iterate_cursor(cursor, self.FETCH_SIZE):
+                if answer is None or answer['id'] != row[0]:
+                    if row[5] >= settled:
+                        break
+                    if answer is not None:
+                        process(answer)
+                        answers_num += 1
+                        if answers_num % self.REPORT_EVERY == 0:
+                            self.report_throughput(answers_num, time_start)
+                    answer = {
+                        'id': row[0],
+                        'user': row[1],
+                        'place_asked': row[2],
+                        'place_answered': row[3],
+                        'place_map': row[4],
+                        'inserted': row[5],
+                        'response_time': row[6],
+                        'number_of_options': row[7],
+                        'type': row[8],
+                        'options': [],
+                    }
+                if row[9] is not None:
+                    answer['options'].append(row[9])
+            if answer is not None:
+                process(answer)
+                answers_num += 1
+                last_answer_id = answer['id']
+        sys.stderr.write('processed answers: ' + str(answers_num) + '\n')
+        self.report_throughput(answers_num, time_start)
+        return last_answer_id
+
+    def report_throughput(self, answers_num, time_start):
+        secs = time.time() - time_start
+        sys.stderr.write('time: {0:.1f} secs, {1:.0f} answers/sec\n'.format(
+            secs, answers_num / secs if secs > 0 else 0))
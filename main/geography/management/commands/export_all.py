@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from geography.management.commands.table2csv import ALLOWED_TABLES, FIELD_MAPPING
+from geography.utils.archive import open_archive, EXTENSIONS, FORMATS
+from geography.utils.db import write_query_by_id
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+import os
+import time
+import sys
+
+
+class Command(BaseCommand):
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--workers',
+            type='int',
+            action='store',
+            dest='workers',
+            default=4,
+            help='number of tables exported at the same time',
+        ),
+        make_option(
+            '--format',
+            type='choice',
+            choices=FORMATS,
+            action='store',
+            dest='format',
+            default='zip',
+            help='format of the archives: ' + ', '.join(FORMATS),
+        ),
+        make_option(
+            '--dest-dir',
+            action='store',
+            dest='dest_dir',
+            default=settings.MEDIA_ROOT,
+            help='directory the archives are put to',
+        ),
+        make_option(
+            '--chunk-size',
+            type='int',
+            action='store',
+            dest='chunk_size',
+            default=10000,
+            help='number of rows read by one query',
+        ),
+    )
+
+    args = '[<table name> ...]'
+
+    help = u'''Export tables to compressed CSV files "geography.<model>.zip"
+    (or "geography.<model>.csv.gz" with --format=gzip) which are served by
+    csv_view. All supported tables are exported when no table is given. Each
+    archive replaces the old one only after it is complete.'''
+
+    def handle(self, *args, **options):
+        for table_name in args:
+            if table_name not in ALLOWED_TABLES:
+                raise CommandError('table ' + table_name + ' is not supported')
+        table_names = args if len(args) > 0 else ALLOWED_TABLES
+        time_start = time.time()
+        pool = ThreadPool(options['workers'])
+        try:
+            for table_name, rows_num in pool.imap_unordered(
+                    lambda table_name: (table_name, self.export(table_name, options)),
+                    table_names):
+                sys.stderr.write('exported {0}, rows: {1}\n'.format(table_name, rows_num))
+        finally:
+            pool.close()
+            pool.join()
+        sys.stderr.write('total time: ' + str(time.time() - time_start) + ' secs\n')
+
+    def export(self, table_name, options):
+        # the files are named after the models as before
+        name = table_name.replace('geography_', 'geography.', 1)
+        dest_file = os.path.join(options['dest_dir'], name + EXTENSIONS[options['format']])
+        tmp_file = dest_file + '.tmp'
+        try:
+            with open(tmp_file, 'wb') as f:
+                archive = open_archive(f, name + '.csv', options['format'])
+                rows_num, last_id = write_query_by_id(
+                    'SELECT * FROM ' + table_name + ' WHERE id > %s',
+                    archive,
+                    chunk_size=options['chunk_size'],
+                    label='dumped rows of ' + table_name,
+                    **FIELD_MAPPING)
+                archive.close()
+            # the web server keeps serving the old file until this moment
+            os.rename(tmp_file, dest_file)
+            return rows_num
+        except:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+        finally:
+            # each thread has its own database connection
+            connection.close()
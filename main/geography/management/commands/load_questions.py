@@ -1,5 +1,5 @@
 from django.core.management.base import BaseCommand, CommandError
-from geography.models import Place, PlaceRelation
+from geography.models import MapSkillStats, Place, PlaceRelation
 import json
 
 
@@ -38,6 +38,8 @@ class Command(BaseCommand):
             p = self.save_place(d)
             map.related_places.add(p)
         map.save()
+        Place.objects.bump_map_index_version()
+        MapSkillStats.objects.rebuild()
 
     def save_place(self, d):
         options = {
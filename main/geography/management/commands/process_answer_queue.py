@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from geography.models import AnswerQueue
+from multiprocessing import Process
+from optparse import make_option
+import logging
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--workers',
+            type='int',
+            action='store',
+            dest='workers',
+            default=1,
+            help='number of worker processes, answers are partitioned among them by user',
+        ),
+        make_option(
+            '--worker',
+            type='int',
+            action='store',
+            dest='worker',
+            default=None,
+            help='run only the given worker (0 <= worker < workers) in this process',
+        ),
+        make_option(
+            '--batch-size',
+            type='int',
+            action='store',
+            dest='batch_size',
+            default=100,
+            help='number of answers fetched from the queue at once',
+        ),
+        make_option(
+            '--sleep',
+            type='float',
+            action='store',
+            dest='sleep',
+            default=1.0,
+            help='number of seconds to wait when the queue is empty',
+        ),
+        make_option(
+            '--once',
+            action='store_true',
+            dest='once',
+            default=False,
+            help='exit when the queue is empty',
+        ),
+        make_option(
+            '--lag',
+            action='store_true',
+            dest='lag',
+            default=False,
+            help='print the number of queued answers, the age of the oldest one and the number of failed answers and exit',
+        ),
+    )
+
+    help = u'''Apply knowledge updates for the answers in the answer queue'''
+
+    def handle(self, *args, **options):
+        if len(args) > 0:
+            raise CommandError('The command doesn\'t need any argument.')
+        if options['lag']:
+            size, lag = AnswerQueue.objects.lag()
+            print 'queued answers: {0}, lag: {1:.1f} secs, failed answers: {2}'.format(
+                size, lag, AnswerQueue.objects.failed())
+            return
+        workers = options['workers']
+        if options['worker'] is not None:
+            if not 0 <= options['worker'] < workers:
+                raise CommandError('The worker has to be between 0 and {0}.'.format(workers - 1))
+            return self.work(options['worker'], workers, options)
+        if workers == 1:
+            return self.work(0, 1, options)
+        # each process has to open its own database connection
+        connection.close()
+        processes = [
+            Process(target=self.work, args=(worker, workers, options))
+            for worker in range(workers)
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+
+    def work(self, worker, workers, options):
+        while True:
+            processed = AnswerQueue.objects.process(worker, workers, options['batch_size'])
+            if processed > 0:
+                size, lag = AnswerQueue.objects.lag()
+                LOGGER.info(
+                    'answer queue worker %s/%s processed %s answers, queued answers: %s, lag: %.1f secs',
+                    worker, workers, processed, size, lag)
+            elif options['once']:
+                return
+            else:
+                # end the current transaction to see newly queued answers
+                transaction.commit_unless_managed()
+                time.sleep(options['sleep'])
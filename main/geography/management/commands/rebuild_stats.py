@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+from geography.models import AnswerStats, MapSkillStats, UserProfile, ValueStats
+import time
+import sys
+
+
+class Command(BaseCommand):
+
+    STATS = (
+        ('answerstats', AnswerStats.objects.rebuild),
+        ('mapskillstats', MapSkillStats.objects.rebuild),
+        ('userprofile', UserProfile.objects.rebuild),
+        ('valuestats', ValueStats.objects.rebuild),
+    )
+
+    args = '[<stats name> ...]'
+
+    help = u'''Rebuild the statistics maintained on answer save from the
+    answers already stored in the database. All statistics are rebuilt when
+    no name is given, the available names are: ''' + ', '.join([n for (n, f) in STATS])
+
+    def handle(self, *args, **options):
+        available = dict(Command.STATS)
+        for name in args:
+            if name not in available:
+                raise CommandError('unknown statistics: ' + name)
+        for name, rebuild in Command.STATS:
+            if len(args) > 0 and name not in args:
+                continue
+            time_start = time.time()
+            sys.stderr.write('rebuilding ' + name + '\n')
+            rebuild()
+            sys.stderr.write('time: ' + str(time.time() - time_start) + ' secs\n')
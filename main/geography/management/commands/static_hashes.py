@@ -1,4 +1,6 @@
-from django.core.management.base import NoArgsCommand
+from django.core.management.base import BaseCommand
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
 import hashlib
 import json
 import os
@@ -6,22 +8,79 @@ from django.conf import settings
 from re import search
 
 
-class Command(NoArgsCommand):
+class Command(BaseCommand):
     help = u"""Compute hashes of static content files. Typically on deploy"""
 
+    args = '[<filter>]'
+
+    CHUNK_SIZE = 1024 * 1024
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--output',
+            action='store',
+            dest='output',
+            default=None,
+            help='write "HASHES = {...}" to the given file instead of printing the hashes, the file is written only when the hashes change',
+        ),
+        make_option(
+            '--manifest',
+            action='store',
+            dest='manifest',
+            default=None,
+            help='file with sizes and modification times of the hashed files, hashes of unchanged files are reused',
+        ),
+        make_option(
+            '--workers',
+            type='int',
+            action='store',
+            dest='workers',
+            default=4,
+            help='number of threads computing hashes',
+        ),
+    )
+
     def handle(self, *args, **options):
         filter_ = ''
         if len(args) > 0:
             filter_ = args[0]
-        self.stdout.write(json.dumps(self.get_hashes(filter_)))
+        manifest = self.load_manifest(options['manifest'])
+        hashes, new_manifest = self.get_hashes(filter_, manifest, options['workers'])
+        if options['manifest'] and new_manifest != manifest:
+            self.write_if_changed(options['manifest'], json.dumps(new_manifest, sort_keys=True))
+        if options['output']:
+            self.write_if_changed(options['output'], 'HASHES = ' + json.dumps(hashes, sort_keys=True) + '\n')
+        else:
+            self.stdout.write(json.dumps(hashes))
 
-    def get_hashes(self, filter_):
-        hashes = {}
+    def get_hashes(self, filter_, manifest=None, workers=1):
+        """
+        Returns hashes of static files and the manifest with their sizes,
+        modification times and hashes. Files with the same size and
+        modification time as in the given manifest aren't read again.
+        """
         module = "geography"
-        static_files = self.get_static_files(module, filter_)
-        for f in static_files:
-            hashes[f[0]] = hashlib.md5(f[1]).hexdigest()
-        return hashes
+        manifest = manifest or {}
+        new_manifest = {}
+        to_hash = []
+        for f in self.get_static_files(module, filter_):
+            stat = os.stat(self.get_static_file_path(f, module))
+            entry = manifest.get(f)
+            if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime:
+                new_manifest[f] = entry
+            else:
+                to_hash.append((f, stat))
+        if to_hash:
+            pool = ThreadPool(workers)
+            try:
+                computed = pool.map(lambda (f, stat): self.get_static_file_hash(f, module), to_hash)
+            finally:
+                pool.close()
+                pool.join()
+            for (f, stat), md5 in zip(to_hash, computed):
+                new_manifest[f] = [stat.st_size, stat.st_mtime, md5]
+        hashes = dict([(f, e[2]) for f, e in new_manifest.iteritems()])
+        return hashes, new_manifest
 
     def get_static_files(self, module, filter_):
         files = []
@@ -33,10 +92,29 @@ class Command(NoArgsCommand):
                 f = str(f)
                 if search(filter_, f):
                     files.append(f)
-        return [(p, self.get_static_file_content(p, module)) for p in files]
+        return files
+
+    def get_static_file_path(self, filename, module):
+        return os.path.join(settings.PROJECT_DIR, module, filename)
+
+    def get_static_file_hash(self, filename, module):
+        md5 = hashlib.md5()
+        with open(self.get_static_file_path(filename, module), 'rb') as f:
+            for chunk in iter(lambda: f.read(Command.CHUNK_SIZE), ''):
+                md5.update(chunk)
+        return md5.hexdigest()
+
+    def load_manifest(self, manifest_file):
+        if not manifest_file or not os.path.exists(manifest_file):
+            return {}
+        with open(manifest_file) as f:
+            return json.load(f)
 
-    def get_static_file_content(self, filename, module):
-        filename = os.path.join(settings.PROJECT_DIR, module, filename)
-        with file(filename) as f:
-            content = f.read()
-        return content
+    def write_if_changed(self, dest_file, content):
+        if os.path.exists(dest_file):
+            with open(dest_file) as f:
+                if f.read() == content:
+                    return
+        with open(dest_file + '.tmp', 'w') as f:
+            f.write(content)
+        os.rename(dest_file + '.tmp', dest_file)
@@ -1,12 +1,53 @@
 # -*- coding: utf-8 -*-
 from django.core.management.base import BaseCommand, CommandError
-from django.db import connection
-from geography.utils.db import dump_cursor
+from geography.utils.db import dump_query_by_id
+from optparse import make_option
+
+ALLOWED_TABLES = [
+    'geography_ab_group',
+    'geography_ab_value',
+    'geography_answer',
+    'geography_answer_ab_values',
+    'geography_place',
+    'geography_placerelation',
+    'geography_answer_options',
+    'geography_placerelation_related_places'
+]
+
+FIELD_MAPPING = {
+    'answer_id': 'answer',
+    'group_id': 'group',
+    'place_id': 'place',
+    'place_asked_id': 'place_asked',
+    'place_answered_id': 'place_answered',
+    'place_map_id': 'place_map',
+    'placerelation_id': 'placerelation',
+    'user_id': 'user',
+    'value_id': 'value'}
 
 
 class Command(BaseCommand):
     help = 'dump model to csv file'
 
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--since-id',
+            type='int',
+            action='store',
+            dest='since_id',
+            default=0,
+            help='dump only rows with greater id',
+        ),
+        make_option(
+            '--chunk-size',
+            type='int',
+            action='store',
+            dest='chunk_size',
+            default=10000,
+            help='number of rows read by one query',
+        ),
+    )
+
     def handle(self, *args, **options):
         if len(args) != 2:
             raise CommandError(
@@ -17,32 +58,13 @@ class Command(BaseCommand):
                 ''')
         table_name = args[0]
         dest_file = args[1]
-        allowed_tables = [
-            'geography_ab_group',
-            'geography_ab_value',
-            'geography_answer',
-            'geography_answer_ab_values',
-            'geography_place',
-            'geography_placerelation',
-            'geography_answer_options',
-            'geography_placerelation_related_places'
-        ]
-        field_mapping = {
-            'answer_id': 'answer',
-            'group_id': 'group',
-            'place_id': 'place',
-            'place_asked_id': 'place_asked',
-            'place_answered_id': 'place_answered',
-            'place_map_id': 'place_map',
-            'placerelation_id': 'placerelation',
-            'user_id': 'user',
-            'value_id': 'value'}
-        if table_name in allowed_tables:
-            cursor = connection.cursor()
-            cursor.execute('SELECT * FROM ' + table_name)
-            dump_cursor(
-                cursor,
+        if table_name in ALLOWED_TABLES:
+            rows_num, last_id = dump_query_by_id(
+                'SELECT * FROM ' + table_name + ' WHERE id > %s',
                 dest_file,
-                **field_mapping)
+                since_id=options['since_id'],
+                chunk_size=options['chunk_size'],
+                **FIELD_MAPPING)
+            print 'dumped rows: {0}, last id: {1}'.format(rows_num, last_id)
         else:
             raise CommandError('table ' + table_name + ' is not supported')
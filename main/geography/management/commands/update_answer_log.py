@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from geography.utils.answerlog import AnswerLog
+from optparse import make_option
+import os
+import time
+import sys
+
+
+class Command(BaseCommand):
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--dir',
+            action='store',
+            dest='dir',
+            default=os.path.join(settings.MEDIA_ROOT, 'answer_log'),
+            help='directory of the answer log',
+        ),
+        make_option(
+            '--batch-size',
+            type='int',
+            action='store',
+            dest='batch_size',
+            default=100000,
+            help='number of answers appended at once',
+        ),
+    )
+
+    help = u'''Append answers newer than the last stored one to the answer
+    log, a columnar copy of answers used by derived_knowledge_data
+    --answer-log and for analyses'''
+
+    def handle(self, *args, **options):
+        if len(args) > 0:
+            raise CommandError('The command doesn\'t need any argument.')
+        time_start = time.time()
+        answer_log = AnswerLog(options['dir'])
+        sys.stderr.write('updating answer log, stored answers: ' + str(len(answer_log)) + '\n')
+        appended = answer_log.update(options['batch_size'])
+        sys.stderr.write('appended answers: ' + str(appended) + ', last id: ' + str(answer_log.last_id) + '\n')
+        sys.stderr.write('time: ' + str(time.time() - time_start) + ' secs\n')
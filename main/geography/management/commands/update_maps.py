@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 from django.core.management.base import BaseCommand
 from geography.management import MapUpdater
-from django.db import connection
+from geography.models import MapSkillStats, Place
+from django.db import connection, transaction
 import csv
 import settings
 
@@ -14,6 +15,8 @@ class Command(BaseCommand):
         u.update_all_maps()
         all_places = u.get_all_places()
         self.translate(all_places)
+        print "Rebuilding map skill statistics"
+        MapSkillStats.objects.rebuild()
 
     def translate(self, all_places):
         translations = self.get_translations()
@@ -37,6 +40,8 @@ class Command(BaseCommand):
                     ''',
                     [name, code, code]
                 )
+        transaction.commit_unless_managed()
+        Place.objects.bump_map_index_version()
         print "Done"
 
     def get_translations(self):
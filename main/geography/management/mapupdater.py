@@ -60,6 +60,7 @@ class MapUpdater():
                     place = self.find_place_or_create_new(code, name, place_type)
                     to_be_added.append(place)
                 relation.related_places.add(*to_be_added)
+        Place.objects.bump_map_index_version()
 
     def find_place_relation_or_create_new(self, place):
         try:
@@ -1,7 +1,9 @@
-from answer import Answer
+from answer import Answer, AnswerQueue
+from answerstats import AnswerStats
+from userprofile import UserProfile
 from place import Place, PlaceRelation
 from userplace import UserPlace
 from averageplace import AveragePlace
-from knowledge import PriorSkill, CurrentSkill, Difficulty, KnowledgeUpdater, InMemoryEnvironmentWithFlush, DatabaseEnvironment
-from ab import Group, Value, UserValues, ABEnvironment
-from mapskill import MapSkill
+from knowledge import PriorSkill, CurrentSkill, Difficulty, KnowledgeUpdater, InMemoryEnvironmentWithFlush, DatabaseEnvironment, RequestEnvironment
+from ab import Group, Value, ValueStats, UserValues, ABEnvironment
+from mapskill import MapSkill, MapSkillStats
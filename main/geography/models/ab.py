@@ -3,17 +3,87 @@ import random
 import utils
 import settings
 import datetime
+import hashlib
 import logging
-from django.db import models
+import uuid
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.db import connection
 from contextlib import closing
+from math import sqrt
+from userprofile import UserProfile
 
 LOGGER = logging.getLogger(__name__)
 
 
+class ABGroups:
+
+    """
+    A/B testing groups with their values. The objects are shared by all
+    requests served by the process, so they mustn't be modified.
+    """
+
+    def __init__(self, version, groups, values):
+        self.version = version
+        self.groups = groups
+        self._values = dict([(v.id, v) for v in values])
+        self._value_ids = dict([(v.value, v.id) for v in values])
+        self._group_values = {}
+        for v in values:
+            self._group_values.setdefault(v.group_id, []).append(v)
+
+    def value(self, value_id):
+        return self._values.get(value_id)
+
+    def value_id(self, value):
+        return self._value_ids.get(value)
+
+    def group_values(self, group_id):
+        "Returns values of the given group ordered by id"
+        return self._group_values.get(group_id, [])
+
+    def default_value(self, group_id):
+        for v in self.group_values(group_id):
+            if v.is_default:
+                return v
+        return None
+
+
 class GroupManager(models.Manager):
 
+    AB_GROUPS_VERSION_KEY = 'geography_ab_groups_version'
+
+    AB_GROUPS_VERSION_TIMEOUT = 365 * 24 * 60 * 60
+
+    _ab_groups = None
+
+    def get_ab_groups(self):
+        """
+        Returns all groups with their values. The groups are loaded once per
+        process and reloaded when the version stamp in the cache changes.
+        """
+        version = cache.get(GroupManager.AB_GROUPS_VERSION_KEY)
+        if version is None:
+            cache.add(GroupManager.AB_GROUPS_VERSION_KEY, uuid.uuid4().hex, GroupManager.AB_GROUPS_VERSION_TIMEOUT)
+            version = cache.get(GroupManager.AB_GROUPS_VERSION_KEY)
+        ab_groups = GroupManager._ab_groups
+        if ab_groups is None or ab_groups.version != version:
+            ab_groups = ABGroups(
+                version,
+                list(self.order_by('id')),
+                list(Value.objects.order_by('id')))
+            GroupManager._ab_groups = ab_groups
+        return ab_groups
+
+    def bump_ab_groups_version(self):
+        """
+        Makes all processes reload the groups, it is called whenever a group
+        or a value is saved or deleted.
+        """
+        cache.set(GroupManager.AB_GROUPS_VERSION_KEY, uuid.uuid4().hex, GroupManager.AB_GROUPS_VERSION_TIMEOUT)
+
     def answers_per_value(self, group_name):
         with closing(connection.cursor()) as cursor:
             cursor.execute(
@@ -130,111 +200,198 @@ class Value(models.Model):
         app_label = 'geography'
 
 
-class UserValuesManager(models.Manager):
-
-    def load_user_values(self, user):
-        user_values = self.for_user(user)
-        defaults = self._prepare_defaults()
-        defaults_v = [d.value for d in defaults]
-        users = self._prepare_user_values(user_values)
-        return defaults + filter(lambda v: v.value not in defaults_v, users)
+class ValueStatsManager(models.Manager):
 
-    def for_user(self, user):
-        try:
-            return self.select_related('values').get(user_id=user.id)
-        except UserValues.DoesNotExist:
-            user_values = UserValues(user_id=user.id)
-            user_values.save()
-            return user_values
-
-    def _choose_value(self, prob_values):
-        choice = random.randint(0, 100)
-        sum_prob = 0
-        for ab_v in prob_values:
-            sum_prob += ab_v['probability']
-            if choice <= sum_prob:
-                return ab_v
-        raise Exception('no value chosen')
-
-    def _prepare_defaults(self):
+    def update_with_answer(self, answer_dict):
+        value_ids = answer_dict.get('ab_values', [])
+        if len(value_ids) == 0:
+            return
+        correct = int(answer_dict['place_asked'] == answer_dict.get('place_answered'))
+        with closing(connection.cursor()) as cursor:
+            cursor.execute(
+                '''
+                INSERT INTO geography_ab_valuestats
+                    (value_id, users_num, answers_num, correct_num, response_time_sum)
+                VALUES ''' + ', '.join(['(%s, 0, 1, %s, %s)'] * len(value_ids)) + '''
+                ON DUPLICATE KEY UPDATE
+                    answers_num = answers_num + 1,
+                    correct_num = correct_num + VALUES(correct_num),
+                    response_time_sum = response_time_sum + VALUES(response_time_sum)
+                ''',
+                [x for value_id in value_ids for x in (value_id, correct, answer_dict['response_time'])])
+        transaction.commit_unless_managed()
+
+    def update_with_user_values(self, value_ids):
+        "Counts a new user for each of the given values"
+        if len(value_ids) == 0:
+            return
         with closing(connection.cursor()) as cursor:
             cursor.execute(
                 '''
+                INSERT INTO geography_ab_valuestats
+                    (value_id, users_num, answers_num, correct_num, response_time_sum)
+                VALUES ''' + ', '.join(['(%s, 1, 0, 0, 0)'] * len(value_ids)) + '''
+                ON DUPLICATE KEY UPDATE
+                    users_num = users_num + 1
+                ''',
+                value_ids)
+        transaction.commit_unless_managed()
+
+    def for_group(self, group_name):
+        """
+        Returns statistics of values of the given group, values without any
+        user and answer get zero statistics.
+        """
+        values = Value.objects.filter(group__name=group_name).order_by('value')
+        stats = dict([(s.value_id, s) for s in self.filter(value__in=values)])
+        return [stats.get(v.id, ValueStats(value=v)) for v in values]
+
+    def rebuild(self):
+        with closing(connection.cursor()) as cursor:
+            cursor.execute('DELETE FROM geography_ab_valuestats')
+            cursor.execute(
+                '''
+                INSERT INTO geography_ab_valuestats
+                    (value_id, users_num, answers_num, correct_num, response_time_sum)
                 SELECT
                     geography_ab_value.id,
-                    geography_ab_value.probability,
-                    geography_ab_value.group_id,
-                    geography_ab_value.value
-                FROM
-                    geography_ab_value
-                    INNER JOIN geography_ab_group ON
-                        geography_ab_group.id = geography_ab_value.group_id
-                WHERE
-                    geography_ab_value.is_default AND NOT geography_ab_group.active
+                    (
+                        SELECT COUNT(*)
+                        FROM geography_ab_uservalues_values
+                        WHERE geography_ab_uservalues_values.value_id = geography_ab_value.id
+                    ),
+                    COUNT(geography_answer.id),
+                    COUNT(IF(geography_answer.place_asked_id = geography_answer.place_answered_id, 1, NULL)),
+                    COALESCE(SUM(geography_answer.response_time), 0)
+                FROM geography_ab_value
+                LEFT JOIN geography_answer_ab_values
+                    ON geography_answer_ab_values.value_id = geography_ab_value.id
+                LEFT JOIN geography_answer
+                    ON geography_answer.id = geography_answer_ab_values.answer_id
                 GROUP BY geography_ab_value.id
                 ''')
-            return [
-                Value(
-                    value=d['value'],
-                    id=d['id'],
-                    probability=d['probability'],
-                    group_id=d['group_id']) for d in utils.fetchall(cursor)
-            ]
-
-    def _prepare_user_values(self, user_values):
+        transaction.commit_unless_managed()
+
+
+class ValueStats(models.Model):
+
+    """
+    Counters of users assigned to the value and of answers the value has been
+    recorded with.
+    """
+
+    value = models.ForeignKey(Value, unique=True)
+    users_num = models.IntegerField(default=0)
+    answers_num = models.IntegerField(default=0)
+    correct_num = models.IntegerField(default=0)
+    response_time_sum = models.BigIntegerField(default=0)
+
+    objects = ValueStatsManager()
+
+    def success_rate(self):
+        if self.answers_num == 0:
+            return None
+        return self.correct_num / float(self.answers_num)
+
+    def success_rate_interval(self, z=1.96):
+        """
+        Returns the Wilson score interval of the success rate, the default
+        z is for the 95% confidence.
+        """
+        n = float(self.answers_num)
+        if n == 0:
+            return None
+        p = self.correct_num / n
+        center = (p + z * z / (2 * n)) / (1 + z * z / n)
+        margin = z * sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+        return (center - margin, center + margin)
+
+    def avg_response_time(self):
+        if self.answers_num == 0:
+            return None
+        return self.response_time_sum / float(self.answers_num)
+
+    class Meta:
+        db_table = 'geography_ab_valuestats'
+        app_label = 'geography'
+
+
+class UserValuesManager(models.Manager):
+
+    def load_user_values(self, user):
+        """
+        Returns ids of A/B values of the given user. Inactive groups use their
+        default values, values already assigned to the user are kept and the
+        user is assigned to the remaining active groups he is eligible for.
+        """
+        ab_groups = Group.objects.get_ab_groups()
         with closing(connection.cursor()) as cursor:
-            cursor.execute(
-                '''
-                SELECT COUNT(id) AS num_answers FROM geography_answer WHERE user_id = %s
-                ''', [user_values.user_id])
-            num_answers = utils.fetchone(cursor)['num_answers']
             cursor.execute(
                 '''
                 SELECT
-                    geography_ab_value.id,
-                    geography_ab_value.is_default,
-                    geography_ab_value.probability,
-                    geography_ab_value.group_id,
-                    geography_ab_group.max_answers,
-                    geography_ab_group.min_answers
+                    geography_ab_uservalues_values.value_id
                 FROM
-                    geography_ab_value
-                    INNER JOIN geography_ab_group ON
-                        geography_ab_group.id = geography_ab_value.group_id
-                WHERE geography_ab_group.id NOT IN (
-                    SELECT
-                        geography_ab_value.group_id
-                    FROM geography_ab_uservalues
+                    geography_ab_uservalues
                     INNER JOIN geography_ab_uservalues_values ON
                         geography_ab_uservalues.id = geography_ab_uservalues_values.uservalues_id
-                    INNER JOIN geography_ab_value ON
-                        geography_ab_value.id = geography_ab_uservalues_values.value_id
-                    WHERE geography_ab_uservalues.user_id = %s)
-                    AND geography_ab_group.active
-                GROUP BY geography_ab_value.id;
-                ''', [user_values.user_id])
-            ab_values = {}
-            ab_values_default = {}
-            ab_value = utils.fetchone(cursor)
-            user_values_defaults = []
-            while ab_value:
-                if ab_value and ab_value['is_default']:
-                    ab_values_default[ab_value['group_id']] = ab_value
-                group_values = ab_values.get(ab_value['group_id'], [])
-                group_values.append(ab_value)
-                ab_values[ab_value['group_id']] = group_values
-                ab_value = utils.fetchone(cursor)
-            updated = False
-            for (group_id, group_values) in ab_values.iteritems():
-                if (not group_values[0]['min_answers'] or num_answers >= group_values[0]['min_answers']) and (not group_values[0]['max_answers'] or num_answers <= group_values[0]['max_answers']):
-                    chosen_value = self._choose_value(group_values)
-                    user_values.values.add(Value.objects.get(id=chosen_value['id']))
-                    updated = True
-                else:
-                    user_values_defaults.append(Value.objects.get(id=ab_values_default[group_id]['id']))
-            if updated:
-                user_values.save()
-            return list(user_values.values.get_query_set()) + user_values_defaults
+                WHERE geography_ab_uservalues.user_id = %s
+                ''', [user.id])
+            assigned = [ab_groups.value(value_id) for (value_id,) in cursor.fetchall()]
+        assigned = filter(lambda v: v is not None, assigned)
+        assigned_groups = set([v.group_id for v in assigned])
+        defaults = [ab_groups.default_value(g.id) for g in ab_groups.groups if not g.active]
+        new_values = []
+        not_eligible_defaults = []
+        num_answers = None
+        for group in ab_groups.groups:
+            if not group.active or group.id in assigned_groups:
+                continue
+            if num_answers is None:
+                num_answers = UserProfile.objects.from_user(user).answers_num
+            if (not group.min_answers or num_answers >= group.min_answers) and (not group.max_answers or num_answers <= group.max_answers):
+                new_values.append(self._choose_value(user, group, ab_groups.group_values(group.id)))
+            else:
+                not_eligible_defaults.append(ab_groups.default_value(group.id))
+        if new_values:
+            user_values = self.for_user(user)
+            UserValues.values.through.objects.bulk_create([
+                UserValues.values.through(uservalues_id=user_values.id, value_id=v.id)
+                for v in new_values
+            ])
+            ValueStats.objects.update_with_user_values([v.id for v in new_values])
+        defaults_ids = [d.id for d in defaults if d is not None]
+        return defaults_ids + [
+            v.id for v in assigned + new_values + not_eligible_defaults
+            if v is not None and v.id not in defaults_ids
+        ]
+
+    def for_user(self, user):
+        try:
+            return self.select_related('values').get(user_id=user.id)
+        except UserValues.DoesNotExist:
+            user_values = UserValues(user_id=user.id)
+            user_values.save()
+            return user_values
+
+    def _choose_value(self, user, group, values):
+        if settings.AB_ASSIGNMENT == 'hash':
+            # the same user is always assigned to the same value, so the
+            # assignment doesn't depend on the state of the random generator
+            digest = hashlib.md5('{0}:{1}'.format(user.id, group.name)).hexdigest()
+            choice = int(digest, 16) % 100
+            sum_prob = 0
+            for ab_v in values:
+                sum_prob += ab_v.probability
+                if choice < sum_prob:
+                    return ab_v
+        else:
+            choice = random.randint(0, 100)
+            sum_prob = 0
+            for ab_v in values:
+                sum_prob += ab_v.probability
+                if choice <= sum_prob:
+                    return ab_v
+        raise Exception('no value chosen')
 
 
 class UserValues(models.Model):
@@ -250,20 +407,25 @@ class UserValues(models.Model):
 
 class ABEnvironment:
 
+    # how long (in seconds) the values stored in the session are used
+    EXPIRE_SECONDS = 15 * 60
+
     def __init__(self, request):
         self._request = request
         self._used = {}
+        self._ab_groups = Group.objects.get_ab_groups()
 
     def is_member_of(self, ab_value, reason):
-        is_member = any([v.value == ab_value for v in self._request.session['ab_values']])
-        if is_member:
-            affecting = self._used.get(reason, [])
-            affecting.append(ab_value)
-            self._used[reason] = affecting
-        return is_member
+        for v in self._values():
+            if v.value == ab_value:
+                affecting = self._used.get(reason, [])
+                affecting.append(v)
+                self._used[reason] = affecting
+                return True
+        return False
 
     def get_membership(self, ab_values, default_value, reason):
-        for v in self._request.session['ab_values']:
+        for v in self._values():
             if v.value in ab_values:
                 affecting = self._used.get(reason, [])
                 affecting.append(v)
@@ -274,17 +436,34 @@ class ABEnvironment:
     def get_affecting_values(self, reason):
         return self._used.get(reason, [])
 
+    def _values(self):
+        values = map(self._ab_groups.value, self._request.session.get('ab_value_ids', []))
+        return filter(lambda v: v is not None, values)
+
     @staticmethod
     def init_session(user, session):
+        # only ids of values are stored in the session, the values themselves
+        # are taken from the groups loaded in memory
+        version = Group.objects.get_ab_groups().version
         if not settings.DEBUG and (
-                ('ab_values_modified' in session.keys() and (session['ab_values_modified'] - datetime.datetime.now()).total_seconds() <= 15 * 60)
-                or ('ab_values_user_id' in session.keys() and session['ab_values_user_id'] != user.id)):
+                session.get('ab_values_user_id') == user.id and
+                session.get('ab_values_version') == version and
+                (datetime.datetime.now() - session['ab_values_modified']).total_seconds() <= ABEnvironment.EXPIRE_SECONDS):
             return session
-        user_values = UserValues.objects.load_user_values(user)
-        session['ab_values'] = user_values
+        session.pop('ab_values', None)
+        session['ab_value_ids'] = UserValues.objects.load_user_values(user)
+        session['ab_values_version'] = version
         session['ab_values_modified'] = datetime.datetime.now()
         session['ab_values_user_id'] = user.id
         LOGGER.debug(
             'init values AB values for user %s: %s',
-            user, session['ab_values'])
+            user, session['ab_value_ids'])
         return session
+
+
+def _bump_ab_groups_version(sender, **kwargs):
+    Group.objects.bump_ab_groups_version()
+
+for model in (Group, Value):
+    post_save.connect(_bump_ab_groups_version, sender=model)
+    post_delete.connect(_bump_ab_groups_version, sender=model)
@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
+import answerstats
+import userprofile
 import knowledge
 import logging
 import place
@@ -14,11 +18,24 @@ class AnswerManager(models.Manager):
 
     def save_with_listeners(self, answer_dict):
         answer_dict['inserted'] = datetime.now()
-        for listener in Answer.ON_SAVE_LISTENERS:
-            try:
-                listener(answer_dict)
-            except Exception as e:
-                LOGGER.error('exception thrown while processing listener for answer save, listener: {}, exception: {}, message: {}'.format(listener.__name__, type(e), str(e)))
+        if settings.ANSWER_QUEUE:
+            # an answer without its queue entry would never be processed
+            with transaction.commit_on_success():
+                answer = self._save(answer_dict)
+                AnswerQueue(answer=answer, user_id=answer.user_id).save()
+            LOGGER.debug("answer queued: %s", answer_dict)
+            return
+        self._process_listeners(Answer.ON_SAVE_LISTENERS, answer_dict)
+        answer = self._save(answer_dict)
+        answer_dict['id'] = answer.id
+        self._process_listeners(Answer.AFTER_SAVE_LISTENERS, answer_dict)
+        LOGGER.debug("answered: %s", answer_dict)
+
+    def process_listeners(self, answer_dict, raise_errors=False):
+        self._process_listeners(Answer.ON_SAVE_LISTENERS, answer_dict, raise_errors)
+        self._process_listeners(Answer.AFTER_SAVE_LISTENERS, answer_dict, raise_errors)
+
+    def _save(self, answer_dict):
         answer = Answer(
             user_id=answer_dict['user'],
             place_asked_id=answer_dict['place_asked'],
@@ -36,10 +53,19 @@ class AnswerManager(models.Manager):
                 id__in=answer_dict['options'],
             )
         if len(answer_dict.get('ab_values', [])) > 0:
-            answer.ab_values = ab.Value.objects.filter(
-                id__in=answer_dict['ab_values'])
+            answer.ab_values = answer_dict['ab_values']
         models.Model.save(answer)
-        LOGGER.debug("answered: %s", answer_dict)
+        return answer
+
+    def _process_listeners(self, listeners, answer_dict, raise_errors=False):
+        for listener in listeners:
+            if raise_errors:
+                listener(answer_dict)
+                continue
+            try:
+                listener(answer_dict)
+            except Exception as e:
+                LOGGER.error('exception thrown while processing listener for answer save, listener: {}, exception: {}, message: {}'.format(listener.__name__, type(e), str(e)))
 
     def get_success_rate(self, user, n):
         answers = self.filter(
@@ -53,6 +79,11 @@ class AnswerManager(models.Manager):
 
 class Answer(models.Model):
     ON_SAVE_LISTENERS = [knowledge.KnowledgeUpdater(knowledge.DatabaseEnvironment()).stream_answer]
+    AFTER_SAVE_LISTENERS = [
+        answerstats.AnswerStats.objects.update_with_answer,
+        userprofile.UserProfile.objects.update_with_answer,
+        ab.ValueStats.objects.update_with_answer,
+    ]
     FIND_ON_MAP = 1
     PICK_NAME = 2
     QUESTION_TYPES = (
@@ -98,3 +129,92 @@ class Answer(models.Model):
     class Meta:
         app_label = 'geography'
         ordering = ["-id"]
+
+
+class AnswerQueueManager(models.Manager):
+
+    # answers whose processing failed so many times are left in the queue
+    # for inspection and are not processed any more
+    MAX_ATTEMPTS = 3
+
+    def lag(self):
+        pending = self.filter(attempts__lt=AnswerQueueManager.MAX_ATTEMPTS)
+        oldest = pending.order_by('id')[:1]
+        if len(oldest) == 0:
+            return (0, 0)
+        return (pending.count(), (datetime.now() - oldest[0].inserted).total_seconds())
+
+    def failed(self):
+        "Returns the number of answers which are not processed any more"
+        return self.filter(attempts__gte=AnswerQueueManager.MAX_ATTEMPTS).count()
+
+    def process(self, worker=0, workers=1, batch_size=100):
+        """
+        Applies the answer listeners to the queued answers of the users from
+        the given partition in order they were inserted and removes them from
+        the queue. When a listener fails, the changes made for the answer are
+        rolled back and the answer stays in the queue to be tried again, the
+        later answers of the same user wait for it. Returns the number of
+        answers tried.
+        """
+        queued = list(self.extra(
+            where=['MOD(user_id, %s) = %s'],
+            params=[workers, worker]).filter(
+                attempts__lt=AnswerQueueManager.MAX_ATTEMPTS).order_by('id')[:batch_size])
+        if len(queued) == 0:
+            return 0
+        answer_ids = [q.answer_id for q in queued]
+        answers = dict([(a.id, a) for a in Answer.objects.filter(id__in=answer_ids)])
+        options = self._related_ids(Answer.options.through, 'place_id', answer_ids)
+        ab_values = self._related_ids(Answer.ab_values.through, 'value_id', answer_ids)
+        failed_users = set()
+        for q in queued:
+            if q.user_id in failed_users:
+                continue
+            answer = answers[q.answer_id]
+            answer_dict = {
+                'id': answer.id,
+                'user': answer.user_id,
+                'place_asked': answer.place_asked_id,
+                'place_answered': answer.place_answered_id,
+                'place_map': answer.place_map_id,
+                'type': answer.type,
+                'response_time': answer.response_time,
+                'number_of_options': answer.number_of_options,
+                'ip_address': answer.ip_address,
+                'answer': answer.answer,
+                'inserted': answer.inserted,
+                'options': options.get(answer.id, []),
+                'ab_values': ab_values.get(answer.id, []),
+            }
+            try:
+                with transaction.commit_on_success():
+                    Answer.objects.process_listeners(answer_dict, raise_errors=True)
+                    q.delete()
+            except Exception:
+                LOGGER.exception(
+                    'processing of the queued answer %s failed, attempt %s of %s',
+                    answer.id, q.attempts + 1, AnswerQueueManager.MAX_ATTEMPTS)
+                with transaction.commit_on_success():
+                    self.filter(id=q.id).update(attempts=F('attempts') + 1)
+                failed_users.add(q.user_id)
+        return len(queued)
+
+    def _related_ids(self, through, column, answer_ids):
+        found = {}
+        for answer_id, related_id in through.objects.filter(answer_id__in=answer_ids).values_list('answer_id', column):
+            found.setdefault(answer_id, []).append(related_id)
+        return found
+
+
+class AnswerQueue(models.Model):
+
+    answer = models.ForeignKey(Answer, unique=True)
+    user = models.ForeignKey(User)
+    inserted = models.DateTimeField(default=datetime.now)
+    attempts = models.IntegerField(default=0)
+
+    objects = AnswerQueueManager()
+
+    class Meta:
+        app_label = 'geography'
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from django.db import models, connection, transaction
+from django.contrib.auth.models import User
+from place import Place
+from contextlib import closing
+
+
+class AnswerStatsManager(models.Manager):
+
+    def update_with_answer(self, answer_dict):
+        with closing(connection.cursor()) as cursor:
+            cursor.execute(
+                '''
+                INSERT INTO geography_answerstats
+                    (user_id, place_id, answers_num, correct_num, last_time)
+                VALUES (%s, %s, 1, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    answers_num = answers_num + 1,
+                    correct_num = correct_num + VALUES(correct_num),
+                    last_time = VALUES(last_time)
+                ''',
+                [
+                    answer_dict['user'],
+                    answer_dict['place_asked'],
+                    int(answer_dict['place_asked'] == answer_dict.get('place_answered')),
+                    answer_dict['inserted']
+                ])
+        transaction.commit_unless_managed()
+
+    def rebuild(self):
+        with closing(connection.cursor()) as cursor:
+            cursor.execute('DELETE FROM geography_answerstats')
+            cursor.execute(
+                '''
+                INSERT INTO geography_answerstats
+                    (user_id, place_id, answers_num, correct_num, last_time)
+                SELECT
+                    user_id,
+                    place_asked_id,
+                    COUNT(id),
+                    COUNT(IF(place_asked_id = place_answered_id, 1, NULL)),
+                    MAX(inserted)
+                FROM geography_answer
+                GROUP BY user_id, place_asked_id
+                ''')
+        transaction.commit_unless_managed()
+
+
+class AnswerStats(models.Model):
+
+    user = models.ForeignKey(User)
+    place = models.ForeignKey(Place)
+    answers_num = models.IntegerField(default=0)
+    correct_num = models.IntegerField(default=0)
+    last_time = models.DateTimeField(null=True, default=None)
+
+    objects = AnswerStatsManager()
+
+    class Meta:
+        app_label = 'geography'
+        unique_together = ('user', 'place')
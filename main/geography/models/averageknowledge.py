@@ -1,41 +1,46 @@
 # -*- coding: utf-8 -*-
 from django.db import models
 from place import Place
+from knowledge import PriorSkill
 from django.contrib.auth.models import User
 
 
 class AverageKnowledgeManager(models.Manager):
 
     def for_user_and_map_prepared(self, user, map):
+        prior_skill = PriorSkill.objects.from_user(user).value
         return self.raw("""
     SELECT
-        geography_currentskill_prepared.user_id * 100000 + geography_placerelation.place_id AS dummy_id,
+        %s * 100000 + geography_placerelation.place_id AS dummy_id,
         geography_placerelation.place_id AS place_id,
-        geography_currentskill_prepared.user_id AS user_id,
+        %s AS user_id,
         geography_place.type AS type,
-        AVG(geography_currentskill_prepared.value) AS skill
+        AVG(COALESCE(
+            geography_currentskill.value,
+            %s - COALESCE(geography_difficulty.value, 0)
+        )) AS skill
     FROM
         geography_placerelation
         INNER JOIN geography_placerelation_related_places
             ON geography_placerelation.id =
                 geography_placerelation_related_places.placerelation_id
-        INNER JOIN geography_currentskill_prepared
-            ON geography_placerelation_related_places.place_id =
-                geography_currentskill_prepared.place_id
         INNER JOIN geography_place
             ON geography_place.id = geography_placerelation_related_places.place_id
+        LEFT JOIN geography_difficulty
+            ON geography_difficulty.place_id = geography_place.id
+        LEFT JOIN geography_currentskill
+            ON geography_currentskill.place_id = geography_place.id
+            AND geography_currentskill.user_id = %s
     WHERE
         (geography_placerelation.type = 1 OR
         geography_placerelation.type = 4 ) AND
-        geography_currentskill_prepared.user_id = %s AND
         geography_placerelation.place_id = %s
     GROUP BY
         geography_placerelation.place_id,
-        geography_currentskill_prepared.user_id,
         geography_place.type
     ORDER BY
         geography_place.name;
-        """, [user.id, map.place.id]
+        """, [user.id, user.id, prior_skill, user.id, map.place.id]
         )
 
 
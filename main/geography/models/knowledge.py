@@ -3,14 +3,13 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.db import connection
 from place import Place
+from mapskill import MapSkillStats
 from proso.geography.environment import Environment, InMemoryEnvironment
 from proso.geography.model import AnswerStream
 from proso.geography.prior import elo_prepare, elo_predict, elo_update
 from proso.geography.current import pfa_prepare, pfa_predict, pfa_update
 from contextlib import closing
-from django.core.cache import cache
-import hashlib
-import json
+import itertools
 
 
 class KnowledgeUpdater(AnswerStream):
@@ -57,80 +56,52 @@ class DatabaseEnvironment(Environment):
                     '''
                     SELECT
                         user_id,
-                        COUNT(geography_answer.id)
-                    FROM geography_answer
+                        SUM(answers_num)
+                    FROM geography_answerstats
                     WHERE user_id IN (''' + ','.join([str(i) for i in user_ids]) + ''')
                     GROUP BY user_id
                     ''')
                 found = dict(cursor.fetchall())
-                return map(lambda i: found[i], user_ids)
+                return map(lambda i: found.get(i, 0), user_ids)
             elif args_type == DatabaseEnvironment.PLACE:
                 cursor.execute(
                     '''
                     SELECT
-                        place_asked_id,
-                        COUNT(geography_answer.id)
-                    FROM geography_answer
-                    WHERE place_asked_id IN (''' + ','.join([str(i) for i in place_ids]) + ''')
-                    GROUP BY place_asked_id
+                        place_id,
+                        SUM(answers_num)
+                    FROM geography_answerstats
+                    WHERE place_id IN (''' + ','.join([str(i) for i in place_ids]) + ''')
+                    GROUP BY place_id
                     ''')
                 found = dict(cursor.fetchall())
-                return map(lambda i: found[i], place_ids)
+                return map(lambda i: found.get(i, 0), place_ids)
             else:
                 cursor.execute(
                     '''
                     SELECT
                         user_id,
-                        place_asked_id,
-                        COUNT(geography_answer.id)
-                    FROM geography_answer
+                        place_id,
+                        answers_num
+                    FROM geography_answerstats
                     WHERE user_id IN (''' + ','.join([str(i) for i in user_ids]) + ''')
-                    AND place_asked_id IN (''' + ','.join([str(i) for i in place_ids]) + ''')
-                    GROUP BY user_id, place_asked_id
+                    AND place_id IN (''' + ','.join([str(i) for i in place_ids]) + ''')
                     ''')
                 found = dict(map(lambda (i, j, k): ((i, j), k), cursor.fetchall()))
                 return map(lambda i: found.get(i, 0), zip(user_ids, place_ids))
 
     def confused_index(self, place_id, place_ids):
-        cache_key = (
-            'confused_index_' +
-            hashlib.sha1(str(place_id)).hexdigest() +
-            '_' +
-            hashlib.sha1(str(place_ids)).hexdigest())
-        places_json = cache.get(cache_key)
-        if places_json is None:
-            with closing(connection.cursor()) as cursor:
-                cursor.execute(
-                    '''
-                    SELECT
-                        geography_place.id,
-                        COUNT(geography_answer.id) AS confusing_factor
-                    FROM
-                        geography_place
-                        LEFT JOIN geography_answer ON (
-                            geography_answer.place_answered_id = geography_place.id
-                            AND geography_answer.place_asked_id = %s)
-                    WHERE
-                        geography_place.id IN (''' + ','.join([str(i) for i in place_ids]) + ''')
-                        AND
-                        geography_answer.place_asked_id != geography_answer.place_answered_id
-                    GROUP BY geography_place.id
-                    ''', [place_id])
-                confusing_factor = dict([(p[0], p[1]) for p in cursor.fetchall()])
-                json_places = json.dumps(map(lambda i: confusing_factor.get(i, 0), place_ids))
-            # TODO find out what was this for
-            # place_answered_num = self.answers_num(place_id=place_id)
-            # expire_hours = max(1, int(round(place_answered_num / 100.0)))
-            expire_seconds = 60 * 60 * 1  # expire_hours
-            cache.set(cache_key, json_places, expire_seconds)
-            places_json = cache.get(cache_key)
-        return json.loads(places_json)
+        # the options of a question are the options of the asked place and
+        # a wrong answer does not store which place was meant, so no place is
+        # known to be confused with another one
+        return [0] * len(place_ids)
 
     def current_skill(self, user_id, place_id, new_value):
         if new_value is not None:
             skill = CurrentSkill.objects.from_user_and_place(user_id, place_id)
+            old_value = skill.value if skill.id is not None else None
             skill.value = new_value
             skill.save()
+            MapSkillStats.objects.update_with_current_skill(user_id, place_id, old_value, new_value)
         else:
             return self.current_skills([user_id], [place_id])[0]
 
@@ -142,12 +113,20 @@ class DatabaseEnvironment(Environment):
                     user_id,
                     place_id,
                     value
-                FROM geography_currentskill_prepared
+                FROM geography_currentskill
                 WHERE user_id IN (''' + ','.join([str(i) for i in user_ids]) + ''')
                 AND place_id IN (''' + ','.join([str(i) for i in place_ids]) + ''')
                 ''')
             current_skills = dict(map(lambda (i, j, k): ((i, j), k), cursor.fetchall()))
-            return map(lambda k: current_skills.get(k, 0), zip(user_ids, place_ids))
+        keys = zip(user_ids, place_ids)
+        missing = [k for k in keys if k not in current_skills]
+        if len(missing) > 0:
+            missing_user_ids, missing_place_ids = map(lambda ids: list(set(ids)), zip(*missing))
+            prior_skills = dict(zip(missing_user_ids, self.prior_skills(missing_user_ids)))
+            difficulties = dict(zip(missing_place_ids, self.difficulties(missing_place_ids)))
+            for user_id, place_id in missing:
+                current_skills[user_id, place_id] = prior_skills[user_id] - difficulties[place_id]
+        return map(lambda k: current_skills[k], keys)
 
     def difficulty(self, place_id, new_value=None):
         if new_value:
@@ -181,36 +160,35 @@ class DatabaseEnvironment(Environment):
                     '''
                     SELECT
                         user_id,
-                        COUNT(DISTINCT(place_asked_id))
-                    FROM geography_answer
+                        COUNT(place_id)
+                    FROM geography_answerstats
                     WHERE user_id IN (''' + ','.join([str(i) for i in user_ids]) + ''')
                     GROUP BY user_id
                     ''')
                 found = dict(cursor.fetchall())
-                return map(lambda i: found[i], user_ids)
+                return map(lambda i: found.get(i, 0), user_ids)
             elif args_type == DatabaseEnvironment.PLACE:
                 cursor.execute(
                     '''
                     SELECT
-                        place_asked_id,
-                        COUNT(DISTINCT(place_asked_id))
-                    FROM geography_answer
-                    WHERE place_asked_id IN (''' + ','.join([str(i) for i in place_ids]) + ''')
-                    GROUP BY place_asked_id
+                        place_id,
+                        COUNT(user_id)
+                    FROM geography_answerstats
+                    WHERE place_id IN (''' + ','.join([str(i) for i in place_ids]) + ''')
+                    GROUP BY place_id
                     ''')
                 found = dict(cursor.fetchall())
-                return map(lambda i: found[i], place_ids)
+                return map(lambda i: found.get(i, 0), place_ids)
             else:
                 cursor.execute(
                     '''
                     SELECT
                         user_id,
-                        place_asked_id,
+                        place_id,
                         1
-                    FROM geography_answer
+                    FROM geography_answerstats
                     WHERE user_id IN (''' + ','.join([str(i) for i in user_ids]) + ''')
-                    AND place_asked_id IN (''' + ','.join([str(i) for i in place_ids]) + ''')
-                    GROUP BY user_id, place_asked_id
+                    AND place_id IN (''' + ','.join([str(i) for i in place_ids]) + ''')
                     ''')
                 found = dict(map(lambda (i, j, k): ((i, j), k), cursor.fetchall()))
                 return map(lambda i: found.get(i, 0), zip(user_ids, place_ids))
@@ -234,38 +212,35 @@ class DatabaseEnvironment(Environment):
                     '''
                     SELECT
                         user_id,
-                        max(inserted)
-                    FROM geography_answer
+                        MAX(last_time)
+                    FROM geography_answerstats
                     WHERE user_id IN (''' + ','.join([str(i) for i in user_ids]) + ''')
                     GROUP BY user_id
                     ''')
                 found = dict(cursor.fetchall())
-                print 'A', found
-                return map(lambda i: found[i], user_ids)
+                return map(lambda i: found.get(i, None), user_ids)
             elif args_type == DatabaseEnvironment.PLACE:
                 cursor.execute(
                     '''
                     SELECT
-                        place_asked_id,
-                        MAX(inserted)
-                    FROM geography_answer
-                    WHERE place_asked_id IN (''' + ','.join([str(i) for i in place_ids]) + ''')
-                    GROUP BY place_asked_id
+                        place_id,
+                        MAX(last_time)
+                    FROM geography_answerstats
+                    WHERE place_id IN (''' + ','.join([str(i) for i in place_ids]) + ''')
+                    GROUP BY place_id
                     ''')
                 found = dict(cursor.fetchall())
-                print 'B', found
-                return map(lambda i: found[i], place_ids)
+                return map(lambda i: found.get(i, None), place_ids)
             else:
                 cursor.execute(
                     '''
                     SELECT
                         user_id,
-                        place_asked_id,
-                        MAX(inserted)
-                    FROM geography_answer
+                        place_id,
+                        last_time
+                    FROM geography_answerstats
                     WHERE user_id IN (''' + ','.join([str(i) for i in user_ids]) + ''')
-                    AND place_asked_id IN (''' + ','.join([str(i) for i in place_ids]) + ''')
-                    GROUP BY user_id, place_asked_id
+                    AND place_id IN (''' + ','.join([str(i) for i in place_ids]) + ''')
                     ''')
                 found = dict(map(lambda (i, j, k): ((i, j), k), cursor.fetchall()))
                 return map(lambda i: found.get(i, None), zip(user_ids, place_ids))
@@ -285,11 +260,14 @@ class DatabaseEnvironment(Environment):
                 SELECT
                     user_id,
                     value
-                FROM geography_priorskill_prepared
+                FROM geography_priorskill
                 WHERE user_id IN (''' + ','.join([str(i) for i in user_ids]) + ''')
                 ''')
             found = dict(cursor.fetchall())
-            return map(lambda user_id: found[user_id], user_ids)
+            return map(lambda user_id: found.get(user_id, 0), user_ids)
+
+    def preload(self, place_ids):
+        pass
 
     def process_answer(self, user_id, place_asked_id, place_answered_id, inserted):
         pass
@@ -305,9 +283,10 @@ class DatabaseEnvironment(Environment):
                     place_answered_id
                 FROM
                     geography_answer
+                WHERE user_id = %s
                 ORDER BY id DESC
                 LIMIT %s
-                ''', [n])
+                ''', [user_id, n])
             return sum([r[0] == r[1] for r in cursor.fetchall()]) / float(n)
 
     def _args_type(self, user_ids, place_ids):
@@ -326,37 +305,251 @@ class DatabaseEnvironment(Environment):
         return DatabaseEnvironment.USER_PLACE
 
 
-class InMemoryEnvironmentWithFlush(InMemoryEnvironment):
+class RequestEnvironment(DatabaseEnvironment):
+
+    """
+    Environment scoped to one request, i.e. to one user practicing one map.
+    Everything the recommendation needs for the preloaded places is loaded
+    by a few bulk queries and the lookups are answered from memory. Lookups
+    for other users or places fall back to the database.
+    """
+
+    def __init__(self, user_id):
+        self._user_id = user_id
+        self._place_ids = set()
+        self._prior_skill = None
+        self._difficulty = {}
+        self._current_skill = {}
+        self._answers_num = {}
+        self._last_time = {}
+        self._rolling_success = {}
+
+    def preload(self, place_ids):
+        place_ids = [p for p in set(place_ids) if p not in self._place_ids]
+        if len(place_ids) == 0:
+            return
+        with closing(connection.cursor()) as cursor:
+            cursor.execute(
+                '''
+                SELECT
+                    geography_place.id,
+                    COALESCE(geography_difficulty.value, 0),
+                    geography_currentskill.value,
+                    COALESCE(geography_answerstats.answers_num, 0),
+                    geography_answerstats.last_time,
+                    COALESCE((
+                        SELECT value
+                        FROM geography_priorskill
+                        WHERE user_id = %s), 0)
+                FROM
+                    geography_place
+                    LEFT JOIN geography_difficulty
+                        ON geography_difficulty.place_id = geography_place.id
+                    LEFT JOIN geography_currentskill
+                        ON geography_currentskill.place_id = geography_place.id
+                        AND geography_currentskill.user_id = %s
+                    LEFT JOIN geography_answerstats
+                        ON geography_answerstats.place_id = geography_place.id
+                        AND geography_answerstats.user_id = %s
+                WHERE geography_place.id IN (''' + ','.join([str(i) for i in place_ids]) + ''')
+                ''', [self._user_id, self._user_id, self._user_id])
+            for place_id, difficulty, current_skill, answers_num, last_time, prior_skill in cursor.fetchall():
+                self._difficulty[place_id] = difficulty
+                if current_skill is not None:
+                    self._current_skill[place_id] = current_skill
+                if answers_num > 0:
+                    self._answers_num[place_id] = answers_num
+                    self._last_time[place_id] = last_time
+                if self._prior_skill is None:
+                    self._prior_skill = prior_skill
+        self._place_ids.update(place_ids)
 
-    def flush_all(self, prior_skill, current_skill, difficulty):
-        sql = '''INSERT INTO geography_priorskill (user_id, value)
-                VALUES ''' + ','.join(self._prior_skill_values()) + ';'
-        sql += '''
-                INSERT INTO geography_difficulty (place_id, value)
-                VALUES''' + ','.join(self._difficulty_values()) + ';'
-        sql += '''
-                INSERT INTO geography_currentskill (user_id, place_id, value)
-                VALUES ''' + ','.join(self._current_skill_values()) + ';'
-        return sql
-
-    def _difficulty_values(self):
-        return [
-            '({}, {})'.format(place_id, difficulty)
-            for place_id, difficulty in self._difficulty.iteritems()
-        ]
+    def answers_nums(self, user_ids, place_ids):
+        if not self._is_preloaded(user_ids, place_ids):
+            return DatabaseEnvironment.answers_nums(self, user_ids, place_ids)
+        return [self._answers_num.get(i, 0) for i in place_ids]
 
-    def _prior_skill_values(self):
-        return [
-            '({}, {})'.format(user_id, skill)
-            for user_id, skill in self._prior_skill.iteritems()
-        ]
+    def current_skill(self, user_id, place_id, new_value=None):
+        if new_value is not None:
+            DatabaseEnvironment.current_skill(self, user_id, place_id, new_value)
+            if self._is_preloaded([user_id], [place_id]):
+                self._current_skill[place_id] = new_value
+        else:
+            return self.current_skills([user_id], [place_id])[0]
 
-    def _current_skill_values(self):
+    def current_skills(self, user_ids, place_ids):
+        if not self._is_preloaded(user_ids, place_ids):
+            return DatabaseEnvironment.current_skills(self, user_ids, place_ids)
         return [
-            '({}, {}, {})'.format(user_id, place_id, skill)
-            for (user_id, place_id), skill in self._current_skill.iteritems()
+            self._current_skill.get(i, self._prior_skill - self._difficulty[i])
+            for i in place_ids
         ]
 
+    def difficulty(self, place_id, new_value=None):
+        if new_value:
+            DatabaseEnvironment.difficulty(self, place_id, new_value)
+            if place_id in self._place_ids:
+                self._difficulty[place_id] = new_value
+        else:
+            return self.difficulties([place_id])
+
+    def difficulties(self, place_ids):
+        if not all([i in self._place_ids for i in place_ids]):
+            return DatabaseEnvironment.difficulties(self, place_ids)
+        return [self._difficulty[i] for i in place_ids]
+
+    def first_answers_nums(self, user_ids, place_ids):
+        if not self._is_preloaded(user_ids, place_ids):
+            return DatabaseEnvironment.first_answers_nums(self, user_ids, place_ids)
+        return [1 if self._answers_num.get(i, 0) > 0 else 0 for i in place_ids]
+
+    def last_times(self, user_ids, place_ids):
+        if not self._is_preloaded(user_ids, place_ids):
+            return DatabaseEnvironment.last_times(self, user_ids, place_ids)
+        return [self._last_time.get(i) for i in place_ids]
+
+    def prior_skill(self, user_id, new_value=None):
+        if new_value is not None:
+            DatabaseEnvironment.prior_skill(self, user_id, new_value)
+            if user_id == self._user_id and self._prior_skill is not None:
+                self._prior_skill = new_value
+        else:
+            return self.prior_skills([user_id])[0]
+
+    def prior_skills(self, user_ids):
+        if self._prior_skill is None or any([i != self._user_id for i in user_ids]):
+            return DatabaseEnvironment.prior_skills(self, user_ids)
+        return [self._prior_skill for i in user_ids]
+
+    def process_answer(self, user_id, place_asked_id, place_answered_id, inserted):
+        if user_id != self._user_id:
+            return
+        self._rolling_success = {}
+        if place_asked_id in self._place_ids:
+            self._answers_num[place_asked_id] = self._answers_num.get(place_asked_id, 0) + 1
+            self._last_time[place_asked_id] = inserted
+
+    def rolling_success(self, user_id, n=10):
+        if user_id != self._user_id:
+            return DatabaseEnvironment.rolling_success(self, user_id, n)
+        if n not in self._rolling_success:
+            self._rolling_success[n] = DatabaseEnvironment.rolling_success(self, user_id, n)
+        return self._rolling_success[n]
+
+    def _is_preloaded(self, user_ids, place_ids):
+        return (
+            all([i == self._user_id for i in user_ids]) and
+            all([i in self._place_ids for i in place_ids]))
+
+
+class InMemoryEnvironmentWithFlush(InMemoryEnvironment):
+
+    flush_batch_size = 1000
+
+    def __init__(self):
+        InMemoryEnvironment.__init__(self)
+        self.reset_changes()
+
+    def current_skill(self, user_id, place_id, new_value=None):
+        if new_value is not None:
+            self._changed_current_skill.add((user_id, place_id))
+        return InMemoryEnvironment.current_skill(self, user_id, place_id, new_value)
+
+    def difficulty(self, place_id, new_value=None):
+        if new_value is not None:
+            self._changed_difficulty.add(place_id)
+        return InMemoryEnvironment.difficulty(self, place_id, new_value)
+
+    def prior_skill(self, user_id, new_value=None):
+        if new_value is not None:
+            self._changed_prior_skill.add(user_id)
+        return InMemoryEnvironment.prior_skill(self, user_id, new_value)
+
+    def changed_current_skills(self):
+        """
+        Returns triples user id, place id and value of the current skills
+        changed since the last call of 'reset_changes'.
+        """
+        return (
+            (user_id, place_id, self._current_skill[user_id, place_id])
+            for (user_id, place_id) in self._changed_current_skill
+        )
+
+    def reset_changes(self):
+        self._changed_current_skill = set()
+        self._changed_difficulty = set()
+        self._changed_prior_skill = set()
+
+    def flush_all(self, prior_skill, current_skill, difficulty):
+        """
+        Returns a generator of INSERT statements, each of them inserts at most
+        'flush_batch_size' rows.
+        """
+        return itertools.chain(
+            self._inserts(
+                'INSERT INTO geography_priorskill (user_id, value) VALUES ',
+                self._prior_skill_values()),
+            self._inserts(
+                'INSERT INTO geography_difficulty (place_id, value) VALUES ',
+                self._difficulty_values()),
+            self._inserts(
+                'INSERT INTO geography_currentskill (user_id, place_id, value) VALUES ',
+                self._current_skill_values()))
+
+    def flush_changed(self):
+        """
+        Returns a generator of statements inserting or updating only the
+        values changed since the last call of 'reset_changes'.
+        """
+        upsert = ' ON DUPLICATE KEY UPDATE value = VALUES(value)'
+        return itertools.chain(
+            self._inserts(
+                'INSERT INTO geography_priorskill (user_id, value) VALUES ',
+                self._prior_skill_values(self._changed_prior_skill),
+                upsert),
+            self._inserts(
+                'INSERT INTO geography_difficulty (place_id, value) VALUES ',
+                self._difficulty_values(self._changed_difficulty),
+                upsert),
+            self._inserts(
+                'INSERT INTO geography_currentskill (user_id, place_id, value) VALUES ',
+                self._current_skill_values(self._changed_current_skill),
+                upsert))
+
+    def _inserts(self, insert, values, suffix=''):
+        batch = []
+        for value in values:
+            batch.append(value)
+            if len(batch) == self.flush_batch_size:
+                yield insert + ','.join(batch) + suffix + ';'
+                batch = []
+        if len(batch) > 0:
+            yield insert + ','.join(batch) + suffix + ';'
+
+    def _difficulty_values(self, place_ids=None):
+        if place_ids is None:
+            place_ids = self._difficulty.iterkeys()
+        return (
+            '({}, {})'.format(place_id, self._difficulty[place_id])
+            for place_id in place_ids
+        )
+
+    def _prior_skill_values(self, user_ids=None):
+        if user_ids is None:
+            user_ids = self._prior_skill.iterkeys()
+        return (
+            '({}, {})'.format(user_id, self._prior_skill[user_id])
+            for user_id in user_ids
+        )
+
+    def _current_skill_values(self, keys=None):
+        if keys is None:
+            keys = self._current_skill.iterkeys()
+        return (
+            '({}, {}, {})'.format(user_id, place_id, self._current_skill[user_id, place_id])
+            for (user_id, place_id) in keys
+        )
+
 
 class DifficultyManager(models.Manager):
 
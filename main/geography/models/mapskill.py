@@ -1,55 +1,242 @@
 # -*- coding: utf-8 -*-
-from django.db import models
+from django.db import models, connection, transaction
 from place import Place
 from django.contrib.auth.models import User
+from contextlib import closing
+from math import log
 
 LEARNED_PROB = 0.9
 
+# current skill for which the probability of the correct answer is LEARNED_PROB
+LEARNED_SKILL = log(LEARNED_PROB / (1 - LEARNED_PROB))
+
+
+class MapSkillStatsManager(models.Manager):
+
+    def update_with_current_skill(self, user_id, place_id, old_value, new_value):
+        """
+        Updates the numbers of learned and practiced places on all maps with
+        the given place when the current skill of the user is changed, the
+        old value is None if the user had no current skill for the place.
+        """
+        learned = int(new_value >= LEARNED_SKILL)
+        practiced = 1 - learned
+        if old_value is not None:
+            was_learned = int(old_value >= LEARNED_SKILL)
+            if was_learned == learned:
+                return
+            learned -= was_learned
+            practiced -= 1 - was_learned
+        with closing(connection.cursor()) as cursor:
+            cursor.execute(
+                '''
+                INSERT INTO geography_mapskillstats
+                    (user_id, place_id, type, learned, practiced)
+                SELECT
+                    %s,
+                    geography_placerelation.place_id,
+                    geography_place.type,
+                    %s,
+                    %s
+                FROM
+                    geography_placerelation
+                    INNER JOIN geography_placerelation_related_places
+                        ON geography_placerelation.id =
+                            geography_placerelation_related_places.placerelation_id
+                    INNER JOIN geography_place
+                        ON geography_place.id = geography_placerelation_related_places.place_id
+                WHERE
+                    (geography_placerelation.type = 1 OR
+                    geography_placerelation.type = 4 ) AND
+                    geography_placerelation_related_places.place_id = %s
+                ON DUPLICATE KEY UPDATE
+                    learned = learned + VALUES(learned),
+                    practiced = practiced + VALUES(practiced)
+                ''', [user_id, learned, practiced, place_id])
+        transaction.commit_unless_managed()
+
+    def rebuild(self):
+        with closing(connection.cursor()) as cursor:
+            for sql in self.rebuild_sql():
+                cursor.execute(sql)
+        transaction.commit_unless_managed()
+
+    def update_sql(self, current_skills, batch_size=1000):
+        """
+        Returns a generator of statements updating the numbers of learned and
+        practiced places when the current skills stored in the database are
+        replaced by the given ones (triples user id, place id and value). The
+        statements have to be executed before the current skills are stored,
+        each of them handles at most 'batch_size' current skills.
+        """
+        batch = []
+        for current_skill in current_skills:
+            batch.append(current_skill)
+            if len(batch) == batch_size:
+                yield self._update_sql(batch)
+                batch = []
+        if len(batch) > 0:
+            yield self._update_sql(batch)
+
+    def rebuild_sql(self):
+        """
+        Returns SQL statements computing the numbers of learned and practiced
+        places from scratch. They have to be executed whenever current skills
+        or maps are changed in bulk. The numbers are computed in a new table
+        which replaces the old one at once, so the old numbers are available
+        until the new ones are complete.
+        """
+        return [
+            'DROP TABLE IF EXISTS geography_mapskillstats_new;',
+            'CREATE TABLE geography_mapskillstats_new LIKE geography_mapskillstats;',
+            '''
+            INSERT INTO geography_mapskillstats_new
+                (user_id, place_id, type, learned, practiced)
+            SELECT
+                geography_currentskill.user_id,
+                geography_placerelation.place_id,
+                geography_place.type,
+                COUNT(IF(geography_currentskill.value >= {0!r}, 1, NULL)),
+                COUNT(IF(geography_currentskill.value < {0!r}, 1, NULL))
+            FROM
+                geography_currentskill
+                INNER JOIN geography_placerelation_related_places
+                    ON geography_placerelation_related_places.place_id = geography_currentskill.place_id
+                INNER JOIN geography_placerelation
+                    ON geography_placerelation.id =
+                        geography_placerelation_related_places.placerelation_id
+                INNER JOIN geography_place
+                    ON geography_place.id = geography_currentskill.place_id
+            WHERE
+                (geography_placerelation.type = 1 OR
+                geography_placerelation.type = 4 )
+            GROUP BY
+                geography_currentskill.user_id,
+                geography_placerelation.place_id,
+                geography_place.type;
+            '''.format(LEARNED_SKILL),
+            '''
+            RENAME TABLE
+                geography_mapskillstats TO geography_mapskillstats_old,
+                geography_mapskillstats_new TO geography_mapskillstats;
+            ''',
+            'DROP TABLE geography_mapskillstats_old;',
+        ]
+
+    def _update_sql(self, current_skills):
+        return '''
+            INSERT INTO geography_mapskillstats
+                (user_id, place_id, type, learned, practiced)
+            {0}
+            ON DUPLICATE KEY UPDATE
+                geography_mapskillstats.learned = geography_mapskillstats.learned + VALUES(learned),
+                geography_mapskillstats.practiced = geography_mapskillstats.practiced + VALUES(practiced);
+            '''.format(self._changes_sql(current_skills))
+
+    def _changes_sql(self, current_skills):
+        # the current skills stored in the database are read in the same
+        # statement, so they are locked until the transaction replacing them
+        # is committed
+        new_values = ' UNION ALL '.join([
+            'SELECT {0} AS user_id, {1} AS place_id, {2} AS value'.format(user_id, place_id, value)
+            for (user_id, place_id, value) in current_skills
+        ])
+        return '''
+            SELECT
+                changes.user_id,
+                geography_placerelation.place_id,
+                geography_place.type,
+                SUM(changes.learned_delta),
+                SUM(changes.practiced_delta)
+            FROM
+                (
+                    SELECT
+                        new_values.user_id AS user_id,
+                        new_values.place_id AS place_id,
+                        (new_values.value >= {0!r}) -
+                            COALESCE(geography_currentskill.value >= {0!r}, 0) AS learned_delta,
+                        (new_values.value < {0!r}) -
+                            COALESCE(geography_currentskill.value < {0!r}, 0) AS practiced_delta
+                    FROM
+                        ({1}) AS new_values
+                        LEFT JOIN geography_currentskill
+                            ON geography_currentskill.user_id = new_values.user_id
+                            AND geography_currentskill.place_id = new_values.place_id
+                ) AS changes
+                INNER JOIN geography_placerelation_related_places
+                    ON geography_placerelation_related_places.place_id = changes.place_id
+                INNER JOIN geography_placerelation
+                    ON geography_placerelation.id =
+                        geography_placerelation_related_places.placerelation_id
+                INNER JOIN geography_place
+                    ON geography_place.id = changes.place_id
+            WHERE
+                (geography_placerelation.type = 1 OR
+                geography_placerelation.type = 4 ) AND
+                (changes.learned_delta != 0 OR changes.practiced_delta != 0)
+            GROUP BY
+                changes.user_id,
+                geography_placerelation.place_id,
+                geography_place.type
+            '''.format(LEARNED_SKILL, new_values)
+
+
+class MapSkillStats(models.Model):
+
+    user = models.ForeignKey(User)
+    place = models.ForeignKey(Place)
+    type = models.IntegerField(choices=Place.PLACE_TYPES)
+    learned = models.IntegerField(default=0)
+    practiced = models.IntegerField(default=0)
+
+    objects = MapSkillStatsManager()
+
+    class Meta:
+        app_label = 'geography'
+        unique_together = ('user', 'place', 'type')
+
 
 class MapSkillManager(models.Manager):
 
     def for_user(self, user):
         return self.raw("""
     SELECT
-        geography_currentskill_prepared.user_id * 100000 + geography_placerelation.place_id AS dummy_id,
-        geography_placerelation.place_id AS place_id,
-        geography_place_related.type AS type,
-        geography_currentskill_prepared.user_id AS user_id,
+        %s * 100000 + map_types.place_id AS dummy_id,
+        map_types.place_id AS place_id,
+        map_types.type AS type,
+        %s AS user_id,
         geography_place.name AS name,
         geography_place.code AS code,
-        COUNT( IF(
-            1/(1+EXP(-geography_currentskill_prepared.currentskill)) >= %s,
-            1,
-            NULL
-        )) AS learned,
-        COUNT( IF(
-            1/(1+EXP(-geography_currentskill_prepared.currentskill)) < %s,
-            1,
-            NULL
-        )) AS practiced
+        COALESCE(geography_mapskillstats.learned, 0) AS learned,
+        COALESCE(geography_mapskillstats.practiced, 0) AS practiced
     FROM
-        geography_placerelation
-        INNER JOIN geography_placerelation_related_places
-            ON geography_placerelation.id =
-                geography_placerelation_related_places.placerelation_id
-        INNER JOIN geography_currentskill_prepared
-            ON geography_placerelation_related_places.place_id =
-                geography_currentskill_prepared.place_id
-        INNER JOIN geography_place AS geography_place_related
-            ON geography_place_related.id = geography_placerelation_related_places.place_id
+        (
+            SELECT
+                geography_placerelation.place_id AS place_id,
+                geography_place_related.type AS type
+            FROM
+                geography_placerelation
+                INNER JOIN geography_placerelation_related_places
+                    ON geography_placerelation.id =
+                        geography_placerelation_related_places.placerelation_id
+                INNER JOIN geography_place AS geography_place_related
+                    ON geography_place_related.id = geography_placerelation_related_places.place_id
+            WHERE
+                (geography_placerelation.type = 1 OR
+                geography_placerelation.type = 4 )
+            GROUP BY
+                geography_placerelation.place_id,
+                geography_place_related.type
+        ) AS map_types
         INNER JOIN geography_place
-            ON geography_place.id = geography_placerelation.place_id
-    WHERE
-        (geography_placerelation.type = 1 OR
-        geography_placerelation.type = 4 ) AND
-        geography_currentskill_prepared.user_id = %s
-    GROUP BY
-        geography_placerelation.place_id,
-        geography_currentskill_prepared.user_id,
-        geography_place_related.type
+            ON geography_place.id = map_types.place_id
+        LEFT JOIN geography_mapskillstats
+            ON geography_mapskillstats.place_id = map_types.place_id
+            AND geography_mapskillstats.type = map_types.type
+            AND geography_mapskillstats.user_id = %s
     ORDER BY
         geography_place.name
-        """, [LEARNED_PROB, LEARNED_PROB, user.id]
+        """, [user.id, user.id, user.id]
         )
 
 
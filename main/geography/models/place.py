@@ -2,9 +2,14 @@
 from django.db import models
 from django.template.defaultfilters import slugify
 from django.db import connection
+from django.core.cache import cache
 from contextlib import closing
 import proso.geography.recommendation as recommendation
+import recommendation as vectorized_recommendation
+import itertools
 import logging
+import random
+import uuid
 
 LOGGER = logging.getLogger(__name__)
 
@@ -17,12 +22,62 @@ class WeghtedPlace:
         self.weight = weight
 
 
+class MapIndex:
+
+    """
+    Places on maps indexed by map and type. The place objects are shared by
+    all requests served by the process, so they mustn't be modified.
+    """
+
+    def __init__(self, version, place_ids, places):
+        self.version = version
+        self._place_ids = place_ids
+        self._places = places
+        self._questions = {}
+
+    def place_ids(self, map_place_id, place_types):
+        "Returns sorted ids of places of the given types on the given map"
+        by_type = self._place_ids.get(map_place_id, {})
+        return sorted(itertools.chain(*[by_type.get(t, []) for t in place_types]))
+
+    def place(self, place_id):
+        return self._places[place_id]
+
+    def question(self, place, map_place):
+        """
+        Returns the part of the question for the given place on the given map
+        which is the same for all users. It is built once per index, so it
+        is shared by all requests and mustn't be modified.
+        """
+        key = (place.id, map_place.place_id)
+        question = self._questions.get(key)
+        if question is None:
+            options = place.options
+            question = {
+                'type': '2' + str(len(options)),
+                'text': place.text,
+                'asked_code': place.code,
+                'map_code': map_place.place.code,
+                'place': place.name,
+                'options': options,
+                'points_count': Place.TEST_COMPOSITION[place.type][2],
+            }
+            self._questions[key] = question
+        return question
+
+
 class PlaceManager(models.Manager):
 
+    MAP_INDEX_VERSION_KEY = 'geography_map_index_version'
+
+    MAP_INDEX_VERSION_TIMEOUT = 365 * 24 * 60 * 60
+
+    _map_index = None
+
     DEFAULT_RECOMMENDATION_STRATEGY = 'recommendation_by_additive_function'
 
     RECOMMENDATION_STRATEGIES = {
-        DEFAULT_RECOMMENDATION_STRATEGY: recommendation.by_additive_function,
+        DEFAULT_RECOMMENDATION_STRATEGY: vectorized_recommendation.by_additive_function,
         'recommendation_by_random': recommendation.by_random
     }
 
@@ -48,11 +103,53 @@ class PlaceManager(models.Manager):
             Place.AB_REASON_RECOMMENDATION)
         strategy = PlaceManager.RECOMMENDATION_STRATEGIES[strategy_name]
         options_strategy = PlaceManager.OPTIONS_STRATEGIES[options_strategy_name]
+        map_index = self.get_map_index()
+        available_place_ids = map_index.place_ids(map_place.place_id, place_types)
+        knowledge_env.preload(available_place_ids)
+        candidates = strategy(
+            user.id,
+            available_place_ids,
+            knowledge_env,
+            n,
+            options_strategy=options_strategy)
+        targets, options_flatten = zip(*candidates)
+        targets_places = map(map_index.place, targets)
+        options_flatten_places = map(
+            lambda os: map(map_index.place, os),
+            options_flatten)
+        return zip(targets_places, options_flatten_places)
+
+    def get_map_index(self):
+        """
+        Returns the index of places on maps. The index is loaded once per
+        process and reloaded when the version stamp in the cache changes.
+        """
+        version = cache.get(PlaceManager.MAP_INDEX_VERSION_KEY)
+        if version is None:
+            cache.add(PlaceManager.MAP_INDEX_VERSION_KEY, uuid.uuid4().hex, PlaceManager.MAP_INDEX_VERSION_TIMEOUT)
+            version = cache.get(PlaceManager.MAP_INDEX_VERSION_KEY)
+        map_index = PlaceManager._map_index
+        if map_index is None or map_index.version != version:
+            map_index = self._load_map_index(version)
+            PlaceManager._map_index = map_index
+        return map_index
+
+    def bump_map_index_version(self):
+        """
+        Makes all processes reload the index of places on maps, has to be
+        called whenever places or maps are changed.
+        """
+        cache.set(PlaceManager.MAP_INDEX_VERSION_KEY, uuid.uuid4().hex, PlaceManager.MAP_INDEX_VERSION_TIMEOUT)
+
+    def _load_map_index(self, version):
+        place_ids = {}
         with closing(connection.cursor()) as cursor:
             cursor.execute(
                 '''
                 SELECT
-                    geography_placerelation_related_places.place_id
+                    geography_placerelation.place_id,
+                    geography_place.type,
+                    geography_place.id
                 FROM
                     geography_placerelation
                     INNER JOIN geography_placerelation_related_places
@@ -60,35 +157,34 @@ class PlaceManager(models.Manager):
                     INNER JOIN geography_place
                         ON geography_placerelation_related_places.place_id = geography_place.id
                 WHERE
-                    geography_placerelation.place_id = %s
-                    AND
                     geography_placerelation.type = %s
-                    AND
-                    geography_place.type IN ''' + str(tuple(place_types)).replace(',)', ')') + '''
-                GROUP BY geography_place.id
                 ORDER BY geography_place.id
                 ''',
-                [
-                    int(map_place.place.id),
-                    int(PlaceRelation.IS_ON_MAP)
-                ])
-            available_place_ids = [p[0] for p in cursor.fetchall()]
-        candidates = strategy(
-            user.id,
-            available_place_ids,
-            knowledge_env,
-            n,
-            options_strategy=options_strategy)
-        targets, options_flatten = zip(*candidates)
-        options = [o for os in options_flatten for o in os]
-        all_ids = set(list(targets) + list(options))
-        all_places = self.filter(id__in=all_ids)
-        all_places_dict = dict([(p.id, p) for p in all_places])
-        targets_places = map(lambda i: all_places_dict[i], targets)
-        options_flatten_places = map(
-            lambda os: map(lambda i: all_places_dict[i], os),
-            options_flatten)
-        return zip(targets_places, options_flatten_places)
+                [int(PlaceRelation.IS_ON_MAP)])
+            for map_place_id, place_type, place_id in cursor.fetchall():
+                place_ids.setdefault(map_place_id, {}).setdefault(place_type, []).append(place_id)
+        places = dict([
+            (p.id, p)
+            for p in self.filter(placerelation__type__in=[
+                PlaceRelation.IS_ON_MAP,
+                PlaceRelation.IS_TOO_SMALL_ON_MAP]).distinct()
+        ])
+        return MapIndex(version, place_ids, places)
+
+    def get_test(self, map_place_id):
+        """
+        Returns places for a practice test on the given map, the number of
+        places of each type is given by Place.TEST_COMPOSITION.
+        """
+        map_index = self.get_map_index()
+        return map(map_index.place, self.generate_test(map_index, map_place_id))
+
+    def generate_test(self, map_index, map_place_id):
+        test = []
+        for place_type, count, points in Place.TEST_COMPOSITION:
+            place_ids = map_index.place_ids(map_place_id, [place_type])
+            test += random.sample(place_ids, min(count, len(place_ids)))
+        return test
 
     def get_states_with_map(self):
         return [pr.place for pr in PlaceRelation.objects.filter(
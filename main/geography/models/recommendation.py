@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from proso.geography import current, recommendation
+from proso.geography.recommendation import OPTIONS_NAIVE, OPTIONS_RANDOM, TARGET_PROBABILITY
+import datetime
+import numpy
+
+
+WEIGHT_PROBABILITY = 10
+WEIGHT_NUMBER_OF_ANSWERS = 5
+WEIGHT_TIME_AGO = 120
+
+NEVER_SECONDS_AGO = 315360000
+
+
+def by_additive_function(user_id, place_ids, env, n, options_strategy=OPTIONS_NAIVE, target_probability=TARGET_PROBABILITY):
+    """
+    The same strategy as proso.geography.recommendation.by_additive_function,
+    but the scores of all places are computed at once using numpy arrays.
+    Places with the same score are ordered by their position in the given
+    list.
+    """
+    if n <= 0:
+        return []
+    user_ids = [user_id for i in place_ids]
+    target_prob = recommendation.adjust_target_probability(
+        target_probability,
+        env.rolling_success(user_id))
+    now = datetime.datetime.now()
+    seconds_ago = numpy.array([
+        (now - x).total_seconds() if x is not None else NEVER_SECONDS_AGO
+        for x in env.last_times(user_ids=user_ids, place_ids=place_ids)
+    ], dtype=float)
+    nums_of_ans = numpy.array(env.answers_nums(user_ids=user_ids, place_ids=place_ids), dtype=float)
+    current_skills = numpy.array(env.current_skills(user_ids=user_ids, place_ids=place_ids), dtype=float)
+    current_skills += current.TIME_SHIFT / numpy.maximum(seconds_ago, 0.001)
+    estimated = 1.0 / (1 + numpy.exp(-current_skills))
+    score_time = -1.0 / numpy.maximum(seconds_ago, 1)
+    score_num = 1.0 / numpy.sqrt(nums_of_ans + 1)
+    diff = target_prob - estimated
+    sign = numpy.where(diff > 0, 1, -1)
+    score_prob = 1 - numpy.abs(diff) / numpy.maximum(0.001, numpy.abs(target_prob - 0.5 + sign * 0.5))
+    scores = WEIGHT_TIME_AGO * score_time + WEIGHT_NUMBER_OF_ANSWERS * score_num + WEIGHT_PROBABILITY * score_prob
+    chosen = _top(scores, n)
+    targets = [place_ids[i] for i in chosen]
+    if options_strategy == OPTIONS_RANDOM:
+        return zip(targets, map(lambda t: recommendation._options_random(place_ids), targets))
+    elif options_strategy == OPTIONS_NAIVE:
+        t_user_ids = [user_id for i in targets]
+        confused_indexes = map(lambda target: env.confused_index(target, place_ids), targets)
+        have_answer = env.have_answer(user_ids=t_user_ids, place_ids=targets)
+        return zip(targets, map(
+            lambda (t, e, h, c): recommendation._options_naive(place_ids, t, target_prob, e, h, c),
+            zip(targets, estimated[chosen].tolist(), have_answer, confused_indexes)))
+    else:
+        raise Exception('unknown strategy for generating options:', options_strategy)
+
+
+def _top(scores, n):
+    """
+    Returns indexes of n highest scores ordered by score (descending) and
+    index (ascending).
+    """
+    if n < len(scores):
+        threshold = scores[numpy.argpartition(-scores, n - 1)[n - 1]]
+        greater = numpy.flatnonzero(scores > threshold)
+        equal = numpy.flatnonzero(scores == threshold)[:n - len(greater)]
+        chosen = numpy.concatenate((greater, equal))
+    else:
+        chosen = numpy.arange(len(scores))
+    return chosen[numpy.lexsort((chosen, -scores[chosen]))]
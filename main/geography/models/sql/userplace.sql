@@ -16,21 +16,7 @@ CREATE OR REPLACE VIEW geography_priorskill_prepared AS
 		LEFT JOIN geography_priorskill
 			ON geography_priorskill.user_id = auth_user.id;
 
-CREATE OR REPLACE VIEW geography_currentskill_prepared AS
-	SELECT
-		geography_priorskill_prepared.user_id AS user_id,
-		geography_difficulty_prepared.place_id AS place_id,
-		geography_priorskill_prepared.value AS skill,
-		geography_difficulty_prepared.value AS difficulty,
-		COALESCE(
-			geography_currentskill.value,
-			geography_priorskill_prepared.value - geography_difficulty_prepared.value
-		) AS value,
-		geography_currentskill.value AS currentskill
-	FROM
-		geography_priorskill_prepared
-		LEFT JOIN geography_difficulty_prepared ON true
-		LEFT JOIN geography_currentskill USING(user_id, place_id);
+DROP VIEW IF EXISTS geography_currentskill_prepared;
 
 CREATE OR REPLACE VIEW geography_userplace AS
 	SELECT
@@ -1,13 +1,13 @@
 from django.contrib.auth.models import User
 from lazysignup.models import LazyUser
-from django.db import connection
-from contextlib import closing
+from userprofile import UserProfile
 
 
 def convert_lazy_user(user):
     LazyUser.objects.filter(user=user).delete()
     user.username = get_unused_username(user)
     user.save()
+    UserProfile.objects.update_with_user(user)
 
 
 def is_username_present(username):
@@ -19,7 +19,7 @@ def is_username_present(username):
 def is_lazy(user):
     if user.is_anonymous() or len(user.username) != 30:
         return False
-    return bool(LazyUser.objects.filter(user=user).count() > 0)
+    return UserProfile.objects.from_user(user).is_lazy
 
 
 def is_named(user):
@@ -39,19 +39,9 @@ def get_unused_username(user):
 
 
 def get_points(user):
-    with closing(connection.cursor()) as cursor:
-        cursor.execute(
-            '''
-            SELECT
-                COUNT(geography_answer.id)
-            FROM
-                geography_answer
-            WHERE
-                user_id = %s
-                AND
-                geography_answer.place_asked_id = geography_answer.place_answered_id
-            ''', [user.id])
-        return cursor.fetchone()[0]
+    if user.is_anonymous():
+        return 0
+    return UserProfile.objects.from_user(user).points
 
 
 def to_serializable(user):
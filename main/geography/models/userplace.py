@@ -1,20 +1,68 @@
 # -*- coding: utf-8 -*-
 from django.db import models
+from django.db.models import Sum
+from django.core.cache import cache
 from place import Place
+from knowledge import PriorSkill
+from answerstats import AnswerStats
 from django.contrib.auth.models import User
 from math import exp, ceil
 
 
 class UserPlaceManager(models.Manager):
 
+    # skills of places the user hasn't answered depend on difficulties
+    # changed by other users, so the summary expires after some time anyway
+    SUMMARY_EXPIRE_SECONDS = 60 * 60
+
+    def summary_for_user_and_map(self, user, map):
+        """
+        Returns the user's skills for places on the map ordered by name, the
+        average skill for each type of places and the expected number of
+        points in the test. The summary is cached until the user's answers
+        are processed.
+        """
+        answers_num = AnswerStats.objects.filter(user=user).aggregate(
+            Sum('answers_num'))['answers_num__sum'] or 0
+        cache_key = 'user_places_summary_{0}_{1}_{2}_{3}'.format(
+            user.id, map.place_id, answers_num, Place.objects.get_map_index().version)
+        summary = cache.get(cache_key)
+        if summary is None:
+            summary = self._compute_summary(user, map)
+            cache.set(cache_key, summary, UserPlaceManager.SUMMARY_EXPIRE_SECONDS)
+        return summary
+
+    def _compute_summary(self, user, map):
+        skills = []
+        types = {}
+        for up in self.for_user_and_map_prepared(user, map):
+            skills.append((up.related_place_id, up.skill, up.currentskill is not None))
+            count, total = types.get(up.type, (0, 0))
+            types[up.type] = (count + 1, total + up.skill)
+        types = dict([(t, (n, skill_sum / n)) for (t, (n, skill_sum)) in types.iteritems()])
+        expected_points = 0
+        for t, (n, skill) in types.iteritems():
+            tc = Place.TEST_COMPOSITION[t]
+            expected_points += tc[1] * tc[2] * 1.0 / (1 + exp(-skill))
+        return {
+            'skills': skills,
+            'types': types,
+            'expected_points': round(expected_points),
+        }
+
     def for_user_and_map_prepared(self, user, map):
+        prior_skill = PriorSkill.objects.from_user(user).value
         return self.raw("""
     SELECT
-        geography_currentskill_prepared.user_id * 100000 + geography_placerelation.place_id AS dummy_id,
+        %s * 100000 + geography_placerelation.place_id AS dummy_id,
         geography_placerelation.place_id AS place_id,
-        geography_currentskill_prepared.user_id AS user_id,
-        geography_currentskill_prepared.currentskill AS currentskill,
-        geography_currentskill_prepared.value AS skill,
+        geography_place.id AS related_place_id,
+        %s AS user_id,
+        geography_currentskill.value AS currentskill,
+        COALESCE(
+            geography_currentskill.value,
+            %s - COALESCE(geography_difficulty.value, 0)
+        ) AS skill,
         geography_place.type AS type,
         geography_place.name AS name,
         geography_place.code AS code,
@@ -28,19 +76,20 @@ class UserPlaceManager(models.Manager):
         INNER JOIN geography_placerelation_related_places
             ON geography_placerelation.id =
                 geography_placerelation_related_places.placerelation_id
-        INNER JOIN geography_currentskill_prepared
-            ON geography_placerelation_related_places.place_id =
-                geography_currentskill_prepared.place_id
         INNER JOIN geography_place
             ON geography_place.id = geography_placerelation_related_places.place_id
+        LEFT JOIN geography_difficulty
+            ON geography_difficulty.place_id = geography_place.id
+        LEFT JOIN geography_currentskill
+            ON geography_currentskill.place_id = geography_place.id
+            AND geography_currentskill.user_id = %s
     WHERE
         (geography_placerelation.type = 1 OR
         geography_placerelation.type = 4 ) AND
-        geography_currentskill_prepared.user_id = %s AND
         geography_placerelation.place_id = %s
     ORDER BY
         geography_place.name;
-        """, [user.id, map.place.id]
+        """, [user.id, user.id, prior_skill, user.id, map.place.id]
         )
 
     def from_user_and_place(self, user, place):
@@ -64,20 +113,24 @@ class UserPlace(models.Model):
     objects = UserPlaceManager()
 
     def to_serializable(self):
-        probability = 1.0 / (1 + exp(-self.skill))
+        return UserPlace.serialize(self, self.skill, self.currentskill is not None)
+
+    @staticmethod
+    def serialize(place, skill, has_currentskill):
+        probability = 1.0 / (1 + exp(-skill))
         learned = probability > 0.9
         ret = {
-            'code': self.code,
-            'name': self.name,
-            'skill': self.skill,
-            'practiced': self.currentskill is not None and not learned,
+            'code': place.code,
+            'name': place.name,
+            'skill': skill,
+            'practiced': has_currentskill and not learned,
             'learned': learned,
             'displayed': True,
             'probability': ceil(10 * probability) / 10.0,
             'certainty': 1,
-            'text': self.text,
-            'correct': self.correct,
-            'options': [self.option_a, self.option_b, self.option_c],
+            'text': place.text,
+            'correct': place.correct,
+            'options': [place.option_a, place.option_b, place.option_c],
         }
         return ret
 
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+from django.db import models, connection, transaction, IntegrityError
+from django.db.models import Sum
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from lazysignup.models import LazyUser
+from lazysignup.signals import converted
+from answerstats import AnswerStats
+from contextlib import closing
+from datetime import datetime, timedelta
+import random
+import threading
+
+
+class _OrderedKeys:
+
+    """
+    Sorted set of keys which also finds keys by their position. The keys are
+    kept in a treap (binary search tree balanced by random priorities) whose
+    nodes know the sizes of their subtrees, so all operations take
+    O(log n) expected time. Nodes are lists [key, priority, size, left,
+    right].
+    """
+
+    def __init__(self, keys=()):
+        """
+        Args:
+            keys: sorted iterable of distinct keys
+        """
+        # Cartesian tree of the sorted keys and random priorities built in
+        # linear time
+        stack = []
+        for key in keys:
+            node = [key, random.random(), 1, None, None]
+            last = None
+            while stack and stack[-1][1] < node[1]:
+                last = stack.pop()
+            node[3] = last
+            if stack:
+                stack[-1][4] = node
+            stack.append(node)
+        self._root = stack[0] if stack else None
+        self._update_sizes(self._root)
+
+    def __len__(self):
+        return _size(self._root)
+
+    def add(self, key):
+        left, right = self._split(self._root, key)
+        self._root = self._merge(self._merge(left, [key, random.random(), 1, None, None]), right)
+
+    def remove(self, key):
+        left, right = self._split(self._root, key)
+        # the first node of the right part is the removed key
+        self._root = self._merge(left, self._remove_first(right))
+
+    def count_less(self, key):
+        "Returns the number of keys less than the given one"
+        count = 0
+        node = self._root
+        while node is not None:
+            if node[0] < key:
+                count += _size(node[3]) + 1
+                node = node[4]
+            else:
+                node = node[3]
+        return count
+
+    def at(self, index):
+        "Returns the key at the given position (starting with 0)"
+        node = self._root
+        while node is not None:
+            left_size = _size(node[3])
+            if index < left_size:
+                node = node[3]
+            elif index == left_size:
+                return node[0]
+            else:
+                index -= left_size + 1
+                node = node[4]
+        raise IndexError(index)
+
+    def _split(self, node, key):
+        # returns trees with keys less than the given key and the others
+        if node is None:
+            return (None, None)
+        if node[0] < key:
+            left, right = self._split(node[4], key)
+            node[4] = left
+            node[2] = _size(node[3]) + _size(left) + 1
+            return (node, right)
+        else:
+            left, right = self._split(node[3], key)
+            node[3] = right
+            node[2] = _size(right) + _size(node[4]) + 1
+            return (left, node)
+
+    def _merge(self, left, right):
+        # all keys of the left tree are less than the keys of the right one
+        if left is None:
+            return right
+        if right is None:
+            return left
+        if left[1] > right[1]:
+            left[4] = self._merge(left[4], right)
+            left[2] = _size(left[3]) + _size(left[4]) + 1
+            return left
+        else:
+            right[3] = self._merge(left, right[3])
+            right[2] = _size(right[3]) + _size(right[4]) + 1
+            return right
+
+    def _remove_first(self, node):
+        if node[3] is None:
+            return node[4]
+        node[3] = self._remove_first(node[3])
+        node[2] -= 1
+        return node
+
+    def _update_sizes(self, root):
+        # post-order traversal without recursion, the tree may be deep
+        stack = [(root, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if node is None:
+                continue
+            if children_done:
+                node[2] = _size(node[3]) + _size(node[4]) + 1
+            else:
+                stack.append((node, True))
+                stack.append((node[3], False))
+                stack.append((node[4], False))
+
+
+def _size(node):
+    return 0 if node is None else node[2]
+
+
+class Leaderboard:
+
+    """
+    Non-lazy users ordered by points. Users are kept as (-points, user id)
+    keys in an ordered set which finds the position of a key and the key at
+    a position in O(log n) expected time. Users with the same number of
+    points share the rank.
+    """
+
+    def __init__(self, users):
+        """
+        Args:
+            users: iterable of (user id, username, points) tuples
+        """
+        self._usernames = {}
+        self._points = {}
+        for user_id, username, points in users:
+            self._usernames[user_id] = username
+            self._points[user_id] = points
+        self._keys = _OrderedKeys(sorted([(-p, user_id) for user_id, p in self._points.iteritems()]))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, user_id, points, username=None):
+        """
+        Sets the points of the given user, the user is added when he isn't in
+        the leaderboard yet. The username is changed only when it is given.
+        """
+        with self._lock:
+            if user_id in self._points:
+                self._keys.remove((-self._points[user_id], user_id))
+            elif username is None:
+                return
+            if username is not None:
+                self._usernames[user_id] = username
+            self._points[user_id] = points
+            self._keys.add((-points, user_id))
+
+    def add_points(self, user_id, points):
+        with self._lock:
+            if user_id not in self._points:
+                return
+            self._keys.remove((-self._points[user_id], user_id))
+            self._points[user_id] += points
+            self._keys.add((-self._points[user_id], user_id))
+
+    def remove(self, user_id):
+        with self._lock:
+            if user_id not in self._points:
+                return
+            self._keys.remove((-self._points[user_id], user_id))
+            del self._points[user_id]
+            del self._usernames[user_id]
+
+    def top(self, offset=0, limit=None):
+        """
+        Returns (rank, username, points) tuples of users ordered by points
+        starting at the given offset.
+        """
+        with self._lock:
+            end = len(self._keys) if limit is None else min(offset + limit, len(self._keys))
+            keys = [self._keys.at(i) for i in xrange(offset, end)]
+            return [
+                (self._rank(-neg_points), self._usernames[user_id], -neg_points)
+                for neg_points, user_id in keys
+            ]
+
+    def rank(self, user_id):
+        """
+        Returns the rank of the given user (starting with 1) and his points,
+        or None when the user isn't in the leaderboard.
+        """
+        with self._lock:
+            points = self._points.get(user_id)
+            if points is None:
+                return None
+            return (self._rank(points), points)
+
+    def _rank(self, points):
+        return self._keys.count_less((-points,)) + 1
+
+
+class UserProfileManager(models.Manager):
+
+    # other processes may see the old values for this number of seconds
+    EXPIRE_SECONDS = 10
+
+    # how often (in seconds) the leaderboard loaded in memory is refreshed with
+    # the profiles changed by other processes, changes made by the process
+    # itself are applied immediately
+    LEADERBOARD_REFRESH_SECONDS = 10
+
+    # profiles changed this number of seconds before the last refresh are read
+    # again, their changes may have been committed later
+    LEADERBOARD_REFRESH_OVERLAP_SECONDS = 60
+
+    _leaderboard = None
+
+    def from_user(self, user):
+        """
+        Returns the profile of the given user, the profile is created when
+        the user doesn't have it yet.
+        """
+        cache_key = self._cache_key(user.id)
+        profile = cache.get(cache_key)
+        if profile is None:
+            try:
+                profile = self.get(user_id=user.id)
+            except UserProfile.DoesNotExist:
+                profile = self._create(user)
+            cache.set(cache_key, profile, UserProfileManager.EXPIRE_SECONDS)
+        return profile
+
+    def update_with_answer(self, answer_dict):
+        with closing(connection.cursor()) as cursor:
+            # users without profile get it computed when it is needed
+            cursor.execute(
+                '''
+                UPDATE geography_userprofile
+                SET
+                    points = points + %s,
+                    answers_num = answers_num + 1,
+                    updated = %s
+                WHERE user_id = %s
+                ''',
+                [
+                    int(answer_dict['place_asked'] == answer_dict.get('place_answered')),
+                    datetime.now(),
+                    answer_dict['user']
+                ])
+        transaction.commit_unless_managed()
+        cache.delete(self._cache_key(answer_dict['user']))
+        if answer_dict['place_asked'] == answer_dict.get('place_answered'):
+            self._update_leaderboard(lambda l: l.add_points(answer_dict['user'], 1))
+
+    def update_with_user(self, user):
+        "Updates the flags of the user, e.g. after the conversion of lazy user"
+        self.filter(user_id=user.id).update(
+            is_lazy=self._is_lazy(user),
+            is_named=self._is_named(user),
+            updated=datetime.now())
+        cache.delete(self._cache_key(user.id))
+        profile = self.from_user(user)
+        if profile.is_lazy:
+            self._update_leaderboard(lambda l: l.remove(user.id))
+        else:
+            self._update_leaderboard(lambda l: l.update(user.id, profile.points, user.username))
+
+    def leaderboard(self):
+        """
+        Returns the leaderboard of non-lazy users. The leaderboard is shared
+        by all requests served by the process, so it mustn't be modified.
+        It is loaded once per process and then refreshed only with the
+        profiles changed since the last refresh.
+        """
+        now = datetime.now()
+        loaded = UserProfileManager._leaderboard
+        if loaded is None:
+            leaderboard = Leaderboard(
+                self.filter(is_lazy=False).values_list('user_id', 'user__username', 'points'))
+            UserProfileManager._leaderboard = (now, leaderboard)
+            return leaderboard
+        refreshed, leaderboard = loaded
+        if refreshed < now - timedelta(seconds=UserProfileManager.LEADERBOARD_REFRESH_SECONDS):
+            UserProfileManager._leaderboard = (now, leaderboard)
+            changed = self.filter(
+                updated__gte=refreshed - timedelta(seconds=UserProfileManager.LEADERBOARD_REFRESH_OVERLAP_SECONDS))
+            for user_id, username, points, is_lazy in changed.values_list('user_id', 'user__username', 'points', 'is_lazy'):
+                if is_lazy:
+                    leaderboard.remove(user_id)
+                else:
+                    leaderboard.update(user_id, points, username)
+        return leaderboard
+
+    def rebuild(self):
+        with closing(connection.cursor()) as cursor:
+            cursor.execute('DELETE FROM geography_userprofile')
+            cursor.execute(
+                '''
+                INSERT INTO geography_userprofile
+                    (user_id, points, answers_num, is_lazy, is_named, updated)
+                SELECT
+                    auth_user.id,
+                    COALESCE(SUM(geography_answerstats.correct_num), 0),
+                    COALESCE(SUM(geography_answerstats.answers_num), 0),
+                    MAX(lazysignup_lazyuser.id) IS NOT NULL,
+                    auth_user.first_name != '' AND auth_user.last_name != '',
+                    %s
+                FROM auth_user
+                LEFT JOIN geography_answerstats
+                    ON geography_answerstats.user_id = auth_user.id
+                LEFT JOIN lazysignup_lazyuser
+                    ON lazysignup_lazyuser.user_id = auth_user.id
+                GROUP BY auth_user.id
+                ''', [datetime.now()])
+        transaction.commit_unless_managed()
+        UserProfileManager._leaderboard = None
+
+    def _create(self, user):
+        stats = AnswerStats.objects.filter(user_id=user.id).aggregate(
+            Sum('correct_num'), Sum('answers_num'))
+        profile = UserProfile(
+            user_id=user.id,
+            points=stats['correct_num__sum'] or 0,
+            answers_num=stats['answers_num__sum'] or 0,
+            is_lazy=self._is_lazy(user),
+            is_named=self._is_named(user))
+        try:
+            sid = transaction.savepoint()
+            profile.save()
+            transaction.savepoint_commit(sid)
+        except IntegrityError:
+            # the profile has been created by another request meanwhile
+            transaction.savepoint_rollback(sid)
+            return self.get(user_id=user.id)
+        if not profile.is_lazy:
+            self._update_leaderboard(lambda l: l.update(user.id, profile.points, user.username))
+        return profile
+
+    def _update_leaderboard(self, update):
+        loaded = UserProfileManager._leaderboard
+        if loaded is not None:
+            update(loaded[1])
+
+    def _is_lazy(self, user):
+        return LazyUser.objects.filter(user_id=user.id).exists()
+
+    def _is_named(self, user):
+        return bool(user.first_name and user.last_name)
+
+    def _cache_key(self, user_id):
+        return 'user_profile_{0}'.format(user_id)
+
+
+class UserProfile(models.Model):
+
+    user = models.OneToOneField(User)
+    points = models.IntegerField(default=0)
+    answers_num = models.IntegerField(default=0)
+    is_lazy = models.BooleanField(default=False)
+    is_named = models.BooleanField(default=False)
+    updated = models.DateTimeField(default=datetime.now, db_index=True)
+
+    objects = UserProfileManager()
+
+    class Meta:
+        app_label = 'geography'
+
+
+def _update_converted_user(sender, user, **kwargs):
+    UserProfile.objects.update_with_user(user)
+
+converted.connect(_update_converted_user)
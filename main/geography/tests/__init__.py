@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+from geography.tests.test_mapskill import *
+from geography.tests.test_derived_knowledge_data import *
+from geography.tests.test_answer_queue import *
+from geography.tests.test_leaderboard import *
+from geography.tests.test_response import *
+from geography.tests.test_recommendation import *
+from geography.tests.test_db import *
+from geography.tests.test_archive import *
+from geography.tests.test_ab import *
+from geography.tests.test_answerlog import *
+from geography.tests.test_question import *
+from geography.tests.test_cache import *
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from django.contrib.auth.models import User
+from django.test.utils import override_settings
+from django.utils import unittest
+from django.test import SimpleTestCase
+from geography.models.ab import Group, UserValues, Value, ValueStats
+import hashlib
+
+
+@override_settings(AB_ASSIGNMENT='hash')
+class ChooseValueTest(SimpleTestCase):
+
+    def setUp(self):
+        self.group = Group(name='options')
+        self.values = [Value(value='a', probability=30), Value(value='b', probability=70)]
+
+    def choose(self, user_id, values=None):
+        return UserValues.objects._choose_value(User(id=user_id), self.group, values or self.values)
+
+    def test_buckets_by_hash(self):
+        for user_id in range(200):
+            bucket = int(hashlib.md5('{0}:options'.format(user_id)).hexdigest(), 16) % 100
+            expected = self.values[0] if bucket < 30 else self.values[1]
+            self.assertIs(expected, self.choose(user_id))
+
+    def test_same_value_for_the_same_user(self):
+        chosen = self.choose(42)
+        for i in range(5):
+            self.assertIs(chosen, self.choose(42))
+
+    def test_probabilities(self):
+        chosen = [self.choose(user_id) for user_id in range(10000)]
+        first = len([v for v in chosen if v is self.values[0]])
+        self.assertAlmostEqual(0.3, first / 10000.0, delta=0.02)
+
+    def test_value_without_probability_is_never_chosen(self):
+        values = [Value(value='a', probability=0), Value(value='b', probability=100)]
+        for user_id in range(500):
+            self.assertIs(values[1], self.choose(user_id, values))
+
+
+class SuccessRateIntervalTest(unittest.TestCase):
+
+    def interval(self, correct_num, answers_num, **kwargs):
+        return ValueStats(correct_num=correct_num, answers_num=answers_num).success_rate_interval(**kwargs)
+
+    def assertInterval(self, expected, interval):
+        self.assertAlmostEqual(expected[0], interval[0], places=4)
+        self.assertAlmostEqual(expected[1], interval[1], places=4)
+
+    def test_wilson_interval(self):
+        self.assertInterval((0.4902, 0.9433), self.interval(8, 10))
+        self.assertInterval((0.4038, 0.5962), self.interval(50, 100))
+
+    def test_extreme_rates(self):
+        self.assertInterval((0, 0.2775), self.interval(0, 10))
+        self.assertInterval((0.7225, 1), self.interval(10, 10))
+
+    def test_z(self):
+        narrow = self.interval(50, 100, z=1)
+        wide = self.interval(50, 100)
+        self.assertTrue(wide[0] < narrow[0] < 0.5 < narrow[1] < wide[1])
+
+    def test_no_answers(self):
+        self.assertEqual(None, self.interval(0, 0))
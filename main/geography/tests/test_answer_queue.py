@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from django.contrib.auth.models import User
+from django.db import DatabaseError
+from django.test import TransactionTestCase
+from django.test.utils import override_settings
+from geography.models import Answer, AnswerQueue, Place
+from geography.models.answer import AnswerQueueManager
+import logging
+
+
+class AnswerQueueTest(TransactionTestCase):
+
+    def setUp(self):
+        self.listeners = Answer.ON_SAVE_LISTENERS, Answer.AFTER_SAVE_LISTENERS
+        self.processed = []
+        self.failing = set()
+        Answer.ON_SAVE_LISTENERS = []
+        Answer.AFTER_SAVE_LISTENERS = [self.listener]
+        # failures of the listeners are logged
+        logging.disable(logging.ERROR)
+        self.users = [User.objects.create(username=name) for name in ['first', 'second']]
+        self.place = Place.objects.create(code=1, text='?', option_a='a', option_b='b', correct=0, name='1')
+
+    def tearDown(self):
+        Answer.ON_SAVE_LISTENERS, Answer.AFTER_SAVE_LISTENERS = self.listeners
+        logging.disable(logging.NOTSET)
+
+    def listener(self, answer_dict):
+        self.processed.append(answer_dict['id'])
+        if answer_dict['id'] in self.failing:
+            raise Exception('listener failed')
+
+    def queue(self, user):
+        answer = Answer.objects._save({
+            'user': user.id,
+            'place_asked': self.place.id,
+            'place_answered': None,
+            'answer': 1,
+            'place_map': self.place.id,
+            'type': Answer.PICK_NAME,
+            'response_time': 1000,
+            'number_of_options': 0,
+            'inserted': datetime.now(),
+        })
+        AnswerQueue.objects.create(answer=answer, user=user)
+        return answer.id
+
+    def test_process_removes_processed_answers(self):
+        answers = [self.queue(self.users[0]), self.queue(self.users[1])]
+        self.assertEqual(2, AnswerQueue.objects.process())
+        self.assertEqual(answers, self.processed)
+        self.assertEqual(0, AnswerQueue.objects.count())
+
+    def test_failed_answer_stays_in_queue(self):
+        failing = self.queue(self.users[0])
+        waiting = self.queue(self.users[0])
+        other = self.queue(self.users[1])
+        self.failing.add(failing)
+        AnswerQueue.objects.process()
+        # the later answer of the same user waits for the failed one
+        self.assertEqual([failing, other], self.processed)
+        self.assertEqual([(failing, 1), (waiting, 0)], list(AnswerQueue.objects.order_by('id').values_list('answer_id', 'attempts')))
+        self.failing.clear()
+        AnswerQueue.objects.process()
+        self.assertEqual([failing, other, failing, waiting], self.processed)
+        self.assertEqual(0, AnswerQueue.objects.count())
+
+    def test_answer_is_given_up_after_max_attempts(self):
+        failing = self.queue(self.users[0])
+        self.failing.add(failing)
+        for i in range(AnswerQueueManager.MAX_ATTEMPTS + 1):
+            AnswerQueue.objects.process()
+        self.assertEqual(AnswerQueueManager.MAX_ATTEMPTS, len(self.processed))
+        self.assertEqual(1, AnswerQueue.objects.failed())
+        self.assertEqual((0, 0), AnswerQueue.objects.lag())
+
+    @override_settings(ANSWER_QUEUE=True)
+    def test_answer_is_not_saved_without_queue_entry(self):
+        def failing_save(queued):
+            raise DatabaseError('queue entry not saved')
+        save = AnswerQueue.save
+        AnswerQueue.save = failing_save
+        try:
+            with self.assertRaises(DatabaseError):
+                Answer.objects.save_with_listeners({
+                    'user': self.users[0].id,
+                    'place_asked': self.place.id,
+                    'place_answered': None,
+                    'answer': 1,
+                    'place_map': self.place.id,
+                    'type': Answer.PICK_NAME,
+                    'response_time': 1000,
+                    'number_of_options': 0,
+                })
+        finally:
+            AnswerQueue.save = save
+        self.assertEqual(0, Answer.objects.count())
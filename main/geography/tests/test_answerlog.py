@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from django.contrib.auth.models import User
+from django.test import TestCase
+from geography.models import Answer, Place
+from geography.utils.answerlog import AnswerLog
+import shutil
+import tempfile
+
+
+class AnswerLogTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.user = User.objects.create(username='logged')
+        self.places = [
+            Place.objects.create(code=code, text='?', option_a='a', option_b='b', correct=0, name=str(code))
+            for code in range(4)]
+        self.answers = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def answer(self, place, answer, options, inserted=datetime(2014, 3, 1, 12, 30, 15, 123456)):
+        answer_dict = {
+            'user': self.user.id,
+            'place_asked': place.id,
+            'place_answered': place.id if answer == place.correct else None,
+            'answer': answer,
+            'place_map': self.places[0].id,
+            'type': Answer.PICK_NAME,
+            'response_time': 1234,
+            'number_of_options': len(options),
+            'inserted': inserted,
+            'options': [p.id for p in options],
+        }
+        answer_dict['id'] = Answer.objects._save(answer_dict).id
+        self.answers.append(answer_dict)
+
+    def expected(self, answers):
+        keys = [
+            'id', 'user', 'place_asked', 'place_answered', 'answer', 'place_map',
+            'inserted', 'response_time', 'number_of_options', 'type']
+        return [dict([(k, a[k]) for k in keys] + [('options', sorted(a['options']))]) for a in answers]
+
+    def stored(self, answer_log, since_id=0, batch_size=100000):
+        stored = list(answer_log.iterate(since_id, batch_size))
+        for a in stored:
+            a['options'] = sorted(a['options'])
+        return stored
+
+    def test_round_trip(self):
+        self.answer(self.places[0], 0, [])
+        self.answer(self.places[1], 1, self.places[2:])
+        self.answer(self.places[2], None, self.places[:2])
+        answer_log = AnswerLog(self.dir)
+        self.assertEqual(3, answer_log.update(batch_size=2))
+        for batch_size in [1, 2, 3, 4]:
+            self.assertEqual(self.expected(self.answers), self.stored(answer_log, batch_size=batch_size))
+        self.assertEqual(self.expected(self.answers[1:]), self.stored(answer_log, self.answers[0]['id'], 2))
+        # the log is read from the files again
+        answer_log = AnswerLog(self.dir)
+        self.assertEqual(3, len(answer_log))
+        self.assertEqual(self.answers[-1]['id'], answer_log.last_id)
+        self.assertEqual(self.expected(self.answers), self.stored(answer_log))
+
+    def test_update_appends_new_answers(self):
+        self.answer(self.places[0], 1, self.places[1:2])
+        answer_log = AnswerLog(self.dir)
+        answer_log.update()
+        self.answer(self.places[1], 0, self.places[2:])
+        self.assertEqual(1, answer_log.update())
+        self.assertEqual(0, answer_log.update())
+        self.assertEqual(self.expected(self.answers), self.stored(AnswerLog(self.dir)))
+
+    def test_interrupted_update_is_ignored(self):
+        self.answer(self.places[0], 1, self.places[1:2])
+        answer_log = AnswerLog(self.dir)
+        answer_log.update()
+        # data written without the meta file being replaced
+        for name in ['id', 'options']:
+            with open(answer_log._path(name), 'ab') as f:
+                f.write('\xff' * 64)
+        answer_log = AnswerLog(self.dir)
+        self.assertEqual(self.expected(self.answers), self.stored(answer_log))
+        self.answer(self.places[1], 0, self.places[2:])
+        answer_log.update()
+        self.assertEqual(self.expected(self.answers), self.stored(AnswerLog(self.dir)))
+
+    def test_recent_answers_are_left_for_next_update(self):
+        self.answer(self.places[0], 0, [])
+        self.answer(self.places[1], 1, [], datetime.now())
+        self.answer(self.places[2], 0, [])
+        answer_log = AnswerLog(self.dir)
+        self.assertEqual(1, answer_log.update())
+        self.assertEqual(self.answers[0]['id'], answer_log.last_id)
+        self.assertEqual(self.expected(self.answers[:1]), self.stored(answer_log))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from django.utils import unittest
+from geography.utils import archive
+import gzip
+import StringIO
+import zipfile
+
+
+class ArchiveTest(unittest.TestCase):
+
+    CONTENT = ''.join(['{0},row {0}\n'.format(i) for i in range(10000)])
+
+    def write(self, archive_format, content=CONTENT):
+        output = StringIO.StringIO()
+        compressed = archive.open_archive(output, 'data.csv', archive_format)
+        for i in range(0, len(content), 1000):
+            compressed.write(content[i:i + 1000])
+        compressed.close()
+        output.seek(0)
+        return output
+
+    def read_zip(self, output):
+        with zipfile.ZipFile(output) as z:
+            self.assertEqual(None, z.testzip())
+            self.assertEqual(['data.csv'], z.namelist())
+            return z.read('data.csv'), z.getinfo('data.csv')
+
+    def test_zip(self):
+        content, info = self.read_zip(self.write('zip'))
+        self.assertEqual(ArchiveTest.CONTENT, content)
+        self.assertEqual(len(ArchiveTest.CONTENT), info.file_size)
+        self.assertEqual(zipfile.ZIP_DEFLATED, info.compress_type)
+
+    def test_empty_zip(self):
+        self.assertEqual('', self.read_zip(self.write('zip', ''))[0])
+
+    def test_zip64(self):
+        # sizes and offsets above the limit are stored in Zip64 fields
+        limit = archive.ZIP64_LIMIT
+        archive.ZIP64_LIMIT = 100
+        try:
+            output = self.write('zip')
+        finally:
+            archive.ZIP64_LIMIT = limit
+        self.assertIn('PK\006\006', output.getvalue())
+        content, info = self.read_zip(output)
+        self.assertEqual(ArchiveTest.CONTENT, content)
+        self.assertEqual(len(ArchiveTest.CONTENT), info.file_size)
+
+    def test_gzip(self):
+        with gzip.GzipFile(fileobj=self.write('gzip')) as f:
+            self.assertEqual(ArchiveTest.CONTENT, f.read())
+
+    def test_unknown_format(self):
+        self.assertRaises(Exception, archive.open_archive, StringIO.StringIO(), 'data.csv', 'rar')
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from django.utils import unittest
+from geography.cache import TwoTierCache
+import time
+import uuid
+
+
+class TwoTierCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        # both caches share the same local memory cache, so they behave as
+        # two processes
+        location = 'django.core.cache.backends.locmem.LocMemCache'
+        params = {
+            'OPTIONS': {
+                'LOCAL_TIMEOUT': 60,
+                'SHARED_ONLY_PREFIXES': ['shared_'],
+            },
+        }
+        self.first = TwoTierCache(location, params)
+        self.second = TwoTierCache(location, params)
+        self.first.clear()
+        self.key = uuid.uuid4().hex
+
+    def test_local_hit(self):
+        self.first.set(self.key, [1, 2])
+        self.assertEqual([1, 2], self.second.get(self.key))
+        self.assertEqual([1, 2], self.second.get(self.key))
+        self.assertEqual(1, self.second.stats()['local_hits'])
+
+    def test_local_copy_does_not_outlive_shared_entry(self):
+        self.first.set(self.key, 'value', 1)
+        self.assertEqual('value', self.second.get(self.key))
+        time.sleep(1.1)
+        self.assertIsNone(self.second.get(self.key))
+
+    def test_shared_only_keys_deleted_by_other_process(self):
+        key = 'shared_' + self.key
+        self.first.set(key, 'value')
+        self.assertEqual('value', self.second.get(key))
+        self.first.delete(key)
+        self.assertIsNone(self.second.get(key))
+        self.first.set(key, 'changed')
+        self.assertEqual('changed', self.second.get(key))
+        self.assertEqual(0, self.second.stats()['local_hits'])
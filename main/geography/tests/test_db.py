@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from django.test import TestCase
+from geography.models import Place
+from geography.utils.db import write_query_by_id
+import csv
+import StringIO
+import sys
+
+
+class WriteQueryByIdTest(TestCase):
+
+    QUERY = 'SELECT id, code, name FROM geography_place WHERE id > %s'
+
+    def setUp(self):
+        self.places = [
+            Place.objects.create(code=code, text='?', option_a='a', option_b='b', correct=0, name=u'místo %s' % code)
+            for code in range(6)]
+        self.stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+
+    def write(self, **kwargs):
+        output = StringIO.StringIO()
+        result = write_query_by_id(self.QUERY, output, **kwargs)
+        return result, list(csv.reader(StringIO.StringIO(output.getvalue())))
+
+    def expected_rows(self, places):
+        return [[str(p.id), str(p.code), p.name.encode('utf-8')] for p in places]
+
+    def test_chunk_boundaries(self):
+        for chunk_size in [1, 2, 3, 4, 6, 7]:
+            result, rows = self.write(chunk_size=chunk_size)
+            self.assertEqual((6, self.places[-1].id), result)
+            self.assertEqual(['id', 'code', 'name'], rows[0])
+            self.assertEqual(self.expected_rows(self.places), rows[1:])
+
+    def test_since_id(self):
+        result, rows = self.write(since_id=self.places[3].id, chunk_size=2)
+        self.assertEqual((2, self.places[-1].id), result)
+        self.assertEqual(self.expected_rows(self.places[4:]), rows[1:])
+
+    def test_nothing_to_write(self):
+        result, rows = self.write(since_id=self.places[-1].id, chunk_size=2)
+        self.assertEqual((0, self.places[-1].id), result)
+        self.assertEqual([['id', 'code', 'name']], rows)
+
+    def test_field_mapping(self):
+        result, rows = self.write(code='place_code')
+        self.assertEqual(['id', 'place_code', 'name'], rows[0])
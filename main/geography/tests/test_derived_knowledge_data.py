@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from django.contrib.auth.models import User
+from django.db import DatabaseError, connection
+from django.test import TransactionTestCase
+from django.utils import unittest
+from geography.management.commands.derived_knowledge_data import Command
+from geography.models import Answer, CurrentSkill, InMemoryEnvironmentWithFlush, Place
+import cPickle
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+
+
+class FailingCommand(Command):
+
+    def apply(self, statements):
+        list(statements)
+        raise DatabaseError('statements failed')
+
+
+class DerivedKnowledgeDataTest(TransactionTestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.dir, 'checkpoint')
+        Command().save_checkpoint(self.checkpoint, InMemoryEnvironmentWithFlush(), 0)
+        self.user = User.objects.create(username='answering')
+        self.place = Place.objects.create(code=1, text='?', option_a='a', option_b='b', correct=0, name='1')
+        self.answer(datetime(2014, 3, 1, 12, 30))
+        self.stdout, self.stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO.StringIO(), StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+        shutil.rmtree(self.dir)
+
+    def answer(self, inserted):
+        return Answer.objects._save({
+            'user': self.user.id,
+            'place_asked': self.place.id,
+            'place_answered': self.place.id,
+            'answer': 0,
+            'place_map': self.place.id,
+            'type': Answer.PICK_NAME,
+            'response_time': 1000,
+            'number_of_options': 0,
+            'inserted': inserted,
+        })
+
+    def options(self, **options):
+        defaults = dict([(o.dest, o.default) for o in Command.option_list if o.dest])
+        defaults.update(checkpoint=self.checkpoint, **options)
+        return defaults
+
+    def last_answer_id(self):
+        with open(self.checkpoint, 'rb') as f:
+            return cPickle.load(f)['last_answer_id']
+
+    def test_checkpoint_is_not_saved_when_statements_fail(self):
+        with self.assertRaises(DatabaseError):
+            FailingCommand().handle(**self.options(incremental=True, execute=True))
+        self.assertEqual(0, self.last_answer_id())
+
+    @unittest.skipUnless(connection.vendor == 'mysql', 'the statements are for MySQL')
+    def test_checkpoint_is_saved_after_statements_are_executed(self):
+        Command().handle(**self.options(incremental=True, execute=True))
+        self.assertEqual(Answer.objects.get().id, self.last_answer_id())
+        self.assertEqual(1, CurrentSkill.objects.count())
+
+    def test_checkpoint_is_not_saved_when_statements_are_only_printed(self):
+        Command().handle(**self.options(incremental=True))
+        self.assertEqual(0, self.last_answer_id())
+        self.assertIn('INSERT INTO geography_currentskill', sys.stdout.getvalue())
+
+    def test_recent_answers_are_left_for_next_run(self):
+        settled = Answer.objects.get()
+        self.answer(datetime.now())
+        self.answer(datetime(2014, 3, 1, 12, 31))
+        command = Command()
+        command.answer_log = None
+        replayed = []
+        last_answer_id = command.replay(lambda answer: replayed.append(answer['id']))
+        self.assertEqual([settled.id], replayed)
+        self.assertEqual(settled.id, last_answer_id)
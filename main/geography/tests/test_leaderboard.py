@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import unittest
+from geography.models import UserProfile
+from geography.models.userprofile import Leaderboard, UserProfileManager, _OrderedKeys
+import random
+
+
+class OrderedKeysTest(unittest.TestCase):
+
+    def test_operations_match_sorted_list(self):
+        generator = random.Random(42)
+        expected = sorted(generator.sample(xrange(1000), 200))
+        keys = _OrderedKeys(expected)
+        for i in xrange(2000):
+            key = generator.randrange(1000)
+            if key in expected:
+                expected.remove(key)
+                keys.remove(key)
+            else:
+                insort(expected, key)
+                keys.add(key)
+            if i % 100 == 0:
+                self.assertEqual(len(expected), len(keys))
+                self.assertEqual(expected, [keys.at(j) for j in xrange(len(keys))])
+                for probe in [-1, 0, key, 500, 1000]:
+                    self.assertEqual(bisect_left(expected, probe), keys.count_less(probe))
+
+    def test_at_out_of_range(self):
+        self.assertRaises(IndexError, _OrderedKeys([1, 2]).at, 2)
+        self.assertRaises(IndexError, _OrderedKeys().at, 0)
+
+
+class LeaderboardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.leaderboard = Leaderboard([(1, 'a', 10), (2, 'b', 5), (3, 'c', 10), (4, 'd', 0)])
+
+    def test_top_shares_ranks_of_equal_points(self):
+        self.assertEqual(
+            [(1, 'a', 10), (1, 'c', 10), (3, 'b', 5), (4, 'd', 0)],
+            self.leaderboard.top())
+        self.assertEqual([(1, 'c', 10), (3, 'b', 5)], self.leaderboard.top(1, 2))
+        self.assertEqual([(4, 'd', 0)], self.leaderboard.top(3, 10))
+        self.assertEqual([], self.leaderboard.top(4, 10))
+
+    def test_rank(self):
+        self.assertEqual((1, 10), self.leaderboard.rank(3))
+        self.assertEqual((3, 5), self.leaderboard.rank(2))
+        self.assertEqual(None, self.leaderboard.rank(5))
+
+    def test_changes(self):
+        self.leaderboard.add_points(2, 6)
+        self.assertEqual((1, 11), self.leaderboard.rank(2))
+        self.assertEqual((2, 10), self.leaderboard.rank(1))
+        self.leaderboard.remove(2)
+        self.assertEqual((1, 10), self.leaderboard.rank(1))
+        # unknown users are added only with their username
+        self.leaderboard.update(5, 20)
+        self.assertEqual(None, self.leaderboard.rank(5))
+        self.leaderboard.update(5, 20, 'e')
+        self.assertEqual([(1, 'e', 20)], self.leaderboard.top(0, 1))
+        self.leaderboard.update(5, 0)
+        self.assertEqual([(3, 'd', 0), (3, 'e', 0)], self.leaderboard.top(2))
+        self.assertEqual(4, len(self.leaderboard))
+
+
+class LeaderboardRefreshTest(TestCase):
+
+    def setUp(self):
+        UserProfileManager._leaderboard = None
+        self.users = [User.objects.create(username=name) for name in ['first', 'second']]
+        for user, points in zip(self.users, [3, 5]):
+            UserProfile.objects.create(user=user, points=points)
+
+    def tearDown(self):
+        UserProfileManager._leaderboard = None
+
+    def test_refresh_reads_changed_profiles(self):
+        leaderboard = UserProfile.objects.leaderboard()
+        self.assertEqual((2, 3), leaderboard.rank(self.users[0].id))
+        UserProfile.objects.filter(user=self.users[0]).update(points=7, updated=datetime.now())
+        UserProfile.objects.filter(user=self.users[1]).update(is_lazy=True, updated=datetime.now())
+        # not refreshed yet
+        self.assertEqual((2, 3), UserProfile.objects.leaderboard().rank(self.users[0].id))
+        UserProfileManager._leaderboard = (
+            datetime.now() - timedelta(seconds=UserProfileManager.LEADERBOARD_REFRESH_SECONDS + 1),
+            leaderboard)
+        self.assertIs(leaderboard, UserProfile.objects.leaderboard())
+        self.assertEqual((1, 7), leaderboard.rank(self.users[0].id))
+        self.assertEqual(None, leaderboard.rank(self.users[1].id))
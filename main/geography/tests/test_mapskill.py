@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+from contextlib import closing
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.utils import unittest
+from geography.models import CurrentSkill, InMemoryEnvironmentWithFlush, MapSkillStats, Place, PlaceRelation
+from geography.models.mapskill import LEARNED_SKILL
+
+
+class MapSkillStatsTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='learner')
+        self.map = self.place(1, Place.UNKNOWN)
+        self.places = [self.place(code, Place.UNKNOWN) for code in [2, 3, 4]]
+        self.off_map = self.place(5, Place.UNKNOWN)
+        relation = PlaceRelation.objects.create(place=self.map, type=PlaceRelation.IS_ON_MAP)
+        relation.related_places = self.places
+
+    def place(self, code, place_type):
+        return Place.objects.create(
+            code=code, text='?', option_a='a', option_b='b', correct=0, name=str(code), type=place_type)
+
+    def current_skill(self, place, value):
+        CurrentSkill.objects.create(user=self.user, place=place, value=value)
+
+    def test_update_sql_is_split_to_batches(self):
+        current_skills = [(self.user.id, place.id, 0) for place in self.places]
+        self.assertEqual(2, len(list(MapSkillStats.objects.update_sql(current_skills, 2))))
+        self.assertEqual(0, len(list(MapSkillStats.objects.update_sql([], 2))))
+
+    def test_changes_are_differences_from_stored_current_skills(self):
+        self.current_skill(self.places[0], LEARNED_SKILL - 1)
+        self.current_skill(self.places[1], LEARNED_SKILL - 1)
+        changes = [
+            # practiced -> learned
+            (self.user.id, self.places[0].id, LEARNED_SKILL + 1),
+            # stays practiced
+            (self.user.id, self.places[1].id, LEARNED_SKILL - 2),
+            # new, practiced
+            (self.user.id, self.places[2].id, LEARNED_SKILL - 1),
+            (self.user.id, self.off_map.id, LEARNED_SKILL + 1),
+        ]
+        self.assertEqual([(self.user.id, self.map.id, Place.UNKNOWN, 1, 0)], self.changes(changes))
+        self.current_skill(self.places[2], LEARNED_SKILL + 1)
+        # learned -> practiced
+        self.assertEqual(
+            [(self.user.id, self.map.id, Place.UNKNOWN, -1, 1)],
+            self.changes([(self.user.id, self.places[2].id, LEARNED_SKILL - 2)]))
+        self.assertEqual([], self.changes([(self.user.id, self.places[1].id, LEARNED_SKILL - 3)]))
+
+    @unittest.skipUnless(connection.vendor == 'mysql', 'the statements use MySQL upsert and RENAME TABLE')
+    def test_update_sql_matches_rebuild_sql(self):
+        self.current_skill(self.places[0], LEARNED_SKILL - 1)
+        self.current_skill(self.places[1], LEARNED_SKILL + 1)
+        MapSkillStats.objects.rebuild()
+        changes = [
+            (self.user.id, self.places[0].id, LEARNED_SKILL + 1),
+            (self.user.id, self.places[1].id, LEARNED_SKILL - 1),
+            (self.user.id, self.places[2].id, LEARNED_SKILL + 1),
+        ]
+        with closing(connection.cursor()) as cursor:
+            for sql in MapSkillStats.objects.update_sql(changes):
+                cursor.execute(sql)
+        for user_id, place_id, value in changes:
+            CurrentSkill.objects.filter(user_id=user_id, place_id=place_id).delete()
+            CurrentSkill.objects.create(user_id=user_id, place_id=place_id, value=value)
+        updated = list(MapSkillStats.objects.values_list('user_id', 'place_id', 'type', 'learned', 'practiced'))
+        MapSkillStats.objects.rebuild()
+        self.assertEqual(
+            updated,
+            list(MapSkillStats.objects.values_list('user_id', 'place_id', 'type', 'learned', 'practiced')))
+        self.assertEqual([(self.user.id, self.map.id, Place.UNKNOWN, 2, 1)], updated)
+
+    def test_changed_current_skills(self):
+        env = InMemoryEnvironmentWithFlush()
+        env.current_skill(1, 2, 0.5)
+        env.reset_changes()
+        env.current_skill(1, 3, 0.1)
+        env.current_skill(1, 3, 0.2)
+        self.assertEqual([(1, 3, 0.2)], list(env.changed_current_skills()))
+
+    def changes(self, current_skills):
+        with closing(connection.cursor()) as cursor:
+            cursor.execute(MapSkillStats.objects._changes_sql(current_skills))
+            return [tuple(row) for row in cursor.fetchall()]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from django.utils import unittest
+from geography.models import Place, PlaceRelation
+from geography.models.ab import Value
+from geography.models.place import MapIndex
+from geography.utils.model import Question
+
+
+class QuestionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.place = Place(
+            id=2, code=20, text='Question?', option_a='a', option_b='b', option_c='c', correct=2,
+            name='question', type=Place.TRAFIC_SIGNS)
+        self.map_place = PlaceRelation(place=Place(id=1, code=10), type=PlaceRelation.IS_ON_MAP)
+        self.map_place.place_id = 1
+        self.ab_values = [Value(value='a'), Value(value='b')]
+
+    def question(self, map_index):
+        return Question(self.place, [], self.map_place, self.ab_values, map_index).to_serializable()
+
+    def test_to_serializable(self):
+        self.assertEqual({
+            'type': '23',
+            'text': 'Question?',
+            'asked_code': 20,
+            'map_code': 10,
+            'place': 'question',
+            'ab_values': ['a', 'b'],
+            'options': self.place.options,
+            'points_count': Place.TEST_COMPOSITION[Place.TRAFIC_SIGNS][2],
+        }, self.question(MapIndex('1', {}, {})))
+
+    def test_static_part_is_built_once_per_index(self):
+        map_index = MapIndex('1', {}, {})
+        first = self.question(map_index)
+        self.place.text = 'Changed?'
+        second = self.question(map_index)
+        self.assertEqual('Question?', second['text'])
+        self.assertIs(first['options'], second['options'])
+        # the shared part isn't changed by the per-user fields
+        second['ab_values'].append('c')
+        self.assertEqual(['a', 'b'], self.question(map_index)['ab_values'])
+        self.assertEqual('Changed?', self.question(MapIndex('2', {}, {}))['text'])
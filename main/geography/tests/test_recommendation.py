@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from django.utils import unittest
+from geography.models.recommendation import _top
+import numpy
+import random
+
+
+class TopTest(unittest.TestCase):
+
+    def top(self, scores, n):
+        return _top(numpy.array(scores, dtype=float), n).tolist()
+
+    def test_orders_by_score(self):
+        self.assertEqual([1, 3], self.top([1, 5, 2, 4], 2))
+        self.assertEqual([1, 3, 2, 0], self.top([1, 5, 2, 4], 4))
+        self.assertEqual([1, 3, 2, 0], self.top([1, 5, 2, 4], 10))
+        self.assertEqual([], self.top([], 3))
+
+    def test_ties_are_ordered_by_index(self):
+        self.assertEqual([0, 1, 2], self.top([1, 1, 1, 1], 3))
+        self.assertEqual([2, 0, 3], self.top([3, 1, 5, 3, 3], 3))
+        self.assertEqual([4, 1, 2], self.top([0, 2, 2, 2, 7], 3))
+
+    def test_matches_stable_sort(self):
+        generator = random.Random(7)
+        for i in range(100):
+            scores = [generator.randint(0, 5) for j in range(generator.randint(1, 30))]
+            n = generator.randint(1, 35)
+            expected = sorted(range(len(scores)), key=lambda j: -scores[j])[:n]
+            self.assertEqual(expected, self.top(scores, n))
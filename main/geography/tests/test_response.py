@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils import unittest
+from django.utils.http import http_date
+from geography.utils.response import send_file, _byte_range, _not_modified
+from geography.views.base import csv_view
+import os
+import shutil
+import tempfile
+
+ETAG = '"1-2-3"'
+
+LAST_MODIFIED = http_date(1000)
+
+
+class ByteRangeTest(unittest.TestCase):
+
+    def byte_range(self, header, if_range=None, size=100):
+        meta = {'HTTP_RANGE': header}
+        if if_range is not None:
+            meta['HTTP_IF_RANGE'] = if_range
+        return _byte_range(RequestFactory().get('/', **meta), ETAG, LAST_MODIFIED, size)
+
+    def test_ranges(self):
+        self.assertEqual((0, 9), self.byte_range('bytes=0-9'))
+        self.assertEqual((90, 99), self.byte_range('bytes=90-'))
+        self.assertEqual((90, 99), self.byte_range('bytes=90-1000'))
+        self.assertEqual((99, 99), self.byte_range('bytes=99-99'))
+
+    def test_suffix_ranges(self):
+        self.assertEqual((90, 99), self.byte_range('bytes=-10'))
+        self.assertEqual((0, 99), self.byte_range('bytes=-1000'))
+        self.assertEqual(False, self.byte_range('bytes=-0'))
+
+    def test_unsatisfiable_ranges(self):
+        self.assertEqual(False, self.byte_range('bytes=100-'))
+        self.assertEqual(False, self.byte_range('bytes=10-5'))
+        self.assertEqual(False, self.byte_range('bytes=0-', size=0))
+
+    def test_whole_file(self):
+        self.assertEqual(None, _byte_range(RequestFactory().get('/'), ETAG, LAST_MODIFIED, 100))
+        self.assertEqual(None, self.byte_range('bytes=-'))
+        self.assertEqual(None, self.byte_range('bytes=0-1,5-6'))
+        self.assertEqual(None, self.byte_range('items=0-1'))
+
+    def test_if_range(self):
+        self.assertEqual((0, 9), self.byte_range('bytes=0-9', ETAG))
+        self.assertEqual((0, 9), self.byte_range('bytes=0-9', LAST_MODIFIED))
+        self.assertEqual(None, self.byte_range('bytes=0-9', '"other"'))
+        self.assertEqual(None, self.byte_range('bytes=0-9', http_date(2000)))
+
+
+class NotModifiedTest(unittest.TestCase):
+
+    def not_modified(self, mtime=1000, **meta):
+        return _not_modified(RequestFactory().get('/', **meta), ETAG, mtime)
+
+    def test_if_none_match(self):
+        self.assertTrue(self.not_modified(HTTP_IF_NONE_MATCH=ETAG))
+        self.assertTrue(self.not_modified(HTTP_IF_NONE_MATCH='"other", ' + ETAG))
+        self.assertTrue(self.not_modified(HTTP_IF_NONE_MATCH='*'))
+        self.assertFalse(self.not_modified(HTTP_IF_NONE_MATCH='"other"'))
+        # If-None-Match takes precedence
+        self.assertFalse(self.not_modified(HTTP_IF_NONE_MATCH='"other"', HTTP_IF_MODIFIED_SINCE=LAST_MODIFIED))
+
+    def test_if_modified_since(self):
+        self.assertTrue(self.not_modified(HTTP_IF_MODIFIED_SINCE=LAST_MODIFIED))
+        self.assertTrue(self.not_modified(mtime=1000.5, HTTP_IF_MODIFIED_SINCE=LAST_MODIFIED))
+        self.assertFalse(self.not_modified(mtime=1001, HTTP_IF_MODIFIED_SINCE=LAST_MODIFIED))
+        self.assertFalse(self.not_modified(HTTP_IF_MODIFIED_SINCE='invalid'))
+        self.assertFalse(self.not_modified())
+
+
+@override_settings(SENDFILE_HEADER=None)
+class SendFileTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(content)
+        os.rename(path + '.tmp', path)
+        return path
+
+    def test_etag_changes_when_file_is_replaced(self):
+        path = self.write('export.zip', 'abcd')
+        stat = os.stat(path)
+        etag = send_file(RequestFactory().get('/'), path, 'application/zip', 'export.zip')['ETag']
+        self.write('export.zip', 'efgh')
+        # the same size and modification time
+        os.utime(path, (stat.st_atime, stat.st_mtime))
+        response = send_file(RequestFactory().get('/', HTTP_IF_NONE_MATCH=etag), path, 'application/zip', 'export.zip')
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+        self.assertEqual(304, send_file(
+            RequestFactory().get('/', HTTP_IF_NONE_MATCH=response['ETag']),
+            path, 'application/zip', 'export.zip').status_code)
+
+    def test_content_matches_etag_when_file_is_replaced(self):
+        path = self.write('export.zip', 'abcd')
+        response = send_file(RequestFactory().get('/'), path, 'application/zip', 'export.zip')
+        self.write('export.zip', 'efghij')
+        self.assertEqual('4', response['Content-Length'])
+        self.assertEqual('abcd', ''.join(response.streaming_content))
+
+    def test_range(self):
+        path = self.write('export.zip', 'abcdefgh')
+        response = send_file(RequestFactory().get('/', HTTP_RANGE='bytes=2-4'), path, 'application/zip', 'export.zip')
+        self.assertEqual(206, response.status_code)
+        self.assertEqual('bytes 2-4/8', response['Content-Range'])
+        self.assertEqual('cde', ''.join(response.streaming_content))
+        response = send_file(RequestFactory().get('/', HTTP_RANGE='bytes=8-'), path, 'application/zip', 'export.zip')
+        self.assertEqual(416, response.status_code)
+
+    def test_csv_view_serves_gzip_exports(self):
+        self.write('geography.answer.csv.gz', 'gzipped')
+        request = RequestFactory().get('/', {'format': 'gzip'})
+        request.user = User(username='staff', is_staff=True)
+        with self.settings(MEDIA_ROOT=self.dir):
+            response = csv_view(request, 'answer')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/gzip', response['Content-Type'])
+        self.assertEqual('attachment; filename=geography.answer.csv.gz', response['Content-Disposition'])
+        self.assertEqual('gzipped', ''.join(response.streaming_content))
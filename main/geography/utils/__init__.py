@@ -1,3 +1,3 @@
-from response import JsonResponse
+from response import JsonResponse, send_file
 from file import StaticFiles
 from model import QuestionService
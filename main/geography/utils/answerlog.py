@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+from geography.utils.db import streaming_cursor, iterate_cursor
+import datetime
+import json
+import numpy
+import os
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class AnswerLog:
+
+    """
+    Append-only copy of answers stored by columns. Each column is a file of
+    fixed-width values which can be memory mapped, missing values are stored
+    as the minimal value of the type. Options of the answers are stored in
+    one column, answer i has options from options_offset[i] to
+    options_offset[i + 1].
+
+    The number of stored answers is kept in the meta file which is replaced
+    only after the columns are written, so the log is consistent even when
+    an update is interrupted. Data written after the last update are ignored
+    and overwritten by the next one.
+
+    Answers are appended in the order of their ids and only the last stored
+    id is remembered. An answer whose transaction is committed after an
+    answer with a greater id has been read would be skipped, so answers
+    inserted in the last SETTLE_SECONDS and all the following ones are left
+    for the next update.
+    """
+
+    SETTLE_SECONDS = 60
+
+    COLUMNS = (
+        ('id', numpy.int64),
+        ('user', numpy.int32),
+        ('place_asked', numpy.int32),
+        ('place_answered', numpy.int32),
+        ('answer', numpy.int16),
+        ('place_map', numpy.int32),
+        ('inserted', numpy.int64),
+        ('response_time', numpy.int32),
+        ('number_of_options', numpy.int16),
+        ('type', numpy.int8),
+        ('options_offset', numpy.int64),
+    )
+
+    OPTIONS_TYPE = numpy.int32
+
+    def __init__(self, directory):
+        self._directory = directory
+        meta_file = self._path('meta.json')
+        if os.path.exists(meta_file):
+            with open(meta_file) as f:
+                self._meta = json.load(f)
+        else:
+            self._meta = {'size': 0, 'options_size': 0, 'last_id': 0}
+
+    def __len__(self):
+        return self._meta['size']
+
+    @property
+    def last_id(self):
+        return self._meta['last_id']
+
+    def column(self, name):
+        "Returns the whole column as a read-only memory mapped array"
+        if name == 'options':
+            return self._memmap(name, AnswerLog.OPTIONS_TYPE, self._meta['options_size'])
+        return self._memmap(name, dict(AnswerLog.COLUMNS)[name], self._meta['size'])
+
+    def update(self, batch_size=100000):
+        """
+        Appends answers newer than the last stored one from the database and
+        returns the number of appended answers.
+        """
+        if not os.path.exists(self._directory):
+            os.makedirs(self._directory)
+        self._truncate()
+        settled = datetime.datetime.now() - datetime.timedelta(seconds=AnswerLog.SETTLE_SECONDS)
+        appended = 0
+        with streaming_cursor() as cursor:
+            cursor.execute(
+                '''
+                SELECT
+                    geography_answer.id,
+                    geography_answer.user_id,
+                    geography_answer.place_asked_id,
+                    geography_answer.place_answered_id,
+                    geography_answer.answer,
+                    geography_answer.place_map_id,
+                    geography_answer.inserted,
+                    geography_answer.response_time,
+                    geography_answer.number_of_options,
+                    geography_answer.type,
+                    geography_answer_options.place_id
+                FROM geography_answer
+                LEFT JOIN geography_answer_options
+                    ON geography_answer_options.answer_id = geography_answer.id
+                WHERE geography_answer.id > %s
+                ORDER BY geography_answer.id
+                ''', [self.last_id])
+            columns = dict([(name, []) for (name, dtype) in AnswerLog.COLUMNS])
+            options = []
+            last_id = None
+            for row in iterate_cursor(cursor):
+                if row[0] != last_id:
+                    if row[6] >= settled:
+                        break
+                    if len(columns['id']) >= batch_size:
+                        # the last answer may have more options in the next rows
+                        appended += self._append(columns, options)
+                        columns = dict([(name, []) for (name, dtype) in AnswerLog.COLUMNS])
+                        options = []
+                    last_id = row[0]
+                    for (name, dtype), value in zip(AnswerLog.COLUMNS, row[:10]):
+                        if name == 'inserted':
+                            value = self._to_microseconds(value)
+                        columns[name].append(numpy.iinfo(dtype).min if value is None else value)
+                    columns['options_offset'].append(self._meta['options_size'] + len(options))
+                if row[10] is not None:
+                    options.append(row[10])
+            appended += self._append(columns, options)
+        return appended
+
+    def iterate(self, since_id=0, batch_size=100000):
+        """
+        Yields answers newer than the given one as dictionaries in the same
+        form as they are passed to the answer listeners.
+        """
+        ids = self.column('id')
+        start = numpy.searchsorted(ids, since_id, side='right')
+        columns = [(name, self.column(name)) for (name, dtype) in AnswerLog.COLUMNS]
+        nulls = dict([(name, numpy.iinfo(dtype).min) for (name, dtype) in AnswerLog.COLUMNS])
+        options = self.column('options')
+        for batch_start in xrange(start, len(self), batch_size):
+            batch_end = min(batch_start + batch_size, len(self))
+            batch = dict([(name, c[batch_start:batch_end].tolist()) for (name, c) in columns])
+            options_end = (
+                self.column('options_offset')[batch_end] if batch_end < len(self)
+                else self._meta['options_size'])
+            options_start = batch['options_offset'][0]
+            batch_options = options[options_start:options_end].tolist()
+            offsets = batch['options_offset'] + [options_end]
+            for i in xrange(batch_end - batch_start):
+                answer = {}
+                for name, c in columns:
+                    value = batch[name][i]
+                    answer[name] = None if value == nulls[name] else value
+                del answer['options_offset']
+                answer['inserted'] = EPOCH + datetime.timedelta(microseconds=answer['inserted'])
+                answer['options'] = batch_options[offsets[i] - options_start:offsets[i + 1] - options_start]
+                yield answer
+
+    def _append(self, columns, options):
+        size = len(columns['id'])
+        if size == 0:
+            return 0
+        for name, dtype in AnswerLog.COLUMNS:
+            with open(self._path(name), 'ab') as f:
+                numpy.array(columns[name], dtype=dtype).tofile(f)
+        with open(self._path('options'), 'ab') as f:
+            numpy.array(options, dtype=AnswerLog.OPTIONS_TYPE).tofile(f)
+        meta = {
+            'size': self._meta['size'] + size,
+            'options_size': self._meta['options_size'] + len(options),
+            'last_id': columns['id'][-1],
+        }
+        with open(self._path('meta.json.tmp'), 'w') as f:
+            json.dump(meta, f)
+        os.rename(self._path('meta.json.tmp'), self._path('meta.json'))
+        self._meta = meta
+        return size
+
+    def _truncate(self):
+        # remove data of an interrupted update
+        for name, dtype in AnswerLog.COLUMNS:
+            self._truncate_file(name, numpy.dtype(dtype).itemsize * self._meta['size'])
+        self._truncate_file('options', numpy.dtype(AnswerLog.OPTIONS_TYPE).itemsize * self._meta['options_size'])
+
+    def _truncate_file(self, name, size):
+        path = self._path(name)
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+
+    def _memmap(self, name, dtype, size):
+        if size == 0:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.memmap(self._path(name), dtype=dtype, mode='r', shape=(size,))
+
+    def _path(self, name):
+        return os.path.join(self._directory, name)
+
+    def _to_microseconds(self, value):
+        delta = value - EPOCH
+        return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import gzip
+import struct
+import time
+import zlib
+
+# sizes and offsets above the limit are stored in Zip64 fields, the limit is
+# the same as in the zipfile module for compatibility with signed readers
+ZIP64_LIMIT = (1 << 31) - 1
+
+FORMATS = ('zip', 'gzip')
+
+# extensions and content types of the archives in the given formats
+EXTENSIONS = {
+    'zip': '.zip',
+    'gzip': '.csv.gz',
+}
+
+CONTENT_TYPES = {
+    'zip': 'application/zip',
+    'gzip': 'application/gzip',
+}
+
+
+class ZipStream:
+
+    """
+    Zip archive with a single compressed file whose content is written as a
+    stream, so the uncompressed content isn't stored anywhere. CRC and sizes
+    are written after the content (data descriptor), large files use Zip64
+    extensions.
+    """
+
+    def __init__(self, fileobj, name, date_time=None):
+        self._fileobj = fileobj
+        self._name = name
+        self._date_time = date_time or time.localtime()[:6]
+        self._compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        self._crc = 0
+        self._size = 0
+        self._compressed_size = 0
+        self._offset = 0
+        self._write(struct.pack(
+            '<4s2B4HL2L2H',
+            'PK\003\004', 20, 0, 0x08, zlib.DEFLATED, self._dos_time(), self._dos_date(),
+            0, 0, 0, len(name), 0))
+        self._write(name)
+        self._header_size = self._offset
+
+    def write(self, data):
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        self._write_compressed(self._compressor.compress(data))
+
+    def close(self):
+        self._write_compressed(self._compressor.flush())
+        crc = self._crc & 0xFFFFFFFF
+        zip64 = self._size > ZIP64_LIMIT or self._compressed_size > ZIP64_LIMIT
+        if zip64:
+            self._write(struct.pack('<4sLQQ', 'PK\007\010', crc, self._compressed_size, self._size))
+            extra = struct.pack('<2H2Q', 1, 16, self._size, self._compressed_size)
+            sizes = (0xFFFFFFFF, 0xFFFFFFFF)
+        else:
+            self._write(struct.pack('<4s3L', 'PK\007\010', crc, self._compressed_size, self._size))
+            extra = ''
+            sizes = (self._compressed_size, self._size)
+        version = 45 if zip64 else 20
+        central_offset = self._offset
+        self._write(struct.pack(
+            '<4s4B4HL2L5H2L',
+            'PK\001\002', version, 3, version, 0, 0x08, zlib.DEFLATED,
+            self._dos_time(), self._dos_date(), crc, sizes[0], sizes[1],
+            len(self._name), len(extra), 0, 0, 0, 0644 << 16, 0))
+        self._write(self._name)
+        self._write(extra)
+        central_size = self._offset - central_offset
+        if central_offset > ZIP64_LIMIT:
+            end64_offset = self._offset
+            self._write(struct.pack(
+                '<4sQ2H2L4Q',
+                'PK\006\006', 44, 45, 45, 0, 0, 1, 1, central_size, central_offset))
+            self._write(struct.pack('<4sLQL', 'PK\006\007', 0, end64_offset, 1))
+            central_offset = 0xFFFFFFFF
+        self._write(struct.pack(
+            '<4s4H2LH',
+            'PK\005\006', 0, 0, 1, 1, central_size, central_offset, 0))
+
+    def _write_compressed(self, data):
+        self._compressed_size += len(data)
+        self._write(data)
+
+    def _write(self, data):
+        self._fileobj.write(data)
+        self._offset += len(data)
+
+    def _dos_time(self):
+        return self._date_time[3] << 11 | self._date_time[4] << 5 | self._date_time[5] // 2
+
+    def _dos_date(self):
+        return (self._date_time[0] - 1980) << 9 | self._date_time[1] << 5 | self._date_time[2]
+
+
+def open_archive(fileobj, name, archive_format):
+    """
+    Returns a writable file-like object compressing the content written to
+    it as the file with the given name into the given file object. The
+    returned object has to be closed before the file object.
+    """
+    if archive_format == 'zip':
+        return ZipStream(fileobj, name)
+    elif archive_format == 'gzip':
+        return gzip.GzipFile(filename=name, mode='wb', fileobj=fileobj)
+    else:
+        raise Exception('unknown archive format: ' + archive_format)
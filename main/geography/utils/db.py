@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
+from contextlib import contextmanager
+from django.db import connection
+from contextlib import closing
 import csv
+import sys
 
 
 def dump_cursor(cursor, dest_file, **field_mapping):
@@ -9,6 +13,93 @@ def dump_cursor(cursor, dest_file, **field_mapping):
         writer.writerow(headers)
         row = cursor.fetchone()
         while row:
-            row = [val.encode('utf-8') if isinstance(val, unicode) else val for val in row]
-            writer.writerow(row)
+            writer.writerow(_encode_row(row))
             row = cursor.fetchone()
+
+
+def dump_query_by_id(query, dest_file, **kwargs):
+    """
+    Dumps the result of the given query to the CSV file, see
+    write_query_by_id for the arguments.
+    """
+    with open(dest_file, 'w') as csvfile:
+        return write_query_by_id(query, csvfile, **kwargs)
+
+
+def write_query_by_id(query, csvfile, id_column='id', params=None, since_id=0, chunk_size=10000, label='dumped rows', **field_mapping):
+    """
+    Writes the result of the given query as CSV to the given file-like
+    object in chunks of rows ordered by the id column, each chunk starts
+    after the last id of the previous one (keyset pagination). So each
+    statement reads a bounded number of rows using the index on the id
+    column regardless of the size of the table.
+
+    Args:
+        query: SELECT statement whose WHERE clause begins with the condition
+            '<id column> > %s', ORDER BY and LIMIT are appended
+        id_column: column to paginate by, it has to be unique and selected
+        params: parameters of the query following the last id
+        since_id: only rows with greater ids are dumped
+        label: prefix of the progress reported to stderr
+
+    Returns:
+        the number of dumped rows and the last dumped id (since_id when
+        nothing was dumped)
+    """
+    params = params or []
+    sql = query + ' ORDER BY ' + id_column + ' LIMIT %s'
+    rows_num = 0
+    last_id = since_id
+    writer = csv.writer(csvfile)
+    with closing(connection.cursor()) as cursor:
+        while True:
+            cursor.execute(sql, [last_id] + list(params) + [chunk_size])
+            if rows_num == 0:
+                columns = [col[0] for col in cursor.description]
+                id_index = columns.index(id_column.split('.')[-1])
+                writer.writerow([field_mapping.get(c, c) for c in columns])
+            rows = cursor.fetchall()
+            for row in rows:
+                writer.writerow(_encode_row(row))
+            if len(rows) == 0:
+                break
+            rows_num += len(rows)
+            last_id = rows[-1][id_index]
+            sys.stderr.write('{0}: {1}, last id: {2}\n'.format(label, rows_num, last_id))
+            if len(rows) < chunk_size:
+                break
+    return (rows_num, last_id)
+
+
+def _encode_row(row):
+    return [val.encode('utf-8') if isinstance(val, unicode) else val for val in row]
+
+
+@contextmanager
+def streaming_cursor():
+    """
+    Returns a cursor which doesn't buffer the whole result on the client side
+    (SSCursor on MySQL), so the result can be arbitrary large. No other query
+    can be executed on the same connection until the cursor is closed. Other
+    database backends fall back to the ordinary cursor.
+    """
+    if connection.vendor == 'mysql':
+        # make sure the connection is established
+        connection.cursor().close()
+        import MySQLdb.cursors
+        cursor = connection.connection.cursor(MySQLdb.cursors.SSCursor)
+    else:
+        cursor = connection.cursor()
+    try:
+        yield cursor
+    finally:
+        cursor.close()
+
+
+def iterate_cursor(cursor, batch_size=10000):
+    "Yields rows from a cursor as tuples fetching them in batches"
+    rows = cursor.fetchmany(batch_size)
+    while rows:
+        for row in rows:
+            yield row
+        rows = cursor.fetchmany(batch_size)
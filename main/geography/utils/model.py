@@ -1,27 +1,22 @@
 # -*- coding: utf-8 -*-
-from geography.models import Answer, Place, Value, DatabaseEnvironment
+from geography.models import Answer, Place, Group, RequestEnvironment
+from geography.models.place import PlaceManager
 import logging
 
 LOGGER = logging.getLogger(__name__)
 
 
 class Question():
-    def __init__(self, place, options, map_place, ab_values):
+    def __init__(self, place, options, map_place, ab_values, map_index):
         self.place = place
         self.map_place = map_place
         self.ab_values = ab_values
+        self.map_index = map_index
 
     def to_serializable(self):
-        ret = {
-            'type': '2' + str(len(self.place.options)),
-            'text': self.place.text,
-            'asked_code': self.place.code,
-            'map_code': self.map_place.place.code,
-            'place': self.place.name,
-            'ab_values': [v.value for v in self.ab_values],
-            "options": self.place.options,
-            'points_count': Place.TEST_COMPOSITION[self.place.type][2],
-        }
+        # the part which is the same for all users is built once per index
+        ret = dict(self.map_index.question(self.place, self.map_place))
+        ret['ab_values'] = [v.value for v in self.ab_values]
         return ret
 
 
@@ -40,21 +35,31 @@ class QuestionService:
             self.map_place,
             n,
             place_types,
-            DatabaseEnvironment(),
+            RequestEnvironment(self.user.id),
             self.ab_env,
             strategy_name)
+        map_index = Place.objects.get_map_index()
         return [
             Question(
                 place,
                 options,
                 self.map_place,
-                self.ab_env.get_affecting_values(Place.AB_REASON_RECOMMENDATION)).to_serializable()
+                self.ab_env.get_affecting_values(Place.AB_REASON_RECOMMENDATION),
+                map_index).to_serializable()
             for (place, options) in candidates]
 
     def get_test(self):
-        questions = []
-        for tc in Place.TEST_COMPOSITION:
-            questions += self.get_questions(tc[1], [tc[0]], 'recommendation_by_random')
+        # the options strategy is looked up to keep the affecting A/B values
+        # the same as when the questions are chosen by 'get_questions'
+        self.ab_env.get_membership(
+            PlaceManager.OPTIONS_STRATEGIES.keys(),
+            PlaceManager.DEFAULT_OPTIONS_STRATEGY,
+            Place.AB_REASON_RECOMMENDATION)
+        ab_values = self.ab_env.get_affecting_values(Place.AB_REASON_RECOMMENDATION)
+        map_index = Place.objects.get_map_index()
+        questions = [
+            Question(place, [], self.map_place, ab_values, map_index).to_serializable()
+            for place in Place.objects.get_test(self.map_place.place_id)]
         for q in questions:
             q['isTest'] = True
         return questions
@@ -80,9 +85,9 @@ class QuestionService:
         }
         answer_dict['options'] = []
         if 'ab_values' in a:
-            ab_values = Value.objects.filter(
-                value__in=[v for v in a['ab_values']])
-            answer_dict['ab_values'] = [v.id for v in ab_values]
+            ab_groups = Group.objects.get_ab_groups()
+            ab_values = map(ab_groups.value_id, a['ab_values'])
+            answer_dict['ab_values'] = [v for v in ab_values if v is not None]
         else:
             answer_dict['ab_values'] = []
         Answer.objects.save_with_listeners(answer_dict)
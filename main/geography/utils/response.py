@@ -1,7 +1,14 @@
 # -*- coding: utf-8 -*-
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse, Http404
 from django.utils import simplejson
+from django.utils.http import http_date, parse_http_date_safe
 from django.conf import settings
+import os
+import re
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+CHUNK_SIZE = 64 * 1024
 
 
 class JsonResponse(HttpResponse):
@@ -19,3 +26,114 @@ class JsonResponse(HttpResponse):
             status=status,
             content_type=content_type,
         )
+
+
+def send_file(request, path, content_type, filename):
+    """
+    Returns a response with the given file supporting conditional requests
+    (ETag, Last-Modified) and single byte ranges. When the SENDFILE_HEADER
+    setting is set, the file itself is sent by the front-end server.
+    """
+    # the file is opened first and both its stat and content are read from
+    # the open file, so they match even when the file is replaced meanwhile
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        raise Http404
+    try:
+        response = _file_response(request, f, path, content_type, filename)
+    except:
+        f.close()
+        raise
+    # only the streamed content is read from the file
+    if not response.streaming:
+        f.close()
+    return response
+
+
+def _file_response(request, f, path, content_type, filename):
+    stat = os.fstat(f.fileno())
+    # the inode changes whenever the file is replaced by rename, so the tag
+    # differs even for a file of the same size replaced in the same second
+    etag = '"{0:x}-{1:x}-{2:x}"'.format(stat.st_ino, int(stat.st_mtime * 1000000), stat.st_size)
+    last_modified = http_date(stat.st_mtime)
+    if _not_modified(request, etag, stat.st_mtime):
+        response = HttpResponse(status=304)
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        return response
+    if settings.SENDFILE_HEADER:
+        # the front-end server takes care of ranges itself
+        response = HttpResponse(content_type=content_type)
+        if settings.SENDFILE_HEADER == 'X-Accel-Redirect':
+            response['X-Accel-Redirect'] = settings.SENDFILE_URL_PREFIX + os.path.relpath(path, settings.MEDIA_ROOT)
+        else:
+            response[settings.SENDFILE_HEADER] = path
+    else:
+        byte_range = _byte_range(request, etag, last_modified, stat.st_size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{0}'.format(stat.st_size)
+            return response
+        start, end = byte_range or (0, stat.st_size - 1)
+        # the file is closed by the response
+        response = StreamingHttpResponse(_read_file(f, start, end + 1 - start), content_type=content_type)
+        response['Content-Length'] = str(end + 1 - start)
+        if byte_range:
+            response.status_code = 206
+            response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, end, stat.st_size)
+        response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    response['Content-Disposition'] = 'attachment; filename=' + filename
+    return response
+
+
+def _not_modified(request, etag, mtime):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return if_none_match.strip() == '*' or etag in [e.strip() for e in if_none_match.split(',')]
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(mtime) <= if_modified_since
+
+
+def _byte_range(request, etag, last_modified, size):
+    """
+    Returns the requested range as (first byte, last byte), None when the
+    whole file should be sent or False when the range can't be satisfied.
+    Multiple ranges aren't supported, so the whole file is sent for them.
+    """
+    header = request.META.get('HTTP_RANGE')
+    if header is None:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is not None and if_range.strip() not in (etag, last_modified):
+        return None
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    start, end = match.groups()
+    if start == '' and end == '':
+        return None
+    if start == '':
+        # suffix range, the last given number of bytes
+        length = int(end)
+        if length == 0:
+            return False
+        return (max(size - length, 0), size - 1)
+    start = int(start)
+    end = size - 1 if end == '' else min(int(end), size - 1)
+    if start > end:
+        return False
+    return (start, end)
+
+
+def _read_file(f, start, length):
+    with f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
@@ -2,12 +2,11 @@
 from django.conf import settings
 from django.core.context_processors import csrf
 from django.shortcuts import render_to_response
-from geography.utils import JsonResponse, StaticFiles
+from geography.utils import JsonResponse, StaticFiles, send_file
+from geography.utils.archive import CONTENT_TYPES, EXTENSIONS, FORMATS
 from geography.views import get_user
-from django.http import HttpResponse
 import json
 import os
-from django.core.servers.basehttp import FileWrapper
 
 
 def home(request, hack=None):
@@ -64,8 +63,10 @@ def csv_view(request, model):
     if model not in allowed_models:
         response = {"error": "the requested model '" + model + "' is not valid"}
         return JsonResponse(response)
-    csv_file = "geography." + model + ".zip"
+    archive_format = request.GET.get('format', 'zip')
+    if archive_format not in FORMATS:
+        response = {"error": "the requested format '" + archive_format + "' is not valid"}
+        return JsonResponse(response)
+    csv_file = "geography." + model + EXTENSIONS[archive_format]
     logpath = os.path.join(settings.MEDIA_ROOT, csv_file)
-    response = HttpResponse(FileWrapper(open(logpath)), content_type='application/zip')
-    response['Content-Disposition'] = 'attachment; filename=' + csv_file
-    return response
+    return send_file(request, logpath, CONTENT_TYPES[archive_format], csv_file)
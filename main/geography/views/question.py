@@ -79,14 +79,27 @@ def users_places(request, map_code, user=None):
             raise HttpResponseBadRequest("Invalid username: {0}" % user)
 
     if user == "average":
-        ps = AveragePlace.objects.for_map(map_places)
+        places = [
+            (p.type if hasattr(p, 'type') else p.place.type, p.to_serializable())
+            for p in AveragePlace.objects.for_map(map_places)
+        ]
+        expected_points = expectedPoints(user, map)
     elif request.user.is_authenticated():
-        ps = UserPlace.objects.for_user_and_map_prepared(user, map)
+        summary = UserPlace.objects.summary_for_user_and_map(user, map)
+        map_index = Place.objects.get_map_index()
+        places = []
+        for place_id, skill, has_currentskill in summary['skills']:
+            place = map_index.place(place_id)
+            places.append((place.type, UserPlace.serialize(place, skill, has_currentskill)))
+        expected_points = summary['expected_points']
     else:
-        ps = []
-    ps = list(ps)
+        places = []
+        expected_points = expectedPoints(user, map)
+    places_by_type = {}
+    for place_type, place in places:
+        places_by_type.setdefault(place_type, []).append(place)
     response = {
-        'expectedPoints': expectedPoints(user, map),
+        'expectedPoints': expected_points,
         'name': map.place.name,
         'placesTypes': [
             {
@@ -94,17 +107,14 @@ def users_places(request, map_code, user=None):
                 'slug': Place.PLACE_TYPE_SLUGS_LOWER[place_type[0]],
                 'countInTest': Place.TEST_COMPOSITION[place_type[0]][1],
                 'pointsInTest': Place.TEST_COMPOSITION[place_type[0]][2],
-                'places': [p.to_serializable() for p in ps
-                           if hasattr(p, 'type') and p.type == place_type[0] or
-                           not hasattr(p, 'type') and p.place.type == place_type[0]]
+                'places': places_by_type[place_type[0]],
             } for place_type in Place.PLACE_TYPE_PLURALS
+            if place_type[0] in places_by_type
         ]
     }
-    response['placesTypes'] = [pt for pt in response['placesTypes']
-                               if len(pt['places']) > 0]
     LOGGER.info(
         u"users_places: previewed map '{0}' of user '{1}' with '{2}' places".
-        format(map.place.name, user, len(list(ps))))
+        format(map.place.name, user, len(places)))
     return JsonResponse(response)
 
 
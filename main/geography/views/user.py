@@ -2,13 +2,58 @@
 from geography.utils import JsonResponse
 from django.contrib.auth import logout
 from django.contrib.auth.models import User
+from django.http import HttpResponseBadRequest
+from geography.models import UserProfile
 import geography.models.user
 
+USER_LIST_LIMIT = 100
+
+USER_LIST_MAX_LIMIT = 1000
+
 
 def user_list_view(request):
-    users = User.objects.all()
-    response = [geography.models.user.to_serializable(s) for s in users
-                if not geography.models.user.is_lazy(s)]
+    """
+    Returns a page of non-lazy users ordered by points as a list of
+    {'rank', 'username', 'points'}. The page is given by 'offset' (0 by
+    default) and 'limit' (USER_LIST_LIMIT by default, at most
+    USER_LIST_MAX_LIMIT). Before the leaderboard the view returned all
+    non-lazy users unordered as {'username', 'points'}, so clients reading
+    the whole list have to request the following pages.
+    """
+    try:
+        offset = int(request.GET.get('offset', 0))
+        limit = int(request.GET.get('limit', USER_LIST_LIMIT))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid offset or limit.')
+    if offset < 0 or not 0 < limit <= USER_LIST_MAX_LIMIT:
+        return HttpResponseBadRequest(
+            'The offset can\'t be negative and the limit has to be between 1 and {0}.'.format(USER_LIST_MAX_LIMIT))
+    response = [
+        {
+            'rank': rank,
+            'username': username,
+            'points': points,
+        } for rank, username, points in UserProfile.objects.leaderboard().top(offset, limit)]
+    return JsonResponse(response)
+
+
+def user_rank_view(request, username=None):
+    if not username:
+        user = request.user
+    else:
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            return HttpResponseBadRequest('Invalid username: {0}'.format(username))
+    leaderboard = UserProfile.objects.leaderboard()
+    # lazy users aren't in the leaderboard
+    found = leaderboard.rank(user.id) if user.is_authenticated() else None
+    response = {
+        'username': user.username if found else '',
+        'rank': found[0] if found else None,
+        'points': found[1] if found else 0,
+        'users_num': len(leaderboard),
+    }
     return JsonResponse(response)
 
 
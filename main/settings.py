@@ -9,6 +9,15 @@ if 'DRIVING_SCHOOL_ON_PRODUCTION' in os.environ:
 elif 'DRIVING_SCHOOL_ON_STAGING' in os.environ:
     ON_STAGING = True
 
+# Knowledge updates for the incoming answers are applied by the workers
+# running './manage.py process_answer_queue' instead of during the request.
+ANSWER_QUEUE = 'DRIVING_SCHOOL_ANSWER_QUEUE' in os.environ
+
+# How users are assigned to values of A/B testing groups, 'hash' derives the
+# value from the user id and the group name, 'random' chooses it randomly.
+# Values assigned before are kept in both cases.
+AB_ASSIGNMENT = os.environ.get('DRIVING_SCHOOL_AB_ASSIGNMENT', 'hash')
+
 PROJECT_DIR = os.path.dirname(os.path.realpath(__file__))
 if ON_PRODUCTION:
     DEBUG = False
@@ -79,6 +88,13 @@ USE_L10N = True
 # Example: "/home/media/media.lawrence.com/media/"
 MEDIA_ROOT = os.environ.get('DRIVING_SCHOOL_DATA_DIR', '')
 
+# Files served by the application (e.g. exports) are sent by the front-end
+# server when the header is set, 'X-Sendfile' (Apache mod_xsendfile) gets the
+# path of the file, 'X-Accel-Redirect' (nginx) gets the path relative to
+# MEDIA_ROOT prefixed by the internal location.
+SENDFILE_HEADER = os.environ.get('DRIVING_SCHOOL_SENDFILE_HEADER')
+SENDFILE_URL_PREFIX = os.environ.get('DRIVING_SCHOOL_SENDFILE_URL_PREFIX', '/protected/')
+
 # URL that handles the media served from MEDIA_ROOT. Make sure to use a
 # trailing slash.
 # Examples: "http://media.lawrence.com/media/", "http://example.com/media/"
@@ -267,11 +283,32 @@ ALLOWED_HOSTS = [
     'altest.thran.cz',
 ]
 
+# values used recently are kept in the process in front of the shared cache,
+# the shared cache can be replaced (e.g. by memcached) to be used by more nodes
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-        'LOCATION': os.path.join(MEDIA_ROOT, '.django_cache'),
-    }
+        'BACKEND': 'geography.cache.TwoTierCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'LOCAL_MAX_ENTRIES': 1000,
+            'LOCAL_TIMEOUT': 60,
+            # deleted on every answer or changed by a single process, the
+            # other processes have to see the change at once
+            'SHARED_ONLY_PREFIXES': [
+                'user_profile_',
+                'geography_map_index_version',
+                'geography_ab_groups_version',
+            ],
+        },
+    },
+    'shared': {
+        'BACKEND': os.environ.get(
+            'DRIVING_SCHOOL_CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get(
+            'DRIVING_SCHOOL_CACHE_LOCATION',
+            os.path.join(MEDIA_ROOT, '.django_cache')),
+    },
 }
 
 LOGIN_REDIRECT_URL = '/'
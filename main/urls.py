@@ -26,6 +26,7 @@ urlpatterns = patterns(
     url(r'^question/(?P<map_code>\w+)/(?P<place_type_slug>\w*)', 'geography.views.question', name='question'),
 
     url(r'^user/list/', 'geography.views.user_list_view', name='user_list_view'),
+    url(r'^user/rank/(?P<username>\w*)', 'geography.views.user_rank_view', name='user_rank_view'),
     url(r'^user/logout/', 'geography.views.logout_view', name='logout_view'),
     url(r'^user/', 'geography.views.user_view', name='user_view'),
 
@@ -79,7 +79,7 @@ if [[ `$GIT_COMMAND diff --name-only $LAST_HEAD $DEPLOY_VERSION` ]]; then
 
 	echo " * collect static"
 	$APP_DIR/manage.py collectstatic --noinput
-	echo "HASHES = $( python $APP_DIR/manage.py static_hashes )" > $APP_DIR/hashes.py
+	python $APP_DIR/manage.py static_hashes --output=$APP_DIR/hashes.py --manifest=$APP_DIR/hashes.manifest.json
 
 	echo " * update maps"
 	$APP_DIR/manage.py update_maps
@@ -92,8 +92,8 @@ if [[ `$GIT_COMMAND diff --name-only $LAST_HEAD $DEPLOY_VERSION` ]]; then
 	echo " * derive knowledge data"
 	$APP_DIR/manage.py derived_knowledge_data
 	fi
-	echo " * remove django cache"
-	rm -rf $DATA_DIR/.django_cache
+	echo " * clear django cache"
+	$APP_DIR/manage.py clear_cache
 fi
 
 
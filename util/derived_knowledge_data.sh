@@ -12,13 +12,26 @@ if [ "$GEOGRAPHY_DATA_DIR" ]; then
 else
 	DATA_DIR="$APP_DIR"
 fi
+# with --incremental only answers newer than the last checkpoint are replayed
+# and the changed values are upserted, so the site can stay online
+if [ "$1" == "--incremental" ]; then
+	INCREMENTAL="--incremental"
+fi
+
+
+###############################################################################
+# copy new answers to the answer log while the site is still running
+###############################################################################
+
+echo " * update answer log"
+$APP_DIR/manage.py update_answer_log --dir=$DATA_DIR/answer_log
 
 
 ###############################################################################
 # disable site
 ###############################################################################
 
-if [ $GEOGRAPHY_ON_PRODUCTION ]; then
+if [ $GEOGRAPHY_ON_PRODUCTION ] && [ ! $INCREMENTAL ]; then
 	echo " * disable production"
 	a2ensite maintenance-production.slepemapy.cz
 	a2dissite production.slepemapy.cz
@@ -32,12 +45,17 @@ fi
 
 echo " * derive knowledge data"
 DEST_FILE=$DATA_DIR/derived_knowledge_`date +"%Y-%m-%d_%H-%M-%S"`.sql
-$APP_DIR/manage.py derived_knowledge_data | tee $DEST_FILE | $APP_DIR/manage.py dbshell
+# the statements are executed by the command which saves the checkpoint only
+# after they are committed, the executed statements are kept in DEST_FILE
+$APP_DIR/manage.py derived_knowledge_data $INCREMENTAL --execute --answer-log=$DATA_DIR/answer_log --checkpoint=$DATA_DIR/derived_knowledge_data.checkpoint > $DEST_FILE || exit 1
 
 
 ###############################################################################
 # enable site
 ###############################################################################
+if [ $INCREMENTAL ]; then
+	exit
+fi
 if [ $GEOGRAPHY_ON_PRODUCTION ]; then
 	echo " * enable production"
 	a2dissite maintenance-production.slepemapy.cz
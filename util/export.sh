@@ -13,8 +13,4 @@ else
 	DATA_DIR="$APP_DIR"
 fi
 
-for MODEL in place placerelation answer answer_options answer_ab_values ab_value ab_group placerelation_related_places; do
-	$APP_DIR/manage.py table2csv geography_$MODEL ${DATA_DIR}/geography.$MODEL.csv
-	zip --junk-paths ${DATA_DIR}/geography.$MODEL.zip ${DATA_DIR}/geography.$MODEL.csv
-	rm -rf ${DATA_DIR}/geography.$MODEL.csv
-done
+$APP_DIR/manage.py export_all --dest-dir=${DATA_DIR}